@@ -0,0 +1,118 @@
+# In this module the time series of a power flow run (df_out) are aggregated once into an hourly, daily, weekly and monthly pyramid
+# of sums, means, minima and maxima per column. Each level is reduced from the one below with numpy array reductions, so the
+# dashboard charts and summary metrics read small precomputed tables instead of resampling the full series on every rerun.
+import numpy as np
+import pandas as pd
+
+PERIODS = ['hour', 'day', 'week', 'month']
+STATISTICS = ['sum', 'mean', 'min', 'max']
+_SOURCE = {'hour': None, 'day': 'hour', 'week': 'day', 'month': 'day'} # Level each level is reduced from (None: the timesteps)
+_NS_PER_HOUR = 3600 * 10**9
+_NS_PER_DAY = 24 * _NS_PER_HOUR
+
+
+def _period_codes(period, starts):
+    # Integer code of the period of each time (as int64 nanoseconds). Weeks start on Monday (1970-01-01 is a Thursday)
+    if period == 'hour':
+        return starts // _NS_PER_HOUR
+    days = starts // _NS_PER_DAY
+    if period == 'day':
+        return days
+    if period == 'week':
+        return (days + 3) // 7
+    dates = days.astype('datetime64[D]')
+    return dates.astype('datetime64[M]').astype(np.int64)
+
+
+def _period_starts(period, codes):
+    # First time of each period, from its code
+    if period == 'hour':
+        return pd.DatetimeIndex(codes * _NS_PER_HOUR)
+    if period == 'day':
+        return pd.DatetimeIndex(codes * _NS_PER_DAY)
+    if period == 'week':
+        return pd.DatetimeIndex((codes * 7 - 3) * _NS_PER_DAY)
+    return pd.DatetimeIndex(codes.astype('datetime64[M]').astype('datetime64[ns]'))
+
+
+class AggregatePyramid:
+    """
+    Hourly, daily, weekly and monthly aggregates of the time series of a power flow run.
+
+    The hourly level is reduced from the 15 minute timesteps, the daily level from the hourly one, and the weekly and monthly
+    levels from the daily one, so the full series is read once. Timesteps are grouped by their time, so the repeated hour at the
+    end of summer time falls in one hour and the missing one is absent. Rows without time (NaT) are only part of the total.
+
+    Parameters:
+    df_out (pd.DataFrame): The power flow results with a DatetimeIndex (as in the dashboard), increasing apart from repeated times.
+    """
+
+    def __init__(self, df_out):
+        self.columns = list(df_out.columns)
+        values = df_out.to_numpy(dtype = float)
+        self.total = pd.Series(np.nansum(values, axis = 0), index = self.columns) # As df_out.sum(), also over the rows without time
+        times = np.asarray(df_out.index, dtype = 'datetime64[ns]') # In nanoseconds, whatever the resolution of the index
+        valid = ~np.isnat(times)
+        times = times.view(np.int64)
+        values, times = values[valid], times[valid]
+        order = np.argsort(times, kind = 'stable') # Already in order, except for repeated times
+        values, times = values[order], times[order]
+        self.start = pd.Timestamp(times[0]) if len(times) else pd.NaT
+        self.end = pd.Timestamp(times[-1]) if len(times) else pd.NaT
+
+        present = ~np.isnan(values)
+        timesteps = {'times': times, 'sum': np.where(present, values, 0.0), 'count': present.astype(float), 'min': values, 'max': values}
+        self._levels = {}
+        for period in PERIODS:
+            below = timesteps if _SOURCE[period] is None else self._levels[_SOURCE[period]]
+            codes = _period_codes(period, below['times'])
+            starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) # First row of each period
+            index = _period_starts(period, codes[starts])
+            self._levels[period] = {
+                'index': index,
+                'times': np.asarray(index, dtype = 'datetime64[ns]').view(np.int64),
+                'sum': np.add.reduceat(below['sum'], starts, axis = 0),
+                'count': np.add.reduceat(below['count'], starts, axis = 0),
+                'min': np.fmin.reduceat(below['min'], starts, axis = 0), # NaN values are ignored
+                'max': np.fmax.reduceat(below['max'], starts, axis = 0),
+            }
+
+    def __sizeof__(self):
+        # Memory used by the levels, for the size estimate of results_cache.size_of
+        return sum(array.nbytes for level in self._levels.values() for key, array in level.items() if key != 'index')
+
+    def get(self, period, statistic = 'sum', rows = slice(None)):
+        """
+        Return one statistic of all columns per period.
+
+        Parameters:
+        period (str): 'hour', 'day', 'week' (starting on Monday) or 'month'.
+        statistic (str, optional): 'sum', 'mean', 'min' or 'max'. Defaults to 'sum'. The mean is over the timesteps of the period.
+        rows (slice, optional): The periods to return, by position. Defaults to all.
+
+        Returns:
+        pd.DataFrame: One row per period, indexed by its first time, one column per column of df_out.
+        """
+        level = self._levels[period]
+        if statistic == 'mean':
+            with np.errstate(invalid = 'ignore', divide = 'ignore'): # Periods without values have a NaN mean
+                values = level['sum'][rows] / level['count'][rows]
+        else:
+            values = level[statistic][rows]
+        return pd.DataFrame(values, index = level['index'][rows], columns = self.columns)
+
+    def window(self, period, start, end, statistic = 'mean'):
+        """
+        Return one statistic of the periods starting in a time window.
+
+        Parameters:
+        period (str): See get.
+        start (datetime-like): The first time of the window.
+        end (datetime-like): The end of the window (excluded).
+        statistic (str, optional): See get. Defaults to 'mean'.
+
+        Returns:
+        pd.DataFrame: The rows of get for the window.
+        """
+        index = self._levels[period]['index']
+        return self.get(period, statistic, slice(index.searchsorted(pd.Timestamp(start)), index.searchsorted(pd.Timestamp(end))))
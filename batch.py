@@ -0,0 +1,243 @@
+# In this module the model is run without the dashboard: the power flow and economic calculations of many sites are carried out
+# in parallel from the command line, and their yearly summaries (and optionally their time series) are written to a directory
+#
+# use: python batch.py site_inputs.csv --output results                     runs one site
+#      python batch.py sites/ --profiles Input_profiles.csv --output results  runs every .csv of the directory sites
+#      python batch.py manifest.json --output results --timeseries --workers 8
+#
+# A manifest is a json file {"sites": [{"name": ..., "inputs": ..., "profiles": ...}, ...]} where "name" and "profiles" are optional
+# and the paths are relative to the manifest. Sites without their own profiles use the --profiles file.
+import argparse
+import json
+import os
+import sys
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from powerflow import calculate_power_flow_new, month_periods
+from economic import calculate_costs, generator_hours
+from helpers import pickle_read, read_profiles_binary
+from sweep import prepare_profiles, summarise_scenario
+from export import EXPORT_FORMATS, export_results, pa
+
+SUMMARY_FILE = 'summary' # Written as summary.parquet and summary.csv in the output directory
+TIMESERIES_DIR = 'timeseries' # Directory of the time series in the output directory, one <site>.parquet per site
+OUTPUT_FORMAT = 'parquet' if pa is not None else 'csv' # Format of the time series, CSV when pyarrow is not installed
+
+# Profiles and options of a worker process, set once per worker by _init_worker
+_worker_profiles = None
+_worker_periods = None
+_worker_site_profiles = {} # Profiles of the sites with their own profile file and their month_periods, read once per worker
+_worker_output = None
+_worker_timeseries = False
+
+
+def read_profiles_file(path):
+    """
+    Read profiles from a CSV file (as Input_profiles.csv) or a binary profile file (see helpers.profiles_to_binary).
+
+    Parameters:
+    path (str): The path of the file, with its '.csv' or '.bin' extension.
+
+    Returns:
+    pd.DataFrame: The profiles.
+    """
+    if path.endswith('.bin'):
+        return read_profiles_binary(path[:-len('.bin')])
+    return pd.read_csv(path)
+
+
+def read_site_inputs(path, df_defaults):
+    """
+    Read the inputs of a site from a CSV file in the format of Input_variables.csv. Variables missing from the file keep their
+    default values.
+
+    Parameters:
+    path (str): The path of the CSV file.
+    df_defaults (pd.DataFrame): The default inputs (e.g. Input_variables.pkl, as in the dashboard).
+
+    Returns:
+    pd.DataFrame: The inputs of the site.
+    """
+    df_site = pd.read_csv(path, index_col = 0)
+    unknown = df_site.index.difference(df_defaults.index)
+    if len(unknown):
+        raise ValueError(f"Unknown input variables in {path}: {', '.join(unknown)}")
+    df_input = df_defaults.copy()
+    df_input.loc[df_site.index, 'Value'] = df_site['Value']
+    return df_input
+
+
+def find_sites(inputs):
+    """
+    List the sites of a batch run.
+
+    Parameters:
+    inputs (str): A CSV file of inputs, a directory of CSV files of inputs or a json manifest (see the top of this module).
+
+    Returns:
+    list: One dict per site with its 'name', 'inputs' file and 'profiles' file (None for the common profiles).
+    """
+    if os.path.isdir(inputs):
+        files = sorted(name for name in os.listdir(inputs) if name.endswith('.csv'))
+        sites = [{'name': name[:-len('.csv')], 'inputs': os.path.join(inputs, name), 'profiles': None} for name in files]
+    elif inputs.endswith('.json'):
+        with open(inputs) as file:
+            manifest = json.load(file)
+        directory = os.path.dirname(inputs)
+        sites = []
+        for entry in manifest['sites']:
+            profiles = entry.get('profiles')
+            sites.append({
+                'name': entry.get('name', os.path.splitext(os.path.basename(entry['inputs']))[0]),
+                'inputs': os.path.join(directory, entry['inputs']),
+                'profiles': os.path.join(directory, profiles) if profiles else None,
+            })
+    else:
+        sites = [{'name': os.path.splitext(os.path.basename(inputs))[0], 'inputs': inputs, 'profiles': None}]
+    names = [site['name'] for site in sites]
+    duplicated = sorted({name for name in names if names.count(name) > 1})
+    if duplicated:
+        raise ValueError(f"Several sites named {', '.join(duplicated)}")
+    return sites
+
+
+def run_site(df_input, df_profiles, name, output_dir = None, timeseries = False, periods = None):
+    """
+    Run the power flow and the economic calculations of a site.
+
+    Parameters:
+    df_input (pd.DataFrame): The inputs of the site.
+    df_profiles (pd.DataFrame or ProfileHandle): The profiles of the site.
+    name (str): The name of the site, used for its time series file.
+    output_dir (str, optional): The output directory of the run. Defaults to None.
+    timeseries (bool, optional): Whether the time series (df_out with the 'Time' of the profiles) is written to
+        output_dir/timeseries/<name>.parquet (.csv without pyarrow, see OUTPUT_FORMAT). Defaults to False.
+    periods (tuple, optional): powerflow.month_periods of df_profiles, computed if not given.
+
+    Returns:
+    dict: The yearly summary of the site, see sweep.summarise_scenario.
+    """
+    if timeseries: # The power flow runs once, its summary is reduced from df_out
+        df_out = calculate_power_flow_new(df_input, df_profiles)
+        df_in = df_input['Value']
+        power_flow_summary = {
+            'annual': df_out.sum()/4000, # As the 'annual' record of output = 'summary'
+            'gen_hours': generator_hours(df_out['gen_production'], [df_in['gen1_capacity'], df_in['gen2_capacity'], df_in['gen3_capacity']]),
+            'shortage_hours': (df_out['shortage_consumption'] > 0).sum() * 0.25,
+        }
+        df_out.insert(0, 'Time', df_profiles['Time'].to_numpy())
+        export_results(df_out, os.path.join(output_dir, TIMESERIES_DIR, name + EXPORT_FORMATS[OUTPUT_FORMAT])) # zstd compressed Parquet
+    else:
+        power_flow_summary = calculate_power_flow_new(df_input, df_profiles, output = 'summary', periods = periods)
+    return summarise_scenario(df_input, power_flow_summary, calculate_costs(df_input, power_flow_summary))
+
+
+def _init_worker(profiles, output_dir, timeseries):
+    # Keep the common profiles (see sweep._init_worker) and the options in the worker for all its sites
+    global _worker_profiles, _worker_periods, _worker_site_profiles, _worker_output, _worker_timeseries
+    if isinstance(profiles, str):
+        _worker_profiles = read_profiles_binary(profiles)
+    elif isinstance(profiles, dict):
+        _worker_profiles = pd.DataFrame(profiles)
+    else:
+        _worker_profiles = profiles
+    _worker_periods = month_periods(_worker_profiles) # Months of the timesteps, found once for all the sites
+    _worker_site_profiles = {}
+    _worker_output = output_dir
+    _worker_timeseries = timeseries
+
+
+def _run_worker_site(task):
+    # Run one site in a worker. Errors are returned with the site instead of stopping the whole batch
+    site, df_input = task
+    start = time.perf_counter()
+    try:
+        if site['profiles'] is None:
+            df_profiles, periods = _worker_profiles, _worker_periods
+        else:
+            if site['profiles'] not in _worker_site_profiles:
+                df_site_profiles, _ = prepare_profiles(read_profiles_file(site['profiles']))
+                _worker_site_profiles[site['profiles']] = df_site_profiles, month_periods(df_site_profiles)
+            df_profiles, periods = _worker_site_profiles[site['profiles']]
+        summary = run_site(df_input, df_profiles, site['name'], _worker_output, _worker_timeseries, periods)
+        error = None
+    except Exception as exception:
+        summary, error = {}, f'{type(exception).__name__}: {exception}'
+    return {'site': site['name'], 'inputs': site['inputs'], 'profiles': site['profiles'], **summary,
+            'error': error, 'seconds': time.perf_counter() - start}
+
+
+def run_batch(inputs, profiles, output_dir, df_defaults = None, workers = None, timeseries = False):
+    """
+    Run the power flow and the economic calculations of all the sites of a batch, in parallel, and write their summaries.
+
+    Parameters:
+    inputs (str): A CSV file of inputs, a directory of CSV files of inputs or a json manifest, see find_sites.
+    profiles (str): The common profiles file (CSV or binary), used by the sites without their own profiles.
+    output_dir (str): The output directory. It gets summary.parquet and summary.csv (only summary.csv without pyarrow), and the 
+        time series if requested.
+    df_defaults (pd.DataFrame, optional): The default inputs. Defaults to Input_variables.pkl, as in the dashboard.
+    workers (int, optional): Number of worker processes. Defaults to the number of cores. With 1 the sites run in this process.
+    timeseries (bool, optional): Whether the time series of each site is written too. Defaults to False.
+
+    Returns:
+    pd.DataFrame: One row per site with its name, files, yearly summary (see sweep.summarise_scenario), error (None if the
+        site ran) and run time in seconds.
+    """
+    df_defaults = pickle_read('Input_variables') if df_defaults is None else df_defaults
+    sites = find_sites(inputs)
+    tasks = []
+    rows = []
+    for site in sites: # Inputs are read here, so that wrong files are reported before any calculation
+        try:
+            tasks.append((site, read_site_inputs(site['inputs'], df_defaults)))
+        except Exception as error:
+            rows.append({'site': site['name'], 'inputs': site['inputs'], 'profiles': site['profiles'], 'error': str(error), 'seconds': 0.0})
+
+    os.makedirs(os.path.join(output_dir, TIMESERIES_DIR) if timeseries else output_dir, exist_ok = True)
+    if OUTPUT_FORMAT != 'parquet':
+        warnings.warn("pyarrow is not installed: the summary and the time series are only written as CSV files")
+    # A binary profile file is memory-mapped by every worker, CSV profiles are read once here and sent to the workers
+    df_profiles, payload = prepare_profiles(profiles[:-len('.bin')] if profiles.endswith('.bin') else read_profiles_file(profiles))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers == 1 or len(tasks) <= 1:
+        _init_worker(df_profiles, output_dir, timeseries)
+        rows += [_run_worker_site(task) for task in tasks]
+    else:
+        chunksize = max(1, len(tasks) // (workers * 4)) # A few chunks per worker to balance the load
+        with ProcessPoolExecutor(max_workers = workers, initializer = _init_worker, initargs = (payload, output_dir, timeseries)) as executor:
+            rows += list(executor.map(_run_worker_site, tasks, chunksize = chunksize))
+
+    order = {site['name']: k for k, site in enumerate(sites)}
+    df_summary = pd.DataFrame(rows).sort_values('site', key = lambda names: names.map(order), ignore_index = True)
+    if OUTPUT_FORMAT == 'parquet':
+        df_summary.to_parquet(os.path.join(output_dir, SUMMARY_FILE + '.parquet'), index = False)
+    df_summary.to_csv(os.path.join(output_dir, SUMMARY_FILE + '.csv'), index = False)
+    return df_summary
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = "Run the power flow and economic calculations of many sites without the dashboard")
+    parser.add_argument('inputs', help = "CSV file of inputs (as Input_variables.csv), directory of CSV files or json manifest")
+    parser.add_argument('--profiles', default = 'Input_profiles.csv', help = "profiles file (.csv or .bin) of the sites without their own")
+    parser.add_argument('--output', required = True, help = "output directory")
+    parser.add_argument('--defaults', help = "CSV file of default inputs (default: Input_variables.pkl)")
+    parser.add_argument('--workers', type = int, help = "worker processes (default: number of cores)")
+    parser.add_argument('--timeseries', action = 'store_true', help = "also write the time series of each site")
+    args = parser.parse_args(args)
+
+    df_defaults = pd.read_csv(args.defaults, index_col = 0) if args.defaults else None
+    start = time.perf_counter()
+    df_summary = run_batch(args.inputs, args.profiles, args.output, df_defaults, args.workers, args.timeseries)
+    failed = df_summary[df_summary['error'].notna()]
+    print(f"{len(df_summary) - len(failed)} of {len(df_summary)} sites run in {time.perf_counter() - start:.1f} s, results in {args.output}")
+    for _, row in failed.iterrows():
+        print(f"{row['site']}: {row['error']}")
+    return 1 if len(failed) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
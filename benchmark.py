@@ -0,0 +1,194 @@
+# In this module the run times of the power flow, economic and dashboard data paths are measured and compared with a stored baseline
+#
+# use: python benchmark.py                      runs all the benchmarks, saves benchmark_results.json and compares with benchmark_baseline.json
+#      python benchmark.py --quick              runs a reduced set of cases
+#      python benchmark.py --update-baseline    stores the results as the new baseline
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+import pandas as pd
+from powerflow import calculate_power_flow_new, calculate_power_flow_old, month_periods, njit
+from economic import calculate_costs, generator_hours
+from helpers import read_from_csv, pickle_read, read_profiles_binary
+from aggregates import AggregatePyramid
+from timegrid import TimeGrid
+from cases import benchmark_input, GRID_TYPES
+
+BASELINE_FILE = 'benchmark_baseline.json'
+RESULTS_FILE = 'benchmark_results.json'
+
+# Parameters of the power flow cases: profile length in timesteps, number of generators and grid charging type
+PROFILE_LENGTHS = [2976, 35136] # One month and one year of quarter-hours
+NUMBER_GENERATORS = [0, 1, 3] # Grid types and capacities of the generators: see cases.py
+
+
+def dashboard_date_range(df_out, start_date, end_date, frequency = '15T', time_grid = None):
+    # Selection of the days shown in the power flow chart of the dashboard, as done there: with the time grid of the profiles
+    # (built once per profiles) the window is a slice, without it the days are looked up one by one as before
+    if time_grid is not None:
+        return time_grid.slice(df_out, start_date, end_date).resample(frequency).mean()
+    df_out = df_out[~df_out.index.duplicated(keep='first')]
+    date_range = [dat.strftime('%Y, %m, %d') for dat in pd.date_range(start=start_date, end=end_date)]
+    df_day = pd.concat([df_out.loc[dates] for dates in date_range])
+    return df_day.resample(frequency).mean()
+
+
+def time_call(function, repeats):
+    """
+    Time a function, silencing its printed output.
+
+    Parameters:
+    function (callable): Function without arguments.
+    repeats (int): Number of timed calls.
+
+    Returns:
+    dict: 'min' and 'median' run time in seconds and the number of 'repeats'.
+    """
+    times = []
+    for _ in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': float(np.median(times)), 'repeats': repeats}
+
+
+def run_benchmarks(quick = False, repeats = 5, slow_repeats = 1):
+    """
+    Run all the benchmarks on the shipped Input_profiles and test_inputs_typeB.csv.
+
+    Parameters:
+    quick (bool, optional): Only run the one month profiles and the slow python loops once per grid type. Defaults to False.
+    repeats (int, optional): Number of timed calls of the fast functions. Defaults to 5.
+    slow_repeats (int, optional): Number of timed calls of the step by step python loops (engine 'python' and calculate_power_flow_old). Defaults to 1.
+
+    Returns:
+    dict: 'environment' (versions of python and the libraries) and 'results' (timings by benchmark name).
+    """
+    df_input = read_from_csv('test_inputs_typeB')
+    df_profiles = pd.read_csv('Input_profiles.csv')
+    time_index = pd.to_datetime(df_profiles['Time'])
+    results = {}
+
+    # Power flow engines and economic calculations
+    with contextlib.redirect_stdout(io.StringIO()):
+        calculate_power_flow_new(df_input, df_profiles.iloc[:96]) # Compiling the kernel before timing it
+    for length in PROFILE_LENGTHS[:1] if quick else PROFILE_LENGTHS:
+        df_case_profiles = df_profiles.iloc[:length]
+        periods = month_periods(df_case_profiles) # Once per profiles, as in sweeps
+        for number_generators in NUMBER_GENERATORS:
+            for grid_type in GRID_TYPES:
+                case = f'{length}steps_{number_generators}gen_type{grid_type}'
+                df_case = benchmark_input(df_input, number_generators, grid_type)
+                results[f'power_flow_new/{case}'] = time_call(lambda: calculate_power_flow_new(df_case, df_case_profiles), repeats)
+                results[f'power_flow_summary/{case}'] = time_call(lambda: calculate_power_flow_new(df_case, df_case_profiles, output = 'summary', periods = periods), repeats)
+                if not quick or number_generators == NUMBER_GENERATORS[0]:
+                    results[f'power_flow_python/{case}'] = time_call(lambda: calculate_power_flow_new(df_case, df_case_profiles, engine = 'python'), slow_repeats)
+                    results[f'power_flow_old/{case}'] = time_call(lambda: calculate_power_flow_old(df_case, df_case_profiles), slow_repeats)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    df_out = calculate_power_flow_new(df_case, df_case_profiles)
+                gen_capacity = np.array([df_case.loc[f'gen{k}_capacity', 'Value'] for k in range(1, 4)])
+                results[f'calculate_costs/{case}'] = time_call(lambda: calculate_costs(df_case, df_out), repeats)
+                results[f'generator_hours/{case}'] = time_call(lambda: generator_hours(df_out['gen_production'].to_numpy(), gen_capacity), repeats)
+
+    # Profile loaders
+    results['read_profiles/csv'] = time_call(lambda: read_from_csv('Input_profiles'), repeats)
+    results['read_profiles/csv_parse_time'] = time_call(lambda: pd.to_datetime(pd.read_csv('Input_profiles.csv')['Time']), repeats)
+    results['read_profiles/pickle'] = time_call(lambda: pickle_read('Input_profiles'), repeats)
+    if os.path.exists('Input_profiles.bin'):
+        results['read_profiles/binary'] = time_call(lambda: read_profiles_binary('Input_profiles'), repeats)
+
+    # Dashboard data paths on the yearly results
+    with contextlib.redirect_stdout(io.StringIO()):
+        df_out = calculate_power_flow_new(df_input, df_profiles)
+    df_out = df_out.set_index(time_index)
+    results['dashboard/sum'] = time_call(lambda: df_out.sum()/4000, repeats)
+    results['dashboard/resample_monthly'] = time_call(lambda: df_out.resample('M').sum()/4000, repeats)
+    results['dashboard/daily_slice'] = time_call(lambda: df_out.loc['2020, 05, 05'].resample('H').mean(), repeats)
+    results['dashboard/date_range_slice'] = time_call(lambda: dashboard_date_range(df_out, '2020-03-10', '2020-03-12'), repeats)
+    time_grid = TimeGrid(time_index)
+    df_shown = time_grid.select(df_out)
+    results['dashboard/date_range_slice_grid'] = time_call(lambda: dashboard_date_range(df_shown, '2020-03-10', '2020-03-12', time_grid = time_grid), repeats)
+    results['dashboard/date_range_year_grid'] = time_call(lambda: dashboard_date_range(df_shown, '2020-01-01', '2020-12-31', time_grid = time_grid), repeats)
+    results['dashboard/aggregates'] = time_call(lambda: AggregatePyramid(df_out), repeats) # Built once per power flow, replaces the resamples above
+    aggregates = AggregatePyramid(df_out)
+    results['dashboard/aggregates_daily_slice'] = time_call(lambda: aggregates.window('hour', '2020-05-05', '2020-05-06'), repeats)
+
+    environment = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'numba': sys.modules['numba'].__version__ if njit is not None else None,
+    }
+    return {'environment': environment, 'results': results}
+
+
+def compare_benchmarks(results, baseline, tolerance = 0.25, min_seconds = 0.001):
+    """
+    Compare benchmark results with a baseline.
+
+    Parameters:
+    results (dict): The benchmark results, see run_benchmarks.
+    baseline (dict): The baseline results, in the same format.
+    tolerance (float, optional): Relative slow down of the median run time above which a benchmark is a regression. Defaults to 0.25.
+    min_seconds (float, optional): Slow downs smaller than this are not regressions, as timings of very fast calls are noisy. Defaults to 1 ms.
+
+    Returns:
+    pd.DataFrame: One row per benchmark present in both, with the baseline and current median run times in seconds, their
+        ratio and whether it is a regression.
+    """
+    rows = []
+    for name, timing in results['results'].items():
+        if name in baseline['results']:
+            reference = baseline['results'][name]['median']
+            rows.append({'benchmark': name, 'baseline': reference, 'current': timing['median'],
+                         'ratio': timing['median'] / reference if reference > 0 else np.inf})
+    df_comparison = pd.DataFrame(rows, columns = ['benchmark', 'baseline', 'current', 'ratio'])
+    df_comparison['regression'] = (df_comparison['ratio'] > 1 + tolerance) & (df_comparison['current'] - df_comparison['baseline'] > min_seconds)
+    return df_comparison
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = "Benchmark the power flow, economic and dashboard data paths")
+    parser.add_argument('--quick', action = 'store_true', help = "run a reduced set of cases")
+    parser.add_argument('--repeats', type = int, default = 5, help = "timed calls of each fast benchmark")
+    parser.add_argument('--output', default = RESULTS_FILE, help = "file of the results")
+    parser.add_argument('--baseline', default = BASELINE_FILE, help = "file of the baseline")
+    parser.add_argument('--tolerance', type = float, default = 0.25, help = "relative slow down reported as a regression")
+    parser.add_argument('--update-baseline', action = 'store_true', help = "store the results as the baseline")
+    args = parser.parse_args(args)
+
+    results = run_benchmarks(quick = args.quick, repeats = args.repeats)
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent = 1)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent = 1)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline {args.baseline}, results saved to {args.output}")
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    df_comparison = compare_benchmarks(results, baseline, args.tolerance)
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(df_comparison.to_string(index = False, float_format = '{:.4f}'.format))
+    regressions = df_comparison[df_comparison['regression']]
+    if len(regressions):
+        print(f"{len(regressions)} regressions above {args.tolerance:.0%}: {', '.join(regressions['benchmark'])}")
+        return 1
+    print("No regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,23 @@
+# In this module the input cases shared by the benchmarks and the golden corpus are built from the base inputs (test_inputs_typeB.csv)
+GRID_TYPES = {'A': 0.3, 'B': 0.0} # grid_soc_trigger: type A charges the battery from the grid below 30%, type B never does
+GENERATOR_CAPACITY = 100 # kW, capacity of each generator of the cases
+
+
+def benchmark_input(df_input, number_generators, grid_type):
+    """
+    Create the inputs of a case from the base inputs.
+
+    Parameters:
+    df_input (pd.DataFrame): The base input DataFrame (test_inputs_typeB.csv).
+    number_generators (int): Number of generators of GENERATOR_CAPACITY kW.
+    grid_type (str): 'A' or 'B', see GRID_TYPES.
+
+    Returns:
+    pd.DataFrame: The inputs of the case.
+    """
+    df_case = df_input.copy()
+    df_case.loc['number_generators', 'Value'] = number_generators
+    for k in range(1, 4):
+        df_case.loc[f'gen{k}_capacity', 'Value'] = GENERATOR_CAPACITY if k <= number_generators else 0
+    df_case.loc['grid_soc_trigger', 'Value'] = GRID_TYPES[grid_type]
+    return df_case
@@ -6,6 +6,15 @@ import csv
 from helpers import * # Helper functions 
 from powerflow import * # Function to carry power flow calculations
 from economic import * # Functions to carry economical calcualtions
+from results_cache import ResultsCache, ResultStore, hash_inputs, hash_profiles # Cache of the calculation results
+from profile_library import ProfileLibrary # Library of site profiles
+from pareto import explore_pareto # Pareto front of cost, renewable fraction, diesel use and curtailment
+from sweep import sweep_grid # Scenarios of the trade-offs
+from instrumentation import start_recording, stop_recording, stage, begin_stage, end_stage # Timings of the stages of a run
+from downsampling import ResolutionPyramid # Reduction of the time series to the points the charts can show
+from aggregates import AggregatePyramid # Hourly, daily, weekly and monthly aggregates of the power flow
+from timegrid import TimeGrid # Row positions of the days of the profiles
+from export import EXPORT_FORMATS, export_bytes # Parquet, Arrow IPC and CSV files of the results
 import numpy as np
 import warnings
 import plotly.graph_objects as go
@@ -16,6 +25,13 @@ import time
 import math 
 
 start_time = time.time() # Starting timer
+
+# Timings of the stages of this run, when the "Show timings" toggle is on or DASHBOARD_INSTRUMENTATION is set ('trace' also records 
+# the trace events of the power flow). Without them the stages cost nothing
+instrumentation = os.environ.get('DASHBOARD_INSTRUMENTATION', '')
+stop_recording() # A run interrupted by a rerun leaves its recorder behind
+if instrumentation or st.session_state.get('show_timings', False):
+    start_recording(trace = instrumentation == 'trace')
  
 #%% ---------------------------- USEFUL FUNCTIONS ----------------------------------
 def numeric_user_input(df_input, variable, value_type = int, max_val = None, min_val = 0): 
@@ -191,7 +207,7 @@ def plot_day_chart(settings, df_day):
     for j, row in enumerate(settings):
           # Add a trace (line) to the chart for each data series
         fig.add_trace(go.Scatter(
-            x=df_day.index,      # X-axis: Months
+            x=df_day[row[0]].index,      # X-axis: Time, of each trace as the reduced traces do not share it
             y=df_day[row[0]],   # Y-axis: Data from the specified column
             mode='lines',         # Plot as lines
             line=dict(color=row[2]),  # Set the line color
@@ -282,7 +298,7 @@ def plot_day_chart_area(settings_consumption, settings_pv, settings_line, df_day
 def plot_soc(df_day):
     fig = go.Figure()
     fig.add_trace(go.Scatter(
-        x=df_day.index,
+        x=df_day['batt_soc_energy'].index,
         y = df_day['batt_soc_energy'],
         mode = 'lines',
         line = dict(color = "#0FACD1")    
@@ -298,6 +314,92 @@ def plot_soc(df_day):
     )
     
     return fig 
+
+def plot_pareto_front(df_front): 
+    """
+    Create a scatter chart of a Pareto front: yearly net cost against renewable fraction, coloured by diesel use.
+
+    Parameters:
+    df_front (pd.DataFrame): The front, see pareto.ParetoFront.to_dataframe.
+
+    Returns:
+    go.Figure: A Plotly figure of the front, with the sizes of each design shown on hover.
+    """
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x = df_front['net_cost'],
+        y = df_front['renewable_fraction'] * 100,
+        mode = 'markers',
+        marker = dict(size = 10, color = df_front['diesel'], colorscale = 'Greys', showscale = True, colorbar = dict(title = 'Diesel')),
+        customdata = df_front[['pv_capacity', 'batt_energy_capacity', 'number_generators', 'curtailment']],
+        hovertemplate = 'PV %{customdata[0]:.0f} kWp<br>Battery %{customdata[1]:.0f} kWh<br>Generators %{customdata[2]:.0f}<br>Curtailment %{customdata[3]:.0f} MWh<extra></extra>',
+    ))
+    
+    fig.update_layout(
+        xaxis_title="Yearly net cost (EUR)", 
+        yaxis_title="Renewable fraction (%)",
+        margin=dict(b=100, t=0),  # Adjust chart margin (bottom and top)
+    )
+    
+    return fig 
+
+
+@st.cache_resource
+def get_profile_library(): 
+    """
+    Open the profile library shared by all sessions, in the directory PROFILE_LIBRARY_DIR (default 'profile_library').
+
+    Returns:
+    ProfileLibrary or None: The library, or None if there is no library directory.
+    """
+    directory = os.environ.get('PROFILE_LIBRARY_DIR', 'profile_library')
+    return ProfileLibrary(directory) if os.path.isdir(directory) else None
+
+
+@st.cache_data
+def read_profiles_csv(filename): 
+    """
+    Read the consumption and production profiles from CSV and parse their times. The file is only read once for all reruns.
+
+    Parameters:
+    filename (str): The name of the CSV file with the profiles (without the '.csv' extension).
+
+    Returns:
+    tuple: The DataFrame df_profiles and the time index of the profiles.
+    """
+    df_profiles = pd.read_csv(filename + '.csv')
+    with stage('profiles/to_datetime'):
+        time_index = pd.to_datetime(df_profiles['Time'])
+    return df_profiles, time_index
+
+def read_profiles(filename): 
+    """
+    Read the consumption and production profiles from the binary file (see helpers.profiles_to_binary), which is memory-mapped
+    without any parsing. It is written again when the CSV file has changed (see helpers.update_profiles_binary), and the CSV 
+    file is read when it cannot be written.
+
+    Parameters:
+    filename (str): The name of the profiles file (without extension).
+
+    Returns:
+    tuple: The DataFrame df_profiles and the time index of the profiles.
+    """
+    if update_profiles_binary(filename):
+        df_profiles = read_profiles_binary(filename)
+        return df_profiles, df_profiles['Time']
+    return read_profiles_csv(filename)
+
+@st.cache_resource
+def get_results_cache(): 
+    """
+    Results cache shared by all reruns and sessions of the dashboard server, so that chart interactions do not recompute results.
+    Results are also kept on disk in the directory RESULTS_STORE_DIR (default 'results_store'), shared with other replicas and sweeps.
+
+    Returns:
+    ResultsCache: The shared cache, keyed on the content of the inputs and profiles.
+    """
+    store = ResultStore(os.environ.get('RESULTS_STORE_DIR', 'results_store'))
+    return ResultsCache(max_entries = 64, max_bytes = 1024 * 2**20, store = store)
                 
 
 #%% -------------- PRSONALIZE THEME ------------------------------
@@ -338,17 +440,29 @@ if uploaded_file is not None:
     # Read the uploaded CSV file into a DataFrame
     df_input = load_inputs_from_csv(df_input, uploaded_file) # Overwriting the input rows of the uploaded inputs in df_input
         
-# Read consumption and production profiles 
-df_profiles = pd.read_csv('Input_profiles.csv')
-
-# Access the data series from the DataFrame
-time_index = pd.to_datetime(df_profiles['Time']) 
+# Read consumption and production profiles and access the time series (a fresh DataFrame at every rerun)
+with stage('profiles/load'):
+    df_profiles, time_index = read_profiles('Input_profiles')
 
 #%% ------------ IMPORT INPUT FROM SIDEBAR -------------------------
+begin_stage('sidebar')
 
 # Set Consumption Inputs
 st.sidebar.header("Consumption")
-select_consumption = st.sidebar.radio("Select consumption input", ["Standard profile","Upload profile"])
+profile_library = get_profile_library()
+consumption_options = ["Standard profile","Upload profile"]
+if profile_library is not None and profile_library.sites(): 
+    consumption_options.append("Library profile")
+select_consumption = st.sidebar.radio("Select consumption input", consumption_options)
+
+if select_consumption == "Library profile": # If user selects a site of the profile library
+    site = st.sidebar.selectbox("Site", profile_library.sites())
+    site_year = st.sidebar.selectbox("Year", profile_library.years(site), index = len(profile_library.years(site)) - 1)
+    df_profiles = profile_library.profile(site, site_year).to_dataframe() # Only the columns of this site and its PV shape are read
+    time_index = df_profiles['Time']
+    yearly_consumption = df_profiles['Consumption (kWh)'].sum()/1000
+    yearly_consumption_in = st.sidebar.number_input(f"Expected yearly consumption (MWh)", value=int(yearly_consumption), step=1, min_value=0, max_value=50000); 
+    df_profiles['Consumption (kWh)'] =  df_profiles['Consumption (kWh)']* yearly_consumption_in/yearly_consumption
 
 if select_consumption == "Upload profile": # If user uploads a consumption profile
     consumption_csv_file = st.sidebar.file_uploader("Upload a Consumption profile", type=["csv"])
@@ -457,33 +571,74 @@ show_battery_breakdown = st.sidebar.toggle("Show battery sources")
 show_monthly_profile = st.sidebar.toggle("Show monthly profile", value = True) 
 show_daily_profile = st.sidebar.toggle("Show daily profile", value = False)
 if show_daily_profile == True: 
+    profile_year = time_index.dropna().iloc[0].year # Year of the displayed profiles
     date_to_display = st.sidebar.slider(
         "Day to display",
-        value=date(2020, 5, 5),
+        value=date(profile_year, 5, 5),
         format="MM/DD", 
-        min_value = date(2020, 1, 1),
-        max_value = date(2020, 12, 31))
+        min_value = date(profile_year, 1, 1),
+        max_value = date(profile_year, 12, 31))
 show_power_flow = st.sidebar.toggle("Show power flow", value = True)
 show_battery_soc = st.sidebar.toggle("Show battery state of charge", value = True)
+show_events = st.sidebar.toggle("Show charge source events", value = False)
+show_trade_offs = st.sidebar.toggle("Show trade-offs", value = False)
 modify_chart = st.sidebar.toggle("Chart options") 
+st.sidebar.toggle("Show timings", key = 'show_timings', help = "Time the stages of each run of the page (profile load, power flow, resamples, charts, ...)") 
 
 # Downloading input file for csv 
 csv = df_input.to_csv(index=True)
 st.sidebar.download_button(label="Download your inputs", data=csv, file_name='my_inputs.csv')
+end_stage('sidebar')
 
 
 #%% ------------ RUNNING POWER FLOW CALCULATIONS -----------------
 
 
-df_out = calculate_power_flow_new(
-    df_input, 
-    df_profiles
-)
-
-df_out.set_index(time_index, inplace = True)
-df = df_out.sort_index()
-df_sum = df_out.sum()/4000 # Sum of all energy flows in MWh
-df_monthly_sum = df_out.resample('M').sum()/4000
+def run_power_flow():
+    # Only the timesteps affected by a change of the profiles since the last run of this session are recomputed
+    with stage('calculate_power_flow'):
+        power_flow_run = calculate_power_flow_incremental(
+            df_input, 
+            df_profiles,
+            st.session_state.get('power_flow_run')
+        )
+    st.session_state['power_flow_run'] = power_flow_run
+    with stage('dataframe'):
+        df_out = power_flow_run['df_out'].copy()
+        df_out.set_index(time_index, inplace = True)
+    with stage('aggregates'):
+        aggregates = AggregatePyramid(df_out) # Read by the charts and metrics instead of resampling df_out on every rerun
+    with stage('power_flow_events'):
+        events = power_flow_events(df_input, power_flow_run['df_out'], time_index) # Grid charging, generator and shortage transitions
+    results = PowerFlowResults.from_dataframe(df_out, df_input.loc['batt_efficiency', 'Value'], RESULTS_DTYPE) # Without the derived columns
+    return results, aggregates, events
+
+# The power flow only runs again when its inputs or the profiles change, not on chart interactions. Cached results must not be modified.
+# The results are kept compact (see PowerFlowResults), with the aggregates and the charge source events, under their own key so that 
+# results stored in another form are not read. RESULTS_DTYPE=float32 keeps them in a third of the memory of df_out
+RESULTS_DTYPE = os.environ.get('RESULTS_DTYPE', 'float64')
+results_cache = get_results_cache()
+with stage('hash_profiles'):
+    profiles_key = hash_profiles(df_profiles)
+with stage('results_cache/power_flow'):
+    results, aggregates, events = results_cache.get_or_compute(('power_flow_compact', ENGINE_VERSION, RESULTS_DTYPE, hash_inputs(df_input, POWER_FLOW_INPUTS), profiles_key), run_power_flow)
+df_sum = aggregates.total/4000 # Sum of all energy flows in MWh
+df_monthly_sum = aggregates.get('month')/4000
+
+# Repeated times and the positions of the days are found once per profiles, not on every rerun
+with stage('results_cache/time_grid'):
+    time_grid = results_cache.get_or_compute(('time_grid', profiles_key), lambda: TimeGrid(time_index))
+
+def build_chart_data():
+    # Results without the repeated times, and their resolutions for the power flow charts, so that long windows are not read and resampled on every rerun
+    with stage('build_pyramid'):
+        shown = results.take(time_grid.rows)
+        return shown, ResolutionPyramid(shown.take(slice(0, time_grid.size)).to_dataframe())
+
+with stage('results_cache/chart_data'):
+    shown, pyramid = results_cache.get_or_compute(('chart_data_compact', ENGINE_VERSION, RESULTS_DTYPE, hash_inputs(df_input, POWER_FLOW_INPUTS), profiles_key), build_chart_data)
+with stage('results/to_dataframe'):
+    df_shown = shown.to_dataframe()
 
 
 
@@ -498,12 +653,14 @@ if modify_chart == True:
     title_size = st.sidebar.slider("Select title size", min_value=0, max_value=30, value = 20, step= 1)
     legend_size = st.sidebar.slider("Select legend size", min_value=0, max_value=20, value = 16, step= 1)
     explode_parameter = st.sidebar.slider("Explode parameter", min_value=0.0, max_value=0.2, value = 0.0, step= 0.01)
+    chart_points = st.sidebar.slider("Points per trace", min_value=200, max_value=5000, value = 1500, step= 100, help = "About the width of the charts in pixels: longer windows are reduced to this number of points, keeping the peaks")
 else: 
     hole_size = 40
     label_size = 16 
     title_size = 20 
     legend_size = 16
     explode_parameter = 0.0
+    chart_points = 1500
 
 # Sample data for the consumption pie chart
 if show_battery_breakdown == True: 
@@ -543,25 +700,32 @@ col1b,col2b = st.columns([1,5])
 
 with col1: 
     st.subheader('Client consumption')
-    fig1 = plot_pie_chart(settings_consumption, df_sum)
+    with stage('figure/pie_consumption'):
+        fig1 = plot_pie_chart(settings_consumption, df_sum)
     st.plotly_chart(fig1, use_container_width=True)
     if show_monthly_profile:
-        fig3 = plot_monthly_chart(settings_consumption, df_monthly_sum, "Consumption (MWh)")
+        with stage('figure/monthly_consumption'):
+            fig3 = plot_monthly_chart(settings_consumption, df_monthly_sum, "Consumption (MWh)")
         st.plotly_chart(fig3, use_container_width=True)
     if show_daily_profile:
-        df_day = df_out.loc[date_to_display.strftime('%Y, %m, %d')].resample('H').mean()
-        fig3d = plot_day_cumulative_chart(settings_consumption, df_day, "Consumption (MWh)")
+        with stage('resample/daily_profile'):
+            df_day = aggregates.window('hour', date_to_display, date_to_display + timedelta(days = 1))
+        with stage('figure/daily_consumption'):
+            fig3d = plot_day_cumulative_chart(settings_consumption, df_day, "Consumption (MWh)")
         st.plotly_chart(fig3d, use_container_width=True)
 
 with col2:  
     st.subheader('Solar production')
-    fig2 = plot_pie_chart(settings_pv, df_sum)
+    with stage('figure/pie_pv'):
+        fig2 = plot_pie_chart(settings_pv, df_sum)
     st.plotly_chart(fig2, use_container_width=True)
     if show_monthly_profile: 
-        fig4 = plot_monthly_chart(settings_pv, df_monthly_sum, "PV production (MWh)")
+        with stage('figure/monthly_pv'):
+            fig4 = plot_monthly_chart(settings_pv, df_monthly_sum, "PV production (MWh)")
         st.plotly_chart(fig4, use_container_width=True)
     if show_daily_profile:
-        fig4d = plot_day_cumulative_chart(settings_pv, df_day, "PV production (MWh)")
+        with stage('figure/daily_pv'):
+            fig4d = plot_day_cumulative_chart(settings_pv, df_day, "PV production (MWh)")
         st.plotly_chart(fig4d, use_container_width=True)
 
         
@@ -569,10 +733,10 @@ with col2:
        
 #%% ------------ DAILY PLOT-----------------------------------
 
-min_datetime, max_datetime = min(df_out.index), max(df_out.index) 
+min_datetime, max_datetime = aggregates.start, aggregates.end
 min_day, max_day = min_datetime.date(), max_datetime.date()
-start_day = datetime.strptime("2020-03-10", "%Y-%m-%d")
-end_day = datetime.strptime("2020-03-12", "%Y-%m-%d")
+start_day = datetime(min_day.year, 3, 10)
+end_day = datetime(min_day.year, 3, 12)
 
 
 
@@ -621,32 +785,53 @@ settings_day_area =  [
 
 
 
+FREQUENCY_STEPS = {'15T': 1, '30T': 2, '1H': 4, '2H': 8, '6H': 24, 'D': 96, '7D': 672, '30D': 2880} # Timesteps per sample
+FREQUENCY_PERIODS = {'1H': 'hour', 'D': 'day'} # Sampling frequencies read from the aggregates
+
 col7, colspace, col8 = st.columns([0.5,0.2,3])
 
 with col7: 
     start_date = st.date_input("Start date", value = start_day, min_value = min_day, max_value = max_day)
     end_date = st.date_input("End date", value = end_day, min_value = min_day, max_value = max_day)
-    select_frequency = st.selectbox('Sampling frequency', ['15T', '30T', '1H', '2H', '6H', 'D', '7D', '30D']) 
-    df_out = df_out[~df_out.index.duplicated(keep='first')]  # Remove duplicates while keeping the first occurrence
-    date_range = pd.date_range(start=start_date, end=end_date)
-    start_date = start_date.strftime('%Y, %m, %d')
-    end_date = end_date.strftime('%Y, %m, %d')
-    date_range = [dat.strftime('%Y, %m, %d') for dat in date_range]
-    df_day = pd.concat([df_out.loc[dates] for dates in date_range ])
-    df_day = df_day.resample(select_frequency).mean()
+    select_frequency = st.selectbox('Sampling frequency', list(FREQUENCY_STEPS)) 
+    begin_stage('resample/date_range')
+    df_out = df_shown # Without the repeated times (first occurrence kept), as in the charts and the costs
+    window_start, window_stop = time_grid.window(start_date, end_date) # Positions of the first timestep of the window and after its last one
+    if (window_stop - window_start) / FREQUENCY_STEPS[select_frequency] > chart_points: # Too many points for the charts: only the window is read from the pyramid, and the lines keep their peaks
+        df_day = pyramid.frame(window_start, window_stop, chart_points)
+        day_lines = {column: pyramid.series(column, window_start, window_stop, chart_points) for column in [row[0] for row in settings_day] + ['batt_soc_energy']}
+    elif select_frequency in FREQUENCY_PERIODS:
+        df_day = aggregates.window(FREQUENCY_PERIODS[select_frequency], start_date, end_date + timedelta(days = 1))
+        day_lines = df_day
+    else: # The selected sampling fits in the charts
+        df_day = df_out.iloc[window_start:window_stop].resample(select_frequency).mean() # A slice of the results, not a copy
+        day_lines = df_day
+    end_stage('resample/date_range')
 with col8: 
     # df_day = df_out.loc[start_date:end_date]
     # df_day = df_day.resample(select_frequency).sum()
     if show_power_flow == True:
         st.subheader('System power flow')
-        fig6 = plot_day_chart(settings_day, df_day)
+        with stage('figure/power_flow'):
+            fig6 = plot_day_chart(settings_day, day_lines)
         st.plotly_chart(fig6, use_container_width=True)
-        fig7b = plot_day_chart_area(settings_consumption, settings_pv, settings_line, df_day)
+        with stage('figure/power_flow_area'):
+            fig7b = plot_day_chart_area(settings_consumption, settings_pv, settings_line, df_day)
         st.plotly_chart(fig7b, use_container_width=True)
     if show_battery_soc == True:
-        fig_batt = plot_soc(df_day)
+        with stage('figure/battery_soc'):
+            fig_batt = plot_soc(day_lines)
         st.subheader('Battery state of charge')
         st.plotly_chart(fig_batt, use_container_width=True)
+    if show_events == True:
+        st.subheader('Charge source events')
+        df_events = events_dataframe(events)
+        counts = df_events['event'].value_counts()
+        st.caption(f"In the whole profile: {counts['grid_charging_start']} grid charging periods, {counts['generator_on']} generator starts "
+                   f"and {counts['shortage_start']} shortages")
+        first_day = pd.Timestamp(start_date)
+        last_day = pd.Timestamp(end_date) + pd.Timedelta(days = 1)
+        st.dataframe(df_events[(df_events['time'] >= first_day) & (df_events['time'] < last_day)], hide_index = True, use_container_width = True)
 
 
 
@@ -656,17 +841,24 @@ with col8:
 
 col5, colspace,col6 = st.columns([3,0.5,1])
 
+def run_costs():
+    with stage('calculate_costs'):
+        return calculate_costs(df_input, df_out)
+
 if select_economic == True:
-    df_cost_balance = calculate_costs(df_input, df_out)
+    with stage('results_cache/costs'):
+        df_cost_balance = results_cache.get_or_compute(('costs', ENGINE_VERSION, RESULTS_DTYPE, hash_inputs(df_input), profiles_key), run_costs)
     
     total_cost = df_cost_balance.loc['Fixed cost'].sum() + df_cost_balance.loc['Variable cost',:].sum()
     total_revenue = df_cost_balance.loc['Variable revenue',:].sum() 
 
     # Plotting cost chart 
+    begin_stage('figure/costs')
     fig5 = go.Figure()
     for col in df_cost_balance.columns: 
          fig5.add_trace(go.Bar(x = df_cost_balance.index, y = df_cost_balance.loc[['Fixed cost', 'Variable cost', 'Variable revenue'], col], name = col, marker_color  = df_cost_balance.loc['Color', col], ))
     fig5.update_layout(barmode='stack')
+    end_stage('figure/costs')
     
     with col5: 
         # Showing the bar chart of the cost breakdown\
@@ -694,12 +886,47 @@ if select_economic == True:
 
 
 
+#%% ------------ TRADE-OFFS ----------------------------------------------------
+
+TRADE_OFF_GENERATOR_CAPACITY = 250 # Capacity in kW of the generators of the trade-offs when none is set (as in Input_variables.csv)
+
+def run_trade_offs():
+    # Designs around the current one: PV and battery from 0 to twice their size and 0 to 3 generators, reduced to their Pareto front
+    pv_capacity = df_input.loc['pv_capacity']['Value']
+    batt_energy_capacity = df_input.loc['batt_energy_capacity']['Value']
+    # Capacity of each generator when in use: the current one, else the largest current one, else TRADE_OFF_GENERATOR_CAPACITY
+    gen_capacities = [df_input.loc[f'gen{k}_capacity']['Value'] for k in range(1, 4)]
+    default_capacity = max(gen_capacities) if max(gen_capacities) > 0 else TRADE_OFF_GENERATOR_CAPACITY
+    gen_capacities = [capacity if capacity > 0 else default_capacity for capacity in gen_capacities]
+    grid = sweep_grid({
+        'pv_capacity': np.linspace(0, 2 * max(pv_capacity, 100), 7),
+        'batt_energy_capacity': np.linspace(0, 2 * max(batt_energy_capacity, 100), 7),
+        'number_generators': [0, 1, 2, 3],
+    })
+    for k in range(1, 4): # Capacities given explicitly, so that the generators in use do not depend on the sidebar
+        grid[f'gen{k}_capacity'] = np.where(grid['number_generators'] >= k, gen_capacities[k - 1], 0)
+    front = explore_pareto(df_input, df_profiles, grid, store_dir = os.environ.get('RESULTS_STORE_DIR', 'results_store'))
+    return front.to_dataframe()
+
+if show_trade_offs == True: 
+    with stage('results_cache/trade_offs'):
+        df_front = results_cache.get_or_compute(('trade_offs', ENGINE_VERSION, hash_inputs(df_input), profiles_key), run_trade_offs)
+    st.subheader('Trade-offs between cost, renewable fraction and diesel use')
+    with stage('figure/trade_offs'):
+        fig_front = plot_pareto_front(df_front)
+    st.plotly_chart(fig_front, use_container_width=True)
+
+
+
 #%%------------- SUMMARY FACTS -------------------------------------------------------------
 st.subheader('Summary of key metrics')
 
 df_sum_consumption = [df_sum[values] for values in ["pv_consumption", "batt_consumption", "gen_consumption", "grid_consumption"]]
 consumption_sum = sum(df_sum_consumption)
-gen_hours = generator_hours(df_out['gen_production'],  [df_input.loc['gen1_capacity']['Value'], df_input.loc['gen2_capacity']['Value'], df_input.loc['gen3_capacity']['Value']]) 
+with stage('generator_statistics'):
+    gen_statistics = generator_statistics(df_out['gen_production'],  [df_input.loc['gen1_capacity']['Value'], df_input.loc['gen2_capacity']['Value'], df_input.loc['gen3_capacity']['Value']]) 
+gen_hours = gen_statistics['gen_hours']
+gen_starts = gen_statistics['starts'][:int(df_input.loc['number_generators']['Value'])] # Number of starts of each installed generator
 gen_consumption = df_input.loc['gen_fuel_consumption']['Value'] * gen_hours
 
 col9, col10 = st.columns(2)
@@ -724,7 +951,7 @@ if np.abs((df_sum.consumption - consumption_sum)/df_sum.consumption) < 0.005: #
                 text_generator = f"Three ({df_input.loc['gen1_capacity']['Value']:.0f} kW, {df_input.loc['gen2_capacity']['Value']:.0f} kW and {df_input.loc['gen3_capacity']['Value']:.0f} kW) generators"
 
         if df_input.loc['number_generators']['Value'] > 0:
-            st.info(text_generator + f" active for {gen_hours:.0f} hours, producing {-df_sum.gen_production:.0f} MWh and consuming {gen_consumption:.0f} L in one year.")
+            st.info(text_generator + f" active for {gen_hours:.0f} hours ({', '.join(str(starts) for starts in gen_starts)} starts), producing {-df_sum.gen_production:.0f} MWh and consuming {gen_consumption:.0f} L in one year.")
 
         if df_input.loc['grid_supply_capacity']['Value'] > 0:
             text_grid_out = f"{df_input.loc['grid_supply_capacity']['Value']:.0f} kW gird connection supplies {-df_sum.grid_outflow:.0f} MWh of which {df_sum.grid_consumption:.0f} MWh consumed and {df_sum.grid_battery:.0f} MWh stored in the battery "
@@ -738,12 +965,24 @@ else:
     with col9: 
         st.error(f"ATTENTION! The yearly energy demand of {df_sum.consumption:.0f} MWh is not satisfied by the selected assets and grid capacities, which provide {consumption_sum:.0f} MWh. Shortage of consumption is {df_sum.shortage_consumption:.0f}. Consider expanding generator, grid, solar or battery capacity.")
 
-# Download output data 
+# Download output data: serialised only when requested, and once per results and format
 
-st.download_button(label="Download output data as csv", data=df_out.to_csv(index=True), file_name='my_output.csv')
+if st.toggle("Download output data"):
+    export_format = st.radio("Output data format", list(EXPORT_FORMATS), horizontal = True, help = "Parquet and Arrow are compressed columnar files, smaller and faster to load than csv")
+    with stage('download/export'):
+        output_data = results_cache.get_or_compute(('export', ENGINE_VERSION, RESULTS_DTYPE, hash_inputs(df_input, POWER_FLOW_INPUTS), profiles_key, export_format), 
+                                                   lambda: export_bytes(df_out, export_format))
+    st.download_button(label=f"Download output data as {export_format}", data=output_data, file_name='my_output' + EXPORT_FORMATS[export_format])
 
 end_time = time.time() # Starting timer
 
 # Display the elapsed time
 st.write(f"Time of running simulation: {end_time-start_time:.1f} seconds")
 
+# Timings of the stages of the run 
+recorder = stop_recording()
+if recorder is not None:
+    st.subheader('Run timings')
+    st.dataframe(recorder.report(), hide_index = True)
+    st.download_button(label="Download timings as json", data=recorder.to_json(), file_name='my_timings.json')
+
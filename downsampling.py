@@ -0,0 +1,154 @@
+# In this module time series are reduced to the number of points a chart can show: a pyramid of precomputed resolutions
+# (mean, minimum and maximum of buckets of 4, 16, 64, ... timesteps) is sliced to the displayed window, and line traces are
+# reduced with LTTB (largest triangle three buckets) on the minima and maxima of the buckets, so that peaks are kept.
+import numpy as np
+import pandas as pd
+
+try:
+    from numba import njit # Compiler for the LTTB loop
+except ImportError: # Without numba the loop runs as plain python
+    njit = None
+
+
+def _lttb(x, y, points):
+    # Largest triangle three buckets: keeps the first and last points and, in each bucket in between, the point forming the
+    # largest triangle with the previously kept point and the average of the next bucket. Returns the positions of the kept points.
+    n = len(x)
+    kept = np.empty(points, dtype = np.int64)
+    kept[0] = 0
+    kept[points - 1] = n - 1
+    bucket = (n - 2) / (points - 2)
+    a = 0
+    for i in range(points - 2):
+        start = int(i * bucket) + 1
+        end = int((i + 1) * bucket) + 1
+        next_end = min(int((i + 2) * bucket) + 1, n)
+        if next_end <= end: # Last bucket: the next point is the last one
+            avg_x, avg_y = x[n - 1], y[n - 1]
+        else:
+            avg_x, avg_y = 0.0, 0.0
+            for j in range(end, next_end):
+                avg_x += x[j]
+                avg_y += y[j]
+            avg_x /= next_end - end
+            avg_y /= next_end - end
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((x[a] - avg_x) * (y[j] - y[a]) - (x[a] - x[j]) * (avg_y - y[a]))
+            if area > best_area:
+                best, best_area = j, area
+        kept[i + 1] = best
+        a = best
+    return kept
+
+
+if njit is not None:
+    _lttb = njit(cache = True)(_lttb)
+
+
+def lttb_indices(x, y, points):
+    """
+    Select the points of a line that best keep its shape, with the largest triangle three buckets algorithm.
+
+    Parameters:
+    x (np.array): The x values (e.g. timestep positions), increasing.
+    y (np.array): The y values.
+    points (int): The number of points to keep (at least 3).
+
+    Returns:
+    np.array: The positions of the kept points, increasing. All positions if there are not more than points.
+    """
+    if len(x) <= points or points < 3:
+        return np.arange(len(x))
+    return _lttb(np.asarray(x, dtype = float), np.nan_to_num(np.asarray(y, dtype = float)), int(points))
+
+
+class ResolutionPyramid:
+    """
+    Precomputed resolutions of a time series DataFrame (e.g. df_out) for charts: level k holds the mean, minimum and maximum of
+    each column over buckets of factor**k consecutive timesteps. Each level is reduced from the previous one, so the pyramid
+    is built in one pass over the data per level, and a window of any length is read from the level with about the number of
+    points of the chart, without touching the rest of the series.
+
+    Parameters:
+    df (pd.DataFrame): The time series, one row per timestep on a regular grid, with an increasing DatetimeIndex (the hour
+        missing at the change to summer time only shifts the bucket times).
+    factor (int, optional): Number of buckets of a level merged in one bucket of the next level. Defaults to 4.
+    min_buckets (int, optional): The coarsest level has at most this number of buckets. Defaults to 16.
+    """
+
+    def __init__(self, df, factor = 4, min_buckets = 16):
+        self.index = df.index
+        self.columns = list(df.columns)
+        self.factor = factor
+        values = df.to_numpy(dtype = float)
+        self.levels = [{'step': 1, 'mean': values, 'min': values, 'max': values, 'count': np.ones(len(values))}]
+        while len(self.levels[-1]['mean']) > min_buckets:
+            previous = self.levels[-1]
+            starts = np.arange(0, len(previous['mean']), factor)
+            count = np.add.reduceat(previous['count'], starts)
+            total = np.add.reduceat(previous['mean'] * previous['count'][:, None], starts, axis = 0)
+            self.levels.append({
+                'step': previous['step'] * factor,
+                'mean': total / count[:, None],
+                'min': np.fmin.reduceat(previous['min'], starts, axis = 0), # NaN values are ignored
+                'max': np.fmax.reduceat(previous['max'], starts, axis = 0),
+                'count': count,
+            })
+
+    def __len__(self):
+        return len(self.index)
+
+    def __sizeof__(self):
+        # Memory used by the levels, for the size estimate of results_cache.size_of
+        return sum(level[key].nbytes for level in self.levels[1:] for key in ['mean', 'min', 'max', 'count']) + self.levels[0]['mean'].nbytes
+
+    def _level(self, start, stop, max_points):
+        # Finest level with at most max_points buckets in the window, and the first and last buckets of the window
+        for level in self.levels:
+            first, last = start // level['step'], -(-stop // level['step'])
+            if last - first <= max_points:
+                return level, first, last
+        return level, first, last
+
+    def frame(self, start, stop, max_points):
+        """
+        Return the means of all columns over a window, at the finest level with at most max_points rows.
+
+        Parameters:
+        start (int): The first position of the window (see timegrid.TimeGrid.window).
+        stop (int): The position after the last one.
+        max_points (int): The maximum number of rows.
+
+        Returns:
+        pd.DataFrame: The mean of each bucket, indexed by the time of its first timestep. With stacked charts all traces share its index.
+        """
+        level, first, last = self._level(start, stop, max_points)
+        index = self.index[np.arange(first, last) * level['step']]
+        return pd.DataFrame(level['mean'][first:last], index = index, columns = self.columns)
+
+    def series(self, column, start, stop, max_points):
+        """
+        Return a column over a window with at most max_points points that keep its peaks: the minima and maxima of the buckets
+        of the finest level with at most max_points buckets, reduced with LTTB.
+
+        Parameters:
+        column (str): The column.
+        start (int): The first position of the window (see timegrid.TimeGrid.window).
+        stop (int): The position after the last one.
+        max_points (int): The maximum number of points.
+
+        Returns:
+        pd.Series: The selected values, indexed by time.
+        """
+        k = self.columns.index(column)
+        level, first, last = self._level(start, stop, max_points)
+        if level['step'] == 1:
+            positions = np.arange(first, last)
+            values = level['mean'][first:last, k]
+        else: # Minimum and maximum of each bucket, the minimum first at the first timestep and the maximum at the middle
+            positions = np.repeat(np.arange(first, last) * level['step'], 2)
+            positions[1::2] += np.minimum(level['step'] // 2, len(self.index) - 1 - positions[1::2])
+            values = np.column_stack([level['min'][first:last, k], level['max'][first:last, k]]).ravel()
+        kept = lttb_indices(positions, values, max_points)
+        return pd.Series(values[kept], index = self.index[positions[kept]], name = column)
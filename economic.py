@@ -7,8 +7,9 @@ def fuel_cost(gen_production, gen_capacity, fuel_consumption, fuel_price):
     Calculate generator cost for a year.
 
     Args:
-        gen_production (list or array): Generator production in kW values over time, output of powerflow calculations.
-        gen_capacity (float): Generator capacity in kW.
+        gen_production (list or array): Generator production in kW values over time, output of powerflow calculations. 
+            A 2D array (scenarios x time) gives one result per scenario.
+        gen_capacity (list or array): Capacity of the three generators in kW, or one row of capacities per scenario.
         diesel_consumption (float): Diesel consumption rate in L/h
         diesel_price (float): Price of diesel fuel in €/L
 
@@ -26,33 +27,66 @@ def fuel_cost(gen_production, gen_capacity, fuel_consumption, fuel_price):
     
     return [gen_hours, diesel_consumption_year, fuel_price_year]
 
+def generators_active(gen_production, gen_capacity):
+    """
+    Number of generators active at each timestep, deduced from the total generator production.
+
+    Args:
+        gen_production (list or array): Generator production in -kW over time, or a 2D array (scenarios x time).
+        gen_capacity (list or array): Capacity of the three generators in kW, or one row of capacities per scenario.
+
+    Returns:
+        array: 0, 1, 2 or 3 for each timestep, with the shape of gen_production. A production up to the capacity of generator 1 
+        counts as one generator, up to the capacity of generators 1 and 2 as two generators and above as three.
+    """
+    gen_production = np.asarray(gen_production, dtype = float)
+    gen_capacity = np.asarray(gen_capacity, dtype = float)
+    one_generator = - gen_capacity[..., 0]
+    two_generators = - (gen_capacity[..., 0] + gen_capacity[..., 1])
+    if gen_production.ndim == 2: # One capacity per scenario, broadcast over time 
+        one_generator = np.asarray(one_generator)[..., None]
+        two_generators = np.asarray(two_generators)[..., None]
+    
+    active = np.where(gen_production >= one_generator, 1, np.where(gen_production >= two_generators, 2, 3))
+    return np.where(gen_production < 0, active, 0)
+
 def generator_hours(gen_production,  gen_capacity): 
-    # Initialize the variable to keep track of generator hours
-    gen_hours = 0
+    # Yearly generator hours: each quarter of an hour counts once per active generator (see generators_active).
+    # A 2D gen_production (scenarios x time) gives one value per scenario.
+    return generators_active(gen_production, gen_capacity).sum(axis = -1) * 0.25
+
+def generator_statistics(gen_production, gen_capacity):
+    """
+    Calculate the run hours and the number of starts of each generator, for maintenance costing.
 
-    # Iterate over the generator production values
-    for i in range(len(gen_production)):
-        if gen_production[i] < 0: 
-            if gen_production[i] >= - gen_capacity[0]:
-                # If one generator is active, add 15 minutes (1/4 hour) to gen_hours
-                gen_hours += 0.25
-            elif gen_production[i] >= - (gen_capacity[0] + gen_capacity[1]):
-                # If two generators are active, add 30 minutes (0.5 hour) to gen_hours
-                gen_hours += 0.5
-            else:
-                # If three generators are active, add 45 minutes (0.75 hour) to gen_hours
-                gen_hours += 0.75
-        else:
-            # Generator is not active, no hours are accounted for
-            gen_hours += 0 
-            
-    return gen_hours
+    Args:
+        gen_production (list or array): Generator production in -kW over time, or a 2D array (scenarios x time).
+        gen_capacity (list or array): Capacity of the three generators in kW, or one row of capacities per scenario.
+
+    Returns:
+        dict: 'gen_hours' (total generator hours, as generator_hours), 'run_hours' and 'starts' (one value per generator, 
+        generators being started in order as in the power flow). Each has an extra first dimension for a 2D gen_production.
+    """
+    active = generators_active(gen_production, gen_capacity)
+    running = np.stack([active >= k for k in (1, 2, 3)], axis = -2) # Generator k running at each timestep 
+    starts = running[..., 0].astype(int) + (running[..., 1:] & ~running[..., :-1]).sum(axis = -1) # Generators are off before the first timestep
+    return {
+        'gen_hours': active.sum(axis = -1) * 0.25,
+        'run_hours': running.sum(axis = -1) * 0.25,
+        'starts': starts,
+    }
     
 def calculate_costs(df_input, df_out):
+    # df_out is either the DataFrame of power flows or the summary record of calculate_power_flow_new(..., output = 'summary')
     df_in = df_input['Value'] # Using only the input values
-    df_sum = df_out.sum()/4000 
-    gen_capacity = np.array([df_in['gen1_capacity'], df_in['gen2_capacity'], df_in['gen3_capacity']])
-    [gen_hours, fuel_cosnumption_year, fuel_cost_year] = fuel_cost(df_out.gen_production, gen_capacity, df_in['gen_fuel_consumption'], df_in['gen_fuel_price'])
+    if not isinstance(df_out, pd.DataFrame): # Summary record (dict or PowerFlowSummary): yearly sums and generator hours are already computed 
+        df_sum = df_out['annual']
+        gen_hours = df_out['gen_hours']
+        fuel_cost_year = df_in['gen_fuel_consumption'] * gen_hours * df_in['gen_fuel_price'] # Same as fuel_cost 
+    else:
+        df_sum = df_out.sum()/4000 
+        gen_capacity = np.array([df_in['gen1_capacity'], df_in['gen2_capacity'], df_in['gen3_capacity']])
+        [gen_hours, fuel_cosnumption_year, fuel_cost_year] = fuel_cost(df_out.gen_production, gen_capacity, df_in['gen_fuel_consumption'], df_in['gen_fuel_price'])
     grid_cost_year = (df_sum.grid_consumption + df_sum.grid_battery) * df_in['grid_energy_price']
     grid_capacity_cost_year = df_in['grid_supply_capacity'] * df_in['capacity_cost']
     grid_return_year = (df_sum.pv_grid) * df_in['grid_feedin_price']
@@ -0,0 +1,181 @@
+# In this module simulation results (df_out, PowerFlowResults, sweep and batch summaries) are written to compressed columnar
+# files, Parquet or Arrow IPC, for BI tools. ResultsWriter appends results to one file as they are computed, so that large
+# sweeps are written without keeping all their results in memory, and export_bytes serialises results for a download.
+#
+# use: with ResultsWriter('timeseries.parquet') as writer:
+#          for k, df_out in enumerate(...): writer.write(df_out, scenario = k)
+#      export_sweep(df_input, 'Input_profiles', {'pv_capacity': [500, 1000, 1500]}, 'sweep.parquet')
+import io
+import numpy as np
+import pandas as pd
+from powerflow import PowerFlowResults
+from sweep import iter_sweep, sweep_grid
+
+try:
+    import pyarrow as pa # Columnar tables and files, also needed by streamlit and pandas.to_parquet
+    import pyarrow.parquet as pq
+except ImportError: # Only CSV can be exported
+    pa = None
+
+EXPORT_FORMATS = {'parquet': '.parquet', 'arrow': '.arrow', 'csv': '.csv'} # Format: file extension
+COMPRESSION = 'zstd' # Compression of the Parquet and Arrow IPC files
+
+
+def results_frame(results, time_column = 'Time'):
+    """
+    Return results as a DataFrame with the times as first column, as written to the files.
+
+    Parameters:
+    results (pd.DataFrame or PowerFlowResults): The results, e.g. df_out with the times of the profiles as index.
+    time_column (str, optional): The name of the column of the times, when the index holds times. Defaults to 'Time'.
+
+    Returns:
+    pd.DataFrame: The results with a RangeIndex.
+    """
+    df = results.to_dataframe() if isinstance(results, PowerFlowResults) else results
+    if isinstance(df.index, pd.DatetimeIndex):
+        return df.reset_index(names = time_column)
+    return df.reset_index(drop = True)
+
+
+def _format(path, format):
+    # Format of a file, from its extension when not given
+    if format is None:
+        format = next((name for name, extension in EXPORT_FORMATS.items() if str(path).endswith(extension)), None)
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{format}', use one of {', '.join(EXPORT_FORMATS)}")
+    if format != 'csv' and pa is None:
+        raise ImportError(f"Writing {format} files needs pyarrow")
+    return format
+
+
+class ResultsWriter:
+    """
+    Writer appending results to one Parquet or Arrow IPC file, one row group (or record batch) per write. The columns are the
+    ones of the first write, later results are cast to their types.
+
+    Parameters:
+    destination (str or file): The path of the file, or a binary file object.
+    format (str, optional): 'parquet' or 'arrow'. Defaults to the format of the extension of destination.
+    compression (str, optional): The compression of the file. Defaults to COMPRESSION.
+    """
+
+    def __init__(self, destination, format = None, compression = COMPRESSION):
+        self.format = _format(destination, format)
+        if self.format == 'csv':
+            raise ValueError("Results are streamed to parquet or arrow files, use export_results for CSV")
+        self.destination = destination
+        self.compression = compression
+        self.schema = None
+        self.rows = 0
+        self._writer = None
+
+    def write(self, results, **labels):
+        """
+        Append results to the file.
+
+        Parameters:
+        results (pd.DataFrame or PowerFlowResults): The results, see results_frame.
+        labels: Constant columns added before the results, e.g. scenario = 3 or site = 'north'.
+        """
+        table = pa.Table.from_pandas(results_frame(results), preserve_index = False)
+        for position, (name, value) in enumerate(labels.items()):
+            table = table.add_column(position, name, pa.array(np.repeat(value, table.num_rows)))
+        if self._writer is None:
+            self.schema = table.schema
+            if self.format == 'parquet':
+                self._writer = pq.ParquetWriter(self.destination, self.schema, compression = self.compression)
+            else:
+                self._writer = pa.ipc.new_file(self.destination, self.schema, options = pa.ipc.IpcWriteOptions(compression = self.compression))
+        self._writer.write_table(table.cast(self.schema))
+        self.rows += table.num_rows
+
+    def close(self):
+        """Finish the file. A writer without any write leaves no file."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+def export_results(results, destination, format = None, compression = COMPRESSION):
+    """
+    Write results to a Parquet, Arrow IPC or CSV file.
+
+    Parameters:
+    results (pd.DataFrame or PowerFlowResults): The results, see results_frame.
+    destination (str or file): The path of the file, or a binary file object.
+    format (str, optional): 'parquet', 'arrow' or 'csv'. Defaults to the format of the extension of destination.
+    compression (str, optional): The compression of Parquet and Arrow IPC files. Defaults to COMPRESSION.
+    """
+    format = _format(destination, format)
+    if format == 'csv': # As the former download of the dashboard
+        df = results.to_dataframe() if isinstance(results, PowerFlowResults) else results
+        data = df.to_csv(index = True).encode()
+        if isinstance(destination, str):
+            with open(destination, 'wb') as file:
+                file.write(data)
+        else:
+            destination.write(data)
+        return
+    with ResultsWriter(destination, format, compression) as writer:
+        writer.write(results)
+
+
+def export_bytes(results, format = 'parquet', compression = COMPRESSION):
+    """
+    Serialise results to the content of a file, e.g. for a download button.
+
+    Parameters:
+    results (pd.DataFrame or PowerFlowResults): The results, see results_frame.
+    format (str, optional): 'parquet', 'arrow' or 'csv'. Defaults to 'parquet'.
+    compression (str, optional): The compression of Parquet and Arrow IPC files. Defaults to COMPRESSION.
+
+    Returns:
+    bytes: The content of the file.
+    """
+    buffer = io.BytesIO()
+    export_results(results, buffer, format, compression)
+    return buffer.getvalue()
+
+
+def export_sweep(df_input, df_profiles, scenarios, destination, format = None, workers = None, store_dir = None, batch_rows = 1000):
+    """
+    Evaluate the scenarios of a sizing study (see sweep.iter_sweep) and write their summaries to one file as they are computed,
+    batch_rows at a time, so that the memory used does not grow with the number of scenarios.
+
+    Parameters:
+    df_input, df_profiles, scenarios, workers, store_dir: See sweep.run_sweep.
+    destination (str or file): The Parquet or Arrow IPC file.
+    format (str, optional): 'parquet' or 'arrow'. Defaults to the format of the extension of destination.
+    batch_rows (int, optional): Number of scenarios per row group of the file. Defaults to 1000.
+
+    Returns:
+    int: The number of scenarios written.
+    """
+    if isinstance(scenarios, dict):
+        scenarios = sweep_grid(scenarios)
+    if isinstance(scenarios, pd.DataFrame):
+        scenarios = scenarios.to_dict('records')
+    with ResultsWriter(destination, format) as writer:
+        rows = []
+        for k, summary in enumerate(iter_sweep(df_input, df_profiles, scenarios, workers, store_dir)):
+            rows.append({'scenario': k, **scenarios[k], **summary})
+            if len(rows) == batch_rows:
+                writer.write(_summary_frame(rows))
+                rows = []
+        if rows:
+            writer.write(_summary_frame(rows))
+    return writer.rows
+
+
+def _summary_frame(rows):
+    # Rows of summaries with float values, so that every batch of a file has the same column types
+    df = pd.DataFrame(rows)
+    numeric = [column for column in df.columns[1:] if pd.api.types.is_numeric_dtype(df[column]) and not pd.api.types.is_bool_dtype(df[column])]
+    return df.astype({column: float for column in numeric})
@@ -0,0 +1,268 @@
+# In this module a corpus of reference results (golden outputs) is kept, against which faster or batched engines are checked
+#
+# use: python golden.py                      checks every engine against the corpus in the golden directory
+#      python golden.py --engine batch        checks one engine
+#      python golden.py --write               freezes the results of the reference python engine as the corpus
+import argparse
+import contextlib
+import io
+import json
+import lzma
+import os
+import sys
+import numpy as np
+import pandas as pd
+from powerflow import (calculate_power_flow_new, calculate_power_flow_stream, calculate_power_flow_incremental, calculate_power_flow_batch,
+                       profile_chunks, batch_scenarios, batch_dataframe, ENGINE_VERSION)
+from economic import calculate_costs
+from helpers import read_from_csv
+from results_cache import hash_profiles
+from cases import benchmark_input, GRID_TYPES
+
+GOLDEN_DIR = 'golden'
+MANIFEST_FILE = 'manifest.json'
+COST_ROWS = ['Fixed cost', 'Variable cost', 'Variable revenue'] # Numeric rows of calculate_costs, the 'Color' row is not kept
+GEN_SOC_TRIGGER = 0.35 # Above batt_soc_minimum (0.2), otherwise the generators of the base inputs never start
+
+# Edge cases on top of the type A/B x 0-3 generators matrix: (grid type, number of generators, overwritten input values)
+EDGE_CASES = {
+    'zero_battery_typeB_1gen': ('B', 1, {'batt_energy_capacity': 0.0, 'batt_power_capacity': 0.0}),
+    'zero_battery_typeA_0gen': ('A', 0, {'batt_energy_capacity': 0.0, 'batt_power_capacity': 0.0}),
+    'zero_pv_typeA_1gen': ('A', 1, {'pv_capacity': 0.0}),
+    'no_grid_typeB_3gen': ('B', 3, {'grid_supply_capacity': 0.0, 'grid_feedin_capacity': 0.0}),
+    'grid_always_charging_typeA_1gen': ('A', 1, {'grid_soc_trigger': 1.0}),
+    'zero_soc_minimum_typeB_0gen': ('B', 0, {'batt_soc_minimum': 0.0}),
+}
+
+
+def golden_configurations(df_input):
+    """
+    Build the configurations of the corpus: grid types A and B with 0 to 3 generators, and the EDGE_CASES, all with the 
+    generators triggered at GEN_SOC_TRIGGER.
+
+    Parameters:
+    df_input (pd.DataFrame): The base input DataFrame (test_inputs_typeB.csv).
+
+    Returns:
+    dict: Mapping from configuration name to its df_input.
+    """
+    df_input = df_input.copy()
+    df_input.loc['gen1_soc_trigger', 'Value'] = GEN_SOC_TRIGGER
+    configurations = {}
+    for grid_type in GRID_TYPES:
+        for number_generators in range(4):
+            configurations[f'type{grid_type}_{number_generators}gen'] = benchmark_input(df_input, number_generators, grid_type)
+    for name, (grid_type, number_generators, values) in EDGE_CASES.items():
+        df_case = benchmark_input(df_input, number_generators, grid_type)
+        for key, value in values.items():
+            df_case.loc[key, 'Value'] = value
+        configurations[name] = df_case
+    return configurations
+
+
+def _run_kernel(df_input, df_profiles):
+    return calculate_power_flow_new(df_input, df_profiles)
+
+
+def _run_python(df_input, df_profiles):
+    return calculate_power_flow_new(df_input, df_profiles, engine = 'python')
+
+
+def _run_stream(df_input, df_profiles):
+    return pd.concat(calculate_power_flow_stream(df_input, profile_chunks(df_profiles, 2976)))
+
+
+def _run_incremental(df_input, df_profiles):
+    return calculate_power_flow_incremental(df_input, df_profiles)['df_out']
+
+
+def _run_batch(df_input, df_profiles):
+    return batch_dataframe(calculate_power_flow_batch(batch_scenarios([df_input]), df_profiles), 0)
+
+
+def _run_compact(df_input, df_profiles):
+    return calculate_power_flow_new(df_input, df_profiles, output = 'compact').to_dataframe()
+
+
+# Engines checked against the corpus: each returns the df_out of a configuration
+ENGINES = {
+    'kernel': _run_kernel,
+    'python': _run_python,
+    'stream': _run_stream,
+    'incremental': _run_incremental,
+    'batch': _run_batch,
+    'compact': _run_compact,
+}
+
+
+def _costs(df_input, df_out):
+    df_cost_balance = calculate_costs(df_input, df_out)
+    return df_cost_balance.loc[COST_ROWS].astype(float)
+
+
+def write_golden(df_input, df_profiles, directory = GOLDEN_DIR):
+    """
+    Freeze the results of calculate_power_flow_new and calculate_costs for all the golden_configurations. The power flows come
+    from the step by step python engine, the reference the faster engines (including the default kernel) are checked against. Each df_out is stored
+    as its float64 values compressed with lzma (lossless, about 0.6 MB per configuration for a year of quarter-hours), and the
+    inputs, columns and costs of all the configurations in a json manifest.
+
+    Parameters:
+    df_input (pd.DataFrame): The base input DataFrame (test_inputs_typeB.csv).
+    df_profiles (pd.DataFrame): The consumption and PV production profiles.
+    directory (str, optional): Directory of the corpus. Defaults to GOLDEN_DIR.
+    """
+    os.makedirs(directory, exist_ok = True)
+    manifest = {'engine_version': ENGINE_VERSION, 'profiles': hash_profiles(df_profiles), 'length': len(df_profiles), 'configurations': {}}
+    for name, df_case in golden_configurations(df_input).items():
+        with contextlib.redirect_stdout(io.StringIO()):
+            df_out = calculate_power_flow_new(df_case, df_profiles, engine = 'python')
+        with lzma.open(os.path.join(directory, f'{name}.npy.xz'), 'wb') as file:
+            np.save(file, df_out.to_numpy(dtype = np.float64))
+        manifest['configurations'][name] = {
+            'inputs': df_case['Value'].astype(float).to_dict(),
+            'columns': list(df_out.columns),
+            'costs': _costs(df_case, df_out).to_dict(),
+        }
+    with open(os.path.join(directory, MANIFEST_FILE), 'w') as file:
+        json.dump(manifest, file, indent = 1)
+
+
+def read_manifest(directory = GOLDEN_DIR):
+    """Return the manifest of the corpus, see write_golden."""
+    with open(os.path.join(directory, MANIFEST_FILE)) as file:
+        return json.load(file)
+
+
+def read_golden(name, directory = GOLDEN_DIR, manifest = None):
+    """
+    Read a configuration of the corpus.
+
+    Parameters:
+    name (str): The name of the configuration, see golden_configurations.
+    directory (str, optional): Directory of the corpus. Defaults to GOLDEN_DIR.
+    manifest (dict, optional): The manifest of the corpus, read if not given.
+
+    Returns:
+    tuple: The df_input, the reference df_out and the reference costs (rows COST_ROWS of calculate_costs) of the configuration.
+    """
+    manifest = read_manifest(directory) if manifest is None else manifest
+    entry = manifest['configurations'][name]
+    with lzma.open(os.path.join(directory, f'{name}.npy.xz'), 'rb') as file:
+        values = np.load(file)
+    df_input = pd.DataFrame({'Value': pd.Series(entry['inputs'])})
+    df_out = pd.DataFrame(values, columns = entry['columns'])
+    return df_input, df_out, pd.DataFrame(entry['costs'])
+
+
+def compare_outputs(df_reference, df_out, tolerance = 0.0):
+    """
+    Compare the columns of two results, e.g. a df_out with the reference of the corpus. NaN values are equal to each other.
+
+    Parameters:
+    df_reference (pd.DataFrame): The reference results.
+    df_out (pd.DataFrame): The results to check, with the same rows as df_reference.
+    tolerance (float, optional): Absolute deviation above which a value diverges. Defaults to 0 (bit for bit equality).
+
+    Returns:
+    pd.DataFrame: One row per column of df_reference with the 'max_deviation' (inf if the column is missing or the lengths differ),
+        the number of 'diverging_steps' and the 'first_diverging_step' (row number, -1 if none).
+    """
+    rows = []
+    for column in df_reference.columns:
+        reference = df_reference[column].to_numpy(dtype = np.float64)
+        if column not in df_out.columns or len(df_out) != len(df_reference):
+            rows.append({'column': column, 'max_deviation': np.inf, 'diverging_steps': len(reference), 'first_diverging_step': 0})
+            continue
+        values = df_out[column].to_numpy(dtype = np.float64)
+        both_nan = np.isnan(reference) & np.isnan(values)
+        deviation = np.where(both_nan, 0.0, np.abs(values - reference))
+        deviation = np.where(np.isnan(deviation), np.inf, deviation) # NaN on one side only
+        diverging = deviation > tolerance
+        rows.append({
+            'column': column,
+            'max_deviation': deviation.max() if len(deviation) else 0.0,
+            'diverging_steps': int(diverging.sum()),
+            'first_diverging_step': int(diverging.argmax()) if diverging.any() else -1,
+        })
+    return pd.DataFrame(rows, columns = ['column', 'max_deviation', 'diverging_steps', 'first_diverging_step'])
+
+
+def check_golden(df_profiles, engine = 'kernel', directory = GOLDEN_DIR, tolerance = 0.0, cost_tolerance = 0.0):
+    """
+    Run an engine on every configuration of the corpus and compare its df_out and costs with the references.
+
+    Parameters:
+    df_profiles (pd.DataFrame): The profiles the corpus was written with (checked through hash_profiles).
+    engine (str or callable, optional): A name of ENGINES, or a function of (df_input, df_profiles) returning df_out. Defaults to 'kernel'.
+    directory (str, optional): Directory of the corpus. Defaults to GOLDEN_DIR.
+    tolerance (float, optional): Absolute deviation of the power flows above which a value diverges. Defaults to 0.
+    cost_tolerance (float, optional): Absolute deviation of the costs in EUR above which a cost diverges. Defaults to 0.
+
+    Returns:
+    pd.DataFrame: One row per configuration and column (power flows, and costs as 'cost/<row>/<asset>'), see compare_outputs,
+        with the 'first_diverging_time' from the 'Time' of df_profiles and whether the column 'diverges'.
+    """
+    manifest = read_manifest(directory)
+    if manifest['profiles'] != hash_profiles(df_profiles):
+        raise ValueError(f"The profiles are not the ones of the golden corpus in {directory}")
+    run = ENGINES[engine] if isinstance(engine, str) else engine
+    times = df_profiles['Time'].to_numpy() if 'Time' in df_profiles else None
+
+    reports = []
+    for name in manifest['configurations']:
+        df_input, df_reference, df_reference_costs = read_golden(name, directory, manifest)
+        with contextlib.redirect_stdout(io.StringIO()):
+            df_out = run(df_input, df_profiles).reset_index(drop = True)
+        df_report = compare_outputs(df_reference, df_out, tolerance)
+        df_report['diverges'] = df_report['diverging_steps'] > 0
+
+        # Costs, from the df_out of the engine
+        df_costs = _costs(df_input, df_out) if len(df_report) and not np.isinf(df_report['max_deviation']).any() else df_reference_costs * np.nan
+        rows = []
+        for row in COST_ROWS:
+            for asset in df_reference_costs.columns:
+                deviation = abs(df_costs.loc[row, asset] - df_reference_costs.loc[row, asset])
+                deviation = np.inf if np.isnan(deviation) else deviation
+                rows.append({'column': f'cost/{row}/{asset}', 'max_deviation': deviation, 'diverging_steps': 0,
+                             'first_diverging_step': -1, 'diverges': deviation > cost_tolerance})
+        df_report = pd.concat([df_report, pd.DataFrame(rows)], ignore_index = True)
+        df_report.insert(0, 'configuration', name)
+        first = df_report['first_diverging_step'].to_numpy()
+        df_report['first_diverging_time'] = [str(times[step]) if times is not None and 0 <= step < len(times) else '' for step in first]
+        reports.append(df_report)
+    return pd.concat(reports, ignore_index = True)
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = "Check the power flow engines against the golden corpus")
+    parser.add_argument('--engine', choices = list(ENGINES), action = 'append', help = "engine to check, can be repeated (default: all)")
+    parser.add_argument('--directory', default = GOLDEN_DIR, help = "directory of the corpus")
+    parser.add_argument('--tolerance', type = float, default = 0.0, help = "absolute deviation of the power flows reported as a divergence")
+    parser.add_argument('--cost-tolerance', type = float, default = 0.0, help = "absolute deviation of the costs reported as a divergence")
+    parser.add_argument('--write', action = 'store_true', help = "freeze the results of the python engine as the corpus")
+    args = parser.parse_args(args)
+
+    df_input = read_from_csv('test_inputs_typeB')
+    df_profiles = pd.read_csv('Input_profiles.csv')
+    if args.write:
+        write_golden(df_input, df_profiles, args.directory)
+        print(f"Golden corpus written to {args.directory}")
+        return 0
+
+    failed = False
+    for engine in args.engine or list(ENGINES):
+        df_report = check_golden(df_profiles, engine, args.directory, args.tolerance, args.cost_tolerance)
+        df_diverging = df_report[df_report['diverges']]
+        if len(df_diverging):
+            failed = True
+            print(f"{engine}: {df_diverging['configuration'].nunique()} configurations diverge")
+            with pd.option_context('display.max_rows', None, 'display.width', 200):
+                print(df_diverging.drop(columns = 'diverges').to_string(index = False))
+        else:
+            print(f"{engine}: {df_report['configuration'].nunique()} configurations match")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
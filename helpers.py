@@ -1,8 +1,14 @@
 import csv 
+import hashlib
+import json
+import os
 import pickle
 import pandas as pd 
 import numpy as np
 
+PROFILE_MAGIC = b'PROFILE1' # First bytes of a binary profile file
+PROFILE_ALIGNMENT = 64 # The data of a binary profile file starts at a multiple of this offset
+
 def pickle_write(df, filename):
     """
     Serialize and save a DataFrame to a pickle file.
@@ -38,7 +44,6 @@ def data_to_csv(df, filename):
     filename (str): The name of the CSV file (without the '.csv' extension).
     """
     df.to_csv(filename + '.csv', index=True)
-    print(df)
     
 def read_from_csv(filename):
     """
@@ -53,6 +58,156 @@ def read_from_csv(filename):
     df_read = pd.read_csv(filename + '.csv', index_col = 0)
     return df_read
 
+def profiles_to_binary(df_profiles, filename, step_minutes = 15, timezone = 'Europe/Amsterdam', source = None):
+    """
+    Write profiles to a binary file that can be memory-mapped by read_profiles_binary.
+    The file holds a JSON header (start time, timestep, columns) followed by one float64 array per column. 
+    The times are not stored but implied by the start time and the timestep.
+
+    Parameters:
+    df_profiles (pd.DataFrame): The profiles, with a 'Time' column on a regular grid. Rows without time are only allowed at the end.
+    filename (str): The name of the binary file (without the '.bin' extension).
+    step_minutes (int, optional): The timestep of the profiles in minutes. Defaults to 15.
+    timezone (str, optional): Timezone of the times when they are local clock times, with an hour missing and an hour repeated 
+        at the daylight saving changes (as in Input_profiles.csv). They are then on a regular grid in UTC. Defaults to 'Europe/Amsterdam'.
+    source (str, optional): The file the profiles were read from (e.g. 'Input_profiles.csv'). Its hash is stored in the header, 
+        see update_profiles_binary. Defaults to None.
+    """
+    step = pd.Timedelta(minutes = step_minutes)
+    time = pd.to_datetime(df_profiles['Time'])
+    periods = int(time.notna().sum()) # Rows on the time grid, the following ones have no time
+    if time.iloc[periods:].notna().any():
+        raise ValueError("Rows without time are only allowed at the end of the profiles")
+    time = time.iloc[:periods]
+    
+    if (time.diff().iloc[1:] == step).all(): # Regular grid of clock times 
+        timezone = None
+    elif timezone is not None: # Local clock times with daylight saving changes
+        time = time.dt.tz_localize(timezone, ambiguous = 'infer').dt.tz_convert('UTC')
+    if not (time.diff().iloc[1:] == step).all():
+        raise ValueError(f"The profile times are not on a regular {step_minutes} minutes grid")
+    
+    columns = [column for column in df_profiles.columns if column != 'Time' and not column.startswith('Unnamed')]
+    data = np.ascontiguousarray(df_profiles[columns].to_numpy(dtype = np.float64).T) # One row per column
+    header = json.dumps({
+        'start': time.iloc[0].isoformat() if periods else None,
+        'timezone': timezone,
+        'step_minutes': step_minutes,
+        'periods': periods,
+        'length': len(df_profiles),
+        'columns': columns,
+        'dtype': '<f8',
+        'source_hash': file_hash(source) if source is not None else None,
+    }).encode()
+    offset = -(-(len(PROFILE_MAGIC) + 4 + len(header)) // PROFILE_ALIGNMENT) * PROFILE_ALIGNMENT
+    with open(filename + '.bin.tmp', 'wb') as file:
+        file.write(PROFILE_MAGIC)
+        file.write(len(header).to_bytes(4, 'little'))
+        file.write(header.ljust(offset - len(PROFILE_MAGIC) - 4))
+        file.write(data.astype('<f8').tobytes())
+    os.replace(filename + '.bin.tmp', filename + '.bin') # Processes that memory-map the former file keep reading it
+
+def file_hash(path):
+    """Return the SHA-1 hash of the content of a file, as a hexadecimal string."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def update_profiles_binary(filename):
+    """
+    Make sure the binary profile file holds the profiles of the CSV file of the same name: it is used only when the hash of the
+    CSV file stored in its header (see profiles_to_binary) matches, and is written again from the CSV file otherwise.
+
+    Parameters:
+    filename (str): The name of the profiles files (without extension).
+
+    Returns:
+    bool: Whether filename.bin can be read. False if it cannot be written (e.g. read-only directory, or profiles not on a regular
+        time grid): the CSV file is then to be read instead.
+    """
+    if not os.path.exists(filename + '.csv'):
+        return os.path.exists(filename + '.bin')
+    if os.path.exists(filename + '.bin') and read_profiles_header(filename).get('source_hash') == file_hash(filename + '.csv'):
+        return True
+    try:
+        profiles_to_binary(pd.read_csv(filename + '.csv'), filename, source = filename + '.csv')
+    except (OSError, ValueError):
+        return False
+    return True
+
+def read_profiles_header(filename):
+    """
+    Read the header of a binary profile file.
+
+    Parameters:
+    filename (str): The name of the binary file (without the '.bin' extension).
+
+    Returns:
+    dict: The header (start, timezone, step_minutes, periods, length, columns, dtype, source_hash) and the 'offset' of the data in the file.
+    """
+    with open(filename + '.bin', 'rb') as file:
+        if file.read(len(PROFILE_MAGIC)) != PROFILE_MAGIC:
+            raise ValueError(f"{filename}.bin is not a binary profile file")
+        length = int.from_bytes(file.read(4), 'little')
+        header = json.loads(file.read(length))
+    header['offset'] = -(-(len(PROFILE_MAGIC) + 4 + length) // PROFILE_ALIGNMENT) * PROFILE_ALIGNMENT
+    return header
+
+def profiles_time_index(header):
+    """
+    Build the times of binary profiles from their start time and timestep, without parsing any string.
+
+    Parameters:
+    header (dict): The header of the profiles, see read_profiles_header.
+
+    Returns:
+    pd.DatetimeIndex: The time of each row (local clock times if the profiles have a timezone), NaT for the rows beyond the time grid.
+    """
+    times = pd.date_range(start = header['start'], periods = header['periods'], freq = pd.Timedelta(minutes = header['step_minutes']))
+    if header.get('timezone') is not None:
+        times = times.tz_convert(header['timezone']).tz_localize(None)
+    return times.append(pd.DatetimeIndex([pd.NaT] * (header['length'] - header['periods'])))
+
+def read_profile_column(filename, column, header = None):
+    """
+    Memory-map a single column of a binary profile file, without reading the other columns.
+
+    Parameters:
+    filename (str): The name of the binary file (without the '.bin' extension).
+    column (str): The name of the column.
+    header (dict, optional): The header of the file, read if not given (see read_profiles_header).
+
+    Returns:
+    np.memmap: The values of the column (read-only).
+    """
+    if header is None:
+        header = read_profiles_header(filename)
+    if column not in header['columns']:
+        raise KeyError(f"{filename}.bin has no column '{column}'")
+    dtype = np.dtype(header['dtype'])
+    offset = header['offset'] + header['columns'].index(column) * header['length'] * dtype.itemsize
+    return np.memmap(filename + '.bin', dtype = dtype, mode = 'r', offset = offset, shape = (header['length'],))
+
+def read_profiles_binary(filename):
+    """
+    Load profiles written by profiles_to_binary. The columns are memory-mapped (read-only, no copy) and the times are built 
+    from the start time and timestep.
+
+    Parameters:
+    filename (str): The name of the binary file (without the '.bin' extension).
+
+    Returns:
+    pd.DataFrame: The profiles with the 'Time' column and one column per stored profile.
+    """
+    header = read_profiles_header(filename)
+    data = np.memmap(filename + '.bin', dtype = header['dtype'], mode = 'r', offset = header['offset'], shape = (len(header['columns']), header['length']))
+    df_profiles = pd.DataFrame({'Time': profiles_time_index(header)})
+    for column, values in zip(header['columns'], data):
+        df_profiles[column] = pd.Series(values, copy = False)
+    return df_profiles
+
 def string_or_none(value):
     """
     Check if a value is a string and return it, or return None if it's not.
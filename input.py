@@ -177,6 +177,7 @@ def import_data_from_excel(filename):
 # pickle_write(df_profiles, 'Input_profiles')
 # data_to_csv(df_input,'Input_variables')
 # data_to_csv(df_profiles, 'Input_profiles')
+# profiles_to_binary(df_profiles, 'Input_profiles')
 
 df_input = read_from_csv('test_inputs_typeB')
 pickle_write(df_input, 'Input_variables')
@@ -0,0 +1,138 @@
+# In this module the wall time and number of calls of the stages of a dashboard run (or of any calculation) are recorded,
+# together with optional trace events of the power flow. When no recording is active every call returns at once.
+import contextlib
+import json
+import threading
+import time
+import pandas as pd
+
+_local = threading.local() # Recorder of each thread: streamlit runs the script of every session in its own thread
+_NO_STAGE = contextlib.nullcontext() # Returned by stage when nothing is recorded
+
+
+class Recorder:
+    """
+    Record of the stages and trace events of one run.
+
+    Parameters:
+    trace (bool, optional): Whether trace events (e.g. every timestep where the grid charges the battery in the python
+        power flow loop) are recorded. Defaults to False, as they can be many.
+    """
+
+    def __init__(self, trace = False):
+        self.trace = trace
+        self.stages = {} # Stage name: [calls, seconds], in order of first call
+        self.events = []
+        self._open = {} # Start time of the stages opened with begin
+        self._start = time.perf_counter()
+        self.total_seconds = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(name, time.perf_counter() - start)
+
+    def begin(self, name):
+        self._open[name] = time.perf_counter()
+
+    def end(self, name):
+        if name in self._open:
+            self._add(name, time.perf_counter() - self._open.pop(name))
+
+    def _add(self, name, seconds):
+        record = self.stages.setdefault(name, [0, 0.0])
+        record[0] += 1
+        record[1] += seconds
+
+    def add_event(self, event, **fields):
+        self.events.append({'time': time.perf_counter() - self._start, 'event': event, **fields})
+
+    def stop(self):
+        self.total_seconds = time.perf_counter() - self._start
+
+    def report(self):
+        """
+        Return the timings of the stages. Stages can be nested (e.g. the power flow within the results cache), so their times
+        can add up to more than the total.
+
+        Returns:
+        pd.DataFrame: One row per stage, in order of first call, with its 'calls', total 'seconds', 'mean_ms' per call and
+            'share' of the total run time.
+        """
+        total = self.total_seconds if self.total_seconds is not None else time.perf_counter() - self._start
+        df_report = pd.DataFrame([(name, calls, seconds) for name, (calls, seconds) in self.stages.items()], columns = ['stage', 'calls', 'seconds'])
+        df_report['mean_ms'] = df_report['seconds'] / df_report['calls'] * 1000
+        df_report['share'] = df_report['seconds'] / total if total > 0 else 0.0
+        return df_report
+
+    def to_json(self):
+        """Return the stages and trace events as a json string, e.g. to download or log them."""
+        return json.dumps({
+            'total_seconds': self.total_seconds,
+            'stages': self.report().to_dict('records'),
+            'events': self.events,
+        }, indent = 1, default = float)
+
+
+def start_recording(trace = False):
+    """
+    Start recording the stages of this thread.
+
+    Parameters:
+    trace (bool, optional): Whether trace events are recorded too. Defaults to False.
+
+    Returns:
+    Recorder: The new recorder.
+    """
+    _local.recorder = Recorder(trace)
+    return _local.recorder
+
+
+def stop_recording():
+    """
+    Stop recording the stages of this thread.
+
+    Returns:
+    Recorder or None: The recorder, with its total run time, or None if nothing was recorded.
+    """
+    recorder = getattr(_local, 'recorder', None)
+    _local.recorder = None
+    if recorder is not None:
+        recorder.stop()
+    return recorder
+
+
+def stage(name):
+    """Context manager adding the wall time of its block to the stage name of the current recorder, if any."""
+    recorder = getattr(_local, 'recorder', None)
+    return _NO_STAGE if recorder is None else recorder.stage(name)
+
+
+def begin_stage(name):
+    """Start timing a stage that does not fit in a with block (e.g. a long section of the dashboard script), see end_stage."""
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is not None:
+        recorder.begin(name)
+
+
+def end_stage(name):
+    """Stop timing a stage started with begin_stage."""
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is not None:
+        recorder.end(name)
+
+
+def tracing():
+    """Return whether trace events are recorded. Loops check it once, not at every step."""
+    recorder = getattr(_local, 'recorder', None)
+    return recorder is not None and recorder.trace
+
+
+def trace(event, **fields):
+    """Record a trace event with its fields (e.g. the timestep), if trace events are recorded."""
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is not None and recorder.trace:
+        recorder.add_event(event, **fields)
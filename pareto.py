@@ -0,0 +1,107 @@
+# In this module the trade-offs between cost, self-sufficiency, diesel use and curtailment are explored through Pareto fronts
+import numpy as np
+import pandas as pd
+from sweep import sweep_grid, iter_sweep
+
+# Objectives of the front and whether they are minimised or maximised
+PARETO_OBJECTIVES = {
+    'net_cost': 'min', # Yearly cost minus revenue in EUR
+    'renewable_fraction': 'max', # Share of the consumption supplied by solar, directly or through the battery
+    'diesel': 'min', # Yearly fuel consumption of the generators
+    'curtailment': 'min', # Yearly curtailed solar energy in MWh
+}
+
+
+def pareto_objectives(summary):
+    """
+    Compute the objectives of a scenario from its annual summary.
+
+    Parameters:
+    summary (dict): The annual summary of the scenario, see sweep.summarise_scenario.
+
+    Returns:
+    dict: The value of each objective of PARETO_OBJECTIVES.
+    """
+    consumption = summary['consumption']
+    renewable = summary['pv_consumption'] + summary['green_batt_consumption']
+    return {
+        'net_cost': - summary['balance'],
+        'renewable_fraction': renewable / consumption if consumption > 0 else 0.0,
+        'diesel': summary['gen_fuel'],
+        'curtailment': summary['pv_curtailment'],
+    }
+
+
+class ParetoFront:
+    """
+    Non-dominated set of scenarios, updated one scenario at a time. A scenario is dominated when another one is at least as
+    good on every objective; dominated scenarios are dropped, so only the useful trade-offs are kept in memory.
+
+    Parameters:
+    objectives (dict, optional): Mapping from objective to 'min' or 'max'. Defaults to PARETO_OBJECTIVES.
+    """
+
+    def __init__(self, objectives = None):
+        self.objectives = dict(PARETO_OBJECTIVES if objectives is None else objectives)
+        self._signs = np.array([1.0 if sense == 'min' else -1.0 for sense in self.objectives.values()]) # All objectives minimised
+        self._points = np.empty((0, len(self.objectives)))
+        self._rows = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, row, objectives):
+        """
+        Add a scenario to the front, unless it is dominated.
+
+        Parameters:
+        row (dict): The scenario (e.g. its input values), kept with the objectives.
+        objectives (dict): The value of each objective.
+
+        Returns:
+        bool: Whether the scenario is on the front.
+        """
+        point = self._signs * np.array([objectives[key] for key in self.objectives], dtype = float)
+        if np.isnan(point).any() or np.all(self._points <= point, axis = 1).any():
+            return False
+        keep = ~np.all(point <= self._points, axis = 1) # Scenarios dominated by the new one are dropped
+        self._points = np.vstack([self._points[keep], point])
+        self._rows = [existing for existing, kept in zip(self._rows, keep) if kept]
+        self._rows.append({**row, **{key: objectives[key] for key in self.objectives}})
+        return True
+
+    def to_dataframe(self):
+        """
+        Return the front.
+
+        Returns:
+        pd.DataFrame: One row per scenario of the front with its values and objectives, sorted by the first objective.
+        """
+        columns = list(self._rows[0]) if self._rows else list(self.objectives)
+        df_front = pd.DataFrame(self._rows, columns = columns)
+        return df_front.sort_values(list(self.objectives)[0], ignore_index = True)
+
+
+def explore_pareto(df_input, df_profiles, scenarios, workers = None, store_dir = None, front = None):
+    """
+    Evaluate the scenarios of a study in parallel and keep their Pareto front of cost, renewable fraction, diesel use and curtailment.
+
+    Parameters:
+    df_input (pd.DataFrame): The base input DataFrame.
+    df_profiles (pd.DataFrame, str or ProfileHandle): The consumption and PV production profiles, see sweep.run_sweep.
+    scenarios (pd.DataFrame, dict or list): The scenarios, see sweep.iter_sweep. A dict is expanded with sweep.sweep_grid.
+    workers (int, optional): Number of worker processes. Defaults to the number of cores.
+    store_dir (str, optional): Directory of a ResultStore shared with sweeps and the dashboard. Defaults to None (no store).
+    front (ParetoFront, optional): Front to update, e.g. from a previous study. Defaults to a new front with PARETO_OBJECTIVES.
+
+    Returns:
+    ParetoFront: The front of all the evaluated scenarios.
+    """
+    if isinstance(scenarios, dict):
+        scenarios = sweep_grid(scenarios)
+    if isinstance(scenarios, pd.DataFrame):
+        scenarios = scenarios.to_dict('records')
+    front = ParetoFront() if front is None else front
+    for values, summary in zip(scenarios, iter_sweep(df_input, df_profiles, scenarios, workers, store_dir)):
+        front.add({**values, 'shortage_consumption': summary['shortage_consumption']}, pareto_objectives(summary))
+    return front
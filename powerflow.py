@@ -1,5 +1,12 @@
 import pandas as pd 
 import numpy as np 
+from instrumentation import stage, begin_stage, end_stage, trace, tracing # Timings and trace events, recorded only when instrumentation is on
+from economic import generators_active
+
+try:
+    from numba import njit # Compiler for the timestep kernel of the power flow
+except ImportError: # Without numba the kernel runs as plain python on lists
+    njit = None
 
 
 def set_limits(vec, min_val, max_val):
@@ -7,14 +14,601 @@ def set_limits(vec, min_val, max_val):
     if isinstance(vec, float) or isinstance(vec, int): 
         return min(max_val, max(min_val, vec))
     else: 
+        if njit is not None and np.asarray(vec).dtype == np.float64: # Compiled loop, same values as the list below
+            return _limit_array(np.asarray(vec), float(min_val), float(max_val))
         return np.array([min(max_val, max(min_val, val)) for val in vec])
+
+
+# Version of the power flow results, part of the keys of stored results. It must be increased whenever a change alters the results
+ENGINE_VERSION = 1
+
+# Order of the columns of df_out 
+POWER_FLOW_COLUMNS = [
+    'consumption',
+    'pv_production',
+    'pv_consumption',
+    'grid_consumption',
+    'gen_consumption',
+    'batt_consumption',
+    'gen_battery',
+    'pv_battery',
+    'grid_battery',
+    'pv_curtailment',
+    'pv_grid',
+    'pv_balance',
+    'green_batt_consumption',
+    'grey_batt_consumption',
+    'blue_batt_consumption',
+    'gen_production',
+    'batt_flow',
+    'batt_outflow',
+    'batt_inflow',
+    'batt_soc_energy',
+    'grid_interface',
+    'grid_inflow',
+    'grid_outflow',
+    'shortage_consumption',
+]
+
+# Columns written by the timestep kernel (all but the two input profiles), in the order of the rows of its output
+KERNEL_COLUMNS = POWER_FLOW_COLUMNS[2:]
+
+
+def power_flow_dataframe(columns):
+    """
+    Build the df_out DataFrame from the power flow time series.
+
+    Parameters:
+    columns (dict): Mapping from column name to time series. It must contain all POWER_FLOW_COLUMNS, other keys are ignored.
+
+    Returns:
+    pd.DataFrame: The DataFrame df_out with the columns in the order of POWER_FLOW_COLUMNS.
+    """
+    return pd.DataFrame({name: columns[name] for name in POWER_FLOW_COLUMNS})
+
+
+# Columns of df_out that are exact functions of the other columns (and of the battery efficiency), see PowerFlowResults
+DERIVED_COLUMNS = [
+    'pv_balance',
+    'green_batt_consumption',
+    'grey_batt_consumption',
+    'blue_batt_consumption',
+    'batt_outflow',
+    'batt_inflow',
+    'grid_inflow',
+    'grid_outflow',
+]
+
+# Columns stored by PowerFlowResults, in the order of POWER_FLOW_COLUMNS
+PRIMARY_COLUMNS = [name for name in POWER_FLOW_COLUMNS if name not in DERIVED_COLUMNS]
+
+
+class PowerFlowResults:
+    """
+    Compact df_out: only the PRIMARY_COLUMNS are stored, optionally as float32, and the DERIVED_COLUMNS are computed when accessed.
+    In float64 every column equals the one of df_out exactly. In float32 the results take a third of the memory of df_out.
+
+    Parameters:
+    columns (dict or pd.DataFrame): The time series of at least the PRIMARY_COLUMNS (e.g. df_out). Other columns are ignored.
+    batt_efficiency (float): The battery efficiency of the run (the 'batt_efficiency' input), for the battery consumption by source.
+    index (pd.Index, optional): The index of the DataFrames and Series returned (e.g. the times of the profiles). Defaults to a RangeIndex.
+    dtype (optional): The type of the stored columns, np.float64 or np.float32. Defaults to np.float64.
+    """
+
+    def __init__(self, columns, batt_efficiency, index = None, dtype = np.float64):
+        self.columns = {name: np.asarray(columns[name], dtype = dtype) for name in PRIMARY_COLUMNS}
+        self.batt_efficiency = float(batt_efficiency)
+        self.dtype = np.dtype(dtype)
+        self.index = pd.RangeIndex(len(self.columns['consumption'])) if index is None else index
+
+    @classmethod
+    def from_dataframe(cls, df_out, batt_efficiency, dtype = np.float64):
+        """Return the compact results of a df_out DataFrame, with its index."""
+        return cls(df_out, batt_efficiency, df_out.index, dtype)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in POWER_FLOW_COLUMNS
+
+    def __sizeof__(self):
+        # Memory of the stored columns, for the size estimate of results_cache.size_of
+        return sum(values.nbytes for values in self.columns.values())
+
+    def astype(self, dtype):
+        """Return the results with the stored columns converted to dtype (e.g. np.float32)."""
+        return PowerFlowResults(self.columns, self.batt_efficiency, self.index, dtype)
+
+    def take(self, rows):
+        """Return the results of some rows (positions, e.g. timegrid.TimeGrid.rows)."""
+        return PowerFlowResults({name: values[rows] for name, values in self.columns.items()}, self.batt_efficiency, self.index[rows], self.dtype)
+
+    def values(self, name):
+        """
+        Return the time series of a column of df_out, stored or derived.
+
+        Parameters:
+        name (str): One of POWER_FLOW_COLUMNS.
+
+        Returns:
+        np.array: The values, in the type of the stored columns. Derived columns are computed as in the power flow kernel.
+        """
+        if name in self.columns:
+            return self.columns[name]
+        columns = self.columns
+        batt_efficiency_squared = self.dtype.type(self.batt_efficiency**2)
+        if name == 'pv_balance': # Summed in the order of the power flow
+            return columns['pv_production'] + columns['pv_consumption'] + columns['pv_battery'] + columns['pv_grid'] + columns['pv_curtailment']
+        elif name == 'green_batt_consumption':
+            return columns['pv_battery'] * batt_efficiency_squared
+        elif name == 'grey_batt_consumption':
+            return columns['gen_battery'] * batt_efficiency_squared
+        elif name == 'blue_batt_consumption':
+            return columns['grid_battery'] * batt_efficiency_squared
+        elif name == 'batt_outflow': # batt_flow and grid_interface have their signs changed for plotting
+            return _vmin(- columns['batt_flow'], 0.0)
+        elif name == 'batt_inflow':
+            return _vmax(- columns['batt_flow'], 0.0)
+        elif name == 'grid_inflow':
+            return _vmax(- columns['grid_interface'], 0.0)
+        elif name == 'grid_outflow':
+            return _vmin(- columns['grid_interface'], 0.0)
+        raise KeyError(name)
+
+    def __getitem__(self, name):
+        return pd.Series(self.values(name), index = self.index, name = name)
+
+    def to_dataframe(self, columns = None, dtype = None):
+        """
+        Return the results as df_out.
+
+        Parameters:
+        columns (list, optional): The columns to include. Defaults to all POWER_FLOW_COLUMNS, in their order.
+        dtype (optional): The type of the columns. Defaults to the type of the stored columns.
+
+        Returns:
+        pd.DataFrame: The DataFrame df_out, with the index of the results.
+        """
+        columns = POWER_FLOW_COLUMNS if columns is None else columns
+        dtype = self.dtype if dtype is None else dtype
+        return pd.DataFrame({name: self.values(name).astype(dtype, copy = False) for name in columns}, index = self.index)
+
+
+class PowerFlowSummary:
+    """
+    Summary record of calculate_power_flow_new(..., output = 'summary'). The running totals are kept as numpy arrays and the
+    pandas objects are only built when read as a dict: 'annual' (pd.Series, as df_out.sum()/4000), 'monthly' (pd.DataFrame, as
+    df_out.resample('M').sum()/4000), 'gen_hours' and 'shortage_hours'.
+
+    Parameters:
+    annual (np.array): Yearly energy of each of the POWER_FLOW_COLUMNS in MWh.
+    monthly (np.array): Monthly energy in MWh, one row per month and one column per POWER_FLOW_COLUMNS.
+    month_end (pd.DatetimeIndex): The last day of each month.
+    gen_hours (float): Yearly generator hours, as economic.generator_hours.
+    shortage_hours (float): Hours with consumption not satisfied.
+    """
+
+    def __init__(self, annual, monthly, month_end, gen_hours, shortage_hours):
+        self.annual = annual
+        self.monthly = monthly
+        self.month_end = month_end
+        self.gen_hours = float(gen_hours)
+        self.shortage_hours = float(shortage_hours)
+
+    def keys(self):
+        return ['annual', 'monthly', 'gen_hours', 'shortage_hours']
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __getitem__(self, key):
+        if key == 'annual':
+            return pd.Series(self.annual, index = POWER_FLOW_COLUMNS)
+        elif key == 'monthly':
+            return pd.DataFrame(self.monthly, index = self.month_end, columns = POWER_FLOW_COLUMNS)
+        elif key in ['gen_hours', 'shortage_hours']:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def annual_totals(self):
+        """Return the yearly energy of each column in MWh as a dict, without building the 'annual' Series."""
+        return dict(zip(POWER_FLOW_COLUMNS, self.annual.tolist()))
+
+
+# The helpers below reproduce exactly the python max, min and set_limits used in the step by step loop 
+# (first argument returned on ties and NaNs), so that the kernel gives bit-for-bit the same numbers.
+def _max(a, b):
+    return b if b > a else a
+
+def _min(a, b):
+    return b if b < a else a
+
+def _limit(val, min_val, max_val):
+    return _min(max_val, _max(min_val, val))
+
+def _limit_array(vec, min_val, max_val):
+    out = np.empty_like(vec)
+    for i in range(len(vec)):
+        out[i] = _limit(vec[i], min_val, max_val)
+    return out
+
+
+def _power_flow_kernel(consumption, pv_production, out, summary, period, acc, counters, state, steps_per_hour, grid_supply_capacity, grid_feedin_capacity, 
+                       batt_power_capacity, batt_energy_capacity, batt_efficiency, batt_soc_minimum, gen_capacity_1, gen_capacity_2, gen_capacity_3, 
+                       gen_trigger_1, gen_trigger_2, gen_trigger_3, grid_stored_energy_trigger):
+    # Timestep kernel of calculate_power_flow_new. Same logic as the python loop, written on scalars only so that numba can compile it. 
+    # out holds one row per column of KERNEL_COLUMNS and can be a 2D array or a list of lists.
+    # With summary, out rows have length 1 and each step is added to one row of the accumulators instead: acc[period[i]] for the month 
+    # of step i, the last row of acc for the steps without month (period[i] < 0); counters gets the generator hours and the shortage hours.
+    # state holds the battery energy and the three generator activations at the start, and is overwritten with the ones at the end, 
+    # so that a long profile can be run in consecutive chunks. steps_per_hour is the number of timesteps in one hour (4 for quarter-hours).
+    pv_consumption, grid_consumption, gen_consumption, batt_consumption, gen_battery, pv_battery, grid_battery, pv_curtailment, \
+        pv_grid, pv_balance, green_batt_consumption, grey_batt_consumption, blue_batt_consumption, gen_production, batt_flow, \
+        batt_outflow, batt_inflow, batt_soc_energy, grid_interface, grid_inflow, grid_outflow, shortage_consumption = out
+    
+    batt_power_limit = batt_power_capacity * batt_efficiency # Power imbalance above which the battery alone is not sufficient
+    batt_efficiency_squared = batt_efficiency**2
+    batt_soc_lower = batt_soc_minimum * batt_energy_capacity
+    step_hours = 1 / steps_per_hour
+    batt_soc = state[0] # Current battery state of charge
+    gen_on_1, gen_on_2, gen_on_3 = state[1], state[2], state[3] # Generation activation
+    gen_loss = 0.0 # Feature still to be implemented 
+
+    for i in range(len(consumption)):
+        
+        #----------------------- GENERATOR  ----------------------------------
+        grid_charging = not ((batt_soc >= grid_stored_energy_trigger) or (grid_stored_energy_trigger == 0)) # Type A
+        if grid_charging:
+            power_balance = consumption[i] + pv_production[i] - grid_supply_capacity
+        else:
+            power_balance = consumption[i] + pv_production[i]
+        
+        gen_on_1 = 1.0 if gen_capacity_1 != 0 and (power_balance >= batt_power_limit or batt_soc < gen_trigger_1 or batt_soc < batt_energy_capacity * gen_on_1) else 0.0
+        gen_on_2 = 1.0 if gen_capacity_2 != 0 and (power_balance - gen_capacity_1 >= batt_power_limit or batt_soc < gen_trigger_2 or batt_soc < batt_energy_capacity * gen_on_2) else 0.0
+        gen_on_3 = 1.0 if gen_capacity_3 != 0 and (power_balance - gen_capacity_1 - gen_capacity_2 >= batt_power_limit or batt_soc < gen_trigger_3 or batt_soc < batt_energy_capacity * gen_on_3) else 0.0
+        
+        gen_prod = -((gen_on_1 * gen_capacity_1 + gen_on_2 * gen_capacity_2) + gen_on_3 * gen_capacity_3) # Same summation order as np.sum
+        power_balance += gen_prod
+        
+        #----------------------- BATTERY ----------------------------------
+        batt_flow_desired = _max(0.0, - power_balance) * batt_efficiency + _min(0.0, - power_balance) / batt_efficiency
+        batt_flow_desired = _limit(batt_flow_desired, - batt_power_capacity, + batt_power_capacity)
+        batt_soc_new = _limit(batt_soc + batt_flow_desired / steps_per_hour, batt_soc_lower, batt_energy_capacity)
+        batt_flow_actual = (batt_soc_new - batt_soc)*steps_per_hour
+        batt_soc = batt_soc_new
+        if batt_flow_actual < 0:
+            batt_loss = -batt_flow_actual * (1 - batt_efficiency)
+        else:
+            batt_loss = -batt_flow_actual * (1 - 1 / batt_efficiency)
+        power_balance += batt_flow_actual + batt_loss
+        
+        #-------------------------------- GRID ----------------------------------
+        if (batt_soc >= grid_stored_energy_trigger) or (grid_stored_energy_trigger == 0): # Type B
+            grid_int = _limit(- power_balance, -grid_supply_capacity, grid_feedin_capacity)
+        else: # Type A
+            curtailment_total = _max(0.0, - grid_supply_capacity - grid_feedin_capacity - power_balance)
+            grid_int = _limit(- (grid_supply_capacity + power_balance + curtailment_total), -grid_supply_capacity, grid_feedin_capacity)
+        
+        #----------------------- CONSUMPTION and BATTERY FLOWS ----------------------------------
+        consumption_excess = consumption[i]
+        pv_cons = _max(0.0, _min(-pv_production[i], consumption_excess))
+        consumption_excess -= pv_cons
+        grid_cons = _max(0.0, _min(-_max(-grid_supply_capacity, grid_int), consumption_excess))
+        consumption_excess -= grid_cons
+        gen_cons = _max(0.0, _min(-gen_prod, consumption_excess))
+        consumption_excess -= gen_cons
+        batt_cons = _max(0.0, _min(_max(0.0, -batt_flow_actual), consumption_excess))
+        consumption_excess -= batt_cons
+        
+        # -min(0, x) in the python loop negates the integer 0, so zeros come out as +0.0 
+        gen_overproduction = _min(0.0, gen_prod + gen_cons + gen_loss + _max(0.0, batt_flow_actual + batt_loss))
+        gen_batt = gen_prod + gen_cons + gen_loss - gen_overproduction
+        gen_batt = -gen_batt if gen_batt < 0 else 0.0
+        grid_batt = grid_int + consumption[i]
+        grid_batt = -grid_batt if grid_batt < 0 else 0.0
+        pv_batt = _max(0.0, batt_flow_actual + batt_loss - gen_batt - grid_batt)
+        pv_curt = pv_cons + pv_batt + pv_production[i] + _max(0.0, grid_int)
+        pv_curt = -pv_curt if pv_curt < 0 else 0.0
+        pv_to_grid = -(pv_cons + pv_batt + pv_production[i] + pv_curt)
+        
+        j = 0 if summary else i
+        pv_consumption[j] = pv_cons
+        grid_consumption[j] = grid_cons
+        gen_consumption[j] = gen_cons
+        batt_consumption[j] = batt_cons
+        gen_battery[j] = gen_batt
+        pv_battery[j] = pv_batt
+        grid_battery[j] = grid_batt
+        pv_curtailment[j] = pv_curt
+        pv_grid[j] = pv_to_grid
+        pv_balance[j] = pv_production[i] + pv_cons + pv_batt + pv_to_grid + pv_curt
+        green_batt_consumption[j] = pv_batt * batt_efficiency_squared
+        grey_batt_consumption[j] = gen_batt * batt_efficiency_squared
+        blue_batt_consumption[j] = grid_batt * batt_efficiency_squared
+        gen_production[j] = gen_prod
+        batt_flow[j] = - batt_flow_actual # Signs changed for plotting 
+        batt_outflow[j] = _min(batt_flow_actual, 0.0)
+        batt_inflow[j] = _max(batt_flow_actual, 0.0)
+        batt_soc_energy[j] = batt_soc
+        grid_interface[j] = - grid_int # Signs changed for plotting 
+        grid_inflow[j] = _max(grid_int, 0.0)
+        grid_outflow[j] = _min(grid_int, 0.0)
+        shortage_consumption[j] = consumption_excess
+        
+        if summary: # One row per step: the total of the profile is added up from the rows afterwards
+            row = acc[period[i]] if period[i] >= 0 else acc[len(acc) - 1]
+            for k in range(len(out)):
+                row[k] += out[k][0]
+            
+            # Generator hours counted as in economic.generator_hours 
+            if gen_prod < 0:
+                if gen_prod >= - gen_capacity_1:
+                    counters[0] += step_hours
+                elif gen_prod >= - (gen_capacity_1 + gen_capacity_2):
+                    counters[0] += 2 * step_hours
+                else:
+                    counters[0] += 3 * step_hours
+            if consumption_excess > 0:
+                counters[1] += step_hours
+    
+    state[0] = batt_soc
+    state[1], state[2], state[3] = gen_on_1, gen_on_2, gen_on_3
+
+
+if njit is not None:
+    _max = njit(cache = True)(_max)
+    _min = njit(cache = True)(_min)
+    _limit = njit(cache = True)(_limit)
+    _limit_array = njit(cache = True)(_limit_array)
+    _power_flow_kernel = njit(cache = True)(_power_flow_kernel)
+
+
+# Fallback of the kernel when numba is not installed: without generators and grid charging the power flow is vectorised over time
+# with numpy (_power_flow_closed_form, bit-for-bit the results of the kernel). It is not an optimisation of the compiled kernel, 
+# which is faster (about 3 ms against 7.5 ms for a year of quarter-hours), but replaces the python loop (about 800 ms) without numba.
+def _closed_form_applies(consumption, pv_production, scalars):
+    # Without generators and without grid charging (grid_soc_trigger = 0) the battery energy only depends on the consumption and 
+    # PV production, and the power flow can be calculated without stepping through time (see _power_flow_closed_form)
+    grid_supply_capacity, grid_feedin_capacity, batt_power_capacity, batt_energy_capacity, batt_efficiency, batt_soc_minimum = scalars[:6]
+    return (scalars[6] == 0 and scalars[7] == 0 and scalars[8] == 0 and scalars[12] == 0 and batt_efficiency > 0 
+            and 0 <= batt_soc_minimum * batt_energy_capacity <= batt_energy_capacity 
+            and np.isfinite(consumption).all() and np.isfinite(pv_production).all())
+
+
+def _clipped_cumsum(steps, start, lower, upper, window = 384):
+    # Battery energy after each step of batt_soc = limit(batt_soc + step, lower, upper), computed segment by segment: sequential sums 
+    # (np.cumsum, same rounding as the loop) run until the energy leaves [lower, upper], where it is clipped and a new segment starts. 
+    # While the battery stays full (empty), the steps that would charge (discharge) it further are skipped at once.
+    n = len(steps)
+    soc = np.empty(n)
+    if lower == upper:
+        soc[:] = upper
+        return soc
+    discharging = np.flatnonzero(steps < 0)
+    charging = np.flatnonzero(steps > 0)
+    value = start
+    i = 0
+    while i < n:
+        if value == upper or value == lower:
+            candidates = discharging if value == upper else charging
+            position = np.searchsorted(candidates, i)
+            j = candidates[position] if position < len(candidates) else n
+            soc[i:j] = value
+            i = j
+            if i >= n:
+                break
+        segment = np.cumsum(np.concatenate(([value], steps[i:i + window])))[1:]
+        outside = np.flatnonzero((segment > upper) | (segment < lower))
+        if len(outside) == 0:
+            soc[i:i + len(segment)] = segment
+            value = segment[-1]
+            i += len(segment)
+        else:
+            k = outside[0]
+            soc[i:i + k] = segment[:k]
+            value = upper if segment[k] > upper else lower
+            soc[i + k] = value
+            i += k + 1
+    return soc
+
+
+def _power_flow_closed_form(consumption, pv_production, start_soc, steps_per_hour, grid_supply_capacity, grid_feedin_capacity, batt_power_capacity, 
+                            batt_energy_capacity, batt_efficiency, batt_soc_minimum):
+    # Power flow without generators and grid charging, vectorised over time: same operations as _power_flow_kernel in the same order, 
+    # so the results are identical. Returns the rows of KERNEL_COLUMNS.
+    gen_prod = - np.zeros(len(consumption)) # Generators off: -0.0 as in the kernel
+    power_balance = consumption + pv_production + gen_prod
+    batt_flow_desired = _vmax(0.0, - power_balance) * batt_efficiency + _vmin(0.0, - power_balance) / batt_efficiency
+    batt_flow_desired = _vlimit(batt_flow_desired, - batt_power_capacity, + batt_power_capacity)
+    batt_soc = _clipped_cumsum(batt_flow_desired / steps_per_hour, start_soc, batt_soc_minimum * batt_energy_capacity, batt_energy_capacity)
+    batt_flow_actual = (batt_soc - np.concatenate(([start_soc], batt_soc[:-1]))) * steps_per_hour
+    batt_loss = np.where(batt_flow_actual < 0, - batt_flow_actual * (1 - batt_efficiency), - batt_flow_actual * (1 - 1 / batt_efficiency))
+    power_balance = power_balance + (batt_flow_actual + batt_loss)
+    grid_int = _vlimit(- power_balance, - grid_supply_capacity, grid_feedin_capacity)
+    
+    consumption_excess = consumption
+    pv_cons = _vmax(0.0, _vmin(- pv_production, consumption_excess))
+    consumption_excess = consumption_excess - pv_cons
+    grid_cons = _vmax(0.0, _vmin(- _vmax(- grid_supply_capacity, grid_int), consumption_excess))
+    consumption_excess = consumption_excess - grid_cons
+    gen_cons = _vmax(0.0, _vmin(- gen_prod, consumption_excess))
+    consumption_excess = consumption_excess - gen_cons
+    batt_cons = _vmax(0.0, _vmin(_vmax(0.0, - batt_flow_actual), consumption_excess))
+    consumption_excess = consumption_excess - batt_cons
+    
+    gen_overproduction = _vmin(0.0, gen_prod + gen_cons + 0.0 + _vmax(0.0, batt_flow_actual + batt_loss))
+    gen_batt = gen_prod + gen_cons + 0.0 - gen_overproduction
+    gen_batt = np.where(gen_batt < 0, - gen_batt, 0.0)
+    grid_batt = grid_int + consumption
+    grid_batt = np.where(grid_batt < 0, - grid_batt, 0.0)
+    pv_batt = _vmax(0.0, batt_flow_actual + batt_loss - gen_batt - grid_batt)
+    pv_curt = pv_cons + pv_batt + pv_production + _vmax(0.0, grid_int)
+    pv_curt = np.where(pv_curt < 0, - pv_curt, 0.0)
+    pv_to_grid = -(pv_cons + pv_batt + pv_production + pv_curt)
+    batt_efficiency_squared = batt_efficiency**2
+    
+    return np.array([
+        pv_cons, grid_cons, gen_cons, batt_cons, gen_batt, pv_batt, grid_batt, pv_curt, pv_to_grid,
+        pv_production + pv_cons + pv_batt + pv_to_grid + pv_curt, 
+        pv_batt * batt_efficiency_squared, gen_batt * batt_efficiency_squared, grid_batt * batt_efficiency_squared,
+        gen_prod, - batt_flow_actual, _vmin(batt_flow_actual, 0.0), _vmax(batt_flow_actual, 0.0), batt_soc, 
+        - grid_int, _vmax(grid_int, 0.0), _vmin(grid_int, 0.0), consumption_excess,
+    ])
+
+
+def _call_power_flow_kernel(consumption, pv_production, scalars, summary = False, period = None, n_periods = 0, state = None, steps_per_hour = 4.0):
+    # Run the kernel with numpy arrays when it is compiled and with python lists otherwise. Returns out, acc and counters as arrays,
+    # with summary the rows of acc being the months then the whole profile.
+    # state (battery energy and generator activations, full battery and generators off if None) is updated in place with the final state.
+    # Without numba, configurations without generators and grid charging use the vectorised _power_flow_closed_form instead of the
+    # python loop. With numba the compiled kernel always runs, as it is faster than the vectorised version.
+    if state is None:
+        state = np.array([scalars[3], 0.0, 0.0, 0.0])
+    n = len(consumption)
+    n_out = 1 if summary else n
+    period = np.full(n, -1, dtype = np.int64) if period is None else np.asarray(period, dtype = np.int64)
+    consumption = np.asarray(consumption, dtype = float)
+    pv_production = np.asarray(pv_production, dtype = float)
+    if njit is None and n > 0 and _closed_form_applies(consumption, pv_production, scalars):
+        out = _power_flow_closed_form(consumption, pv_production, float(state[0]), float(steps_per_hour), *scalars[:6])
+        state[:] = [out[KERNEL_COLUMNS.index('batt_soc_energy'), -1], 0.0, 0.0, 0.0]
+        acc = np.zeros((n_periods + 1, len(KERNEL_COLUMNS)))
+        counters = np.zeros(2)
+        if summary: # np.bincount adds up the steps of each row in order, as the kernel does
+            row = np.where(period >= 0, period, n_periods)
+            for k, values in enumerate(out):
+                acc[:, k] = np.bincount(row, values, n_periods + 1)
+            acc[-1] = acc.sum(axis = 0)
+            shortage = np.flatnonzero(out[KERNEL_COLUMNS.index('shortage_consumption')] > 0)
+            counters[1] = np.bincount(np.zeros(len(shortage), dtype = np.int64), np.full(len(shortage), 1 / steps_per_hour), 1)[0]
+            out = out[:, -1:]
+        return out, acc, counters
+    if njit is not None:
+        out = np.zeros((len(KERNEL_COLUMNS), n_out))
+        acc = np.zeros((n_periods + 1, len(KERNEL_COLUMNS)))
+        counters = np.zeros(2)
+        _power_flow_kernel(consumption, pv_production, out, summary, period, acc, counters, state, float(steps_per_hour), *scalars)
+    else: 
+        out = [[0.0] * n_out for _ in KERNEL_COLUMNS] # Python floats in lists are much faster to index than numpy arrays
+        acc = [[0.0] * len(KERNEL_COLUMNS) for _ in range(n_periods + 1)]
+        counters = [0.0, 0.0]
+        final_state = [float(value) for value in state]
+        _power_flow_kernel(consumption.tolist(), pv_production.tolist(), out, summary, period.tolist(), acc, counters, final_state, float(steps_per_hour), *scalars)
+        state[:] = final_state
+    out, acc, counters = np.asarray(out, dtype = float), np.asarray(acc, dtype = float), np.asarray(counters, dtype = float) # No copy of the numba arrays
+    if summary:
+        acc[-1] = acc.sum(axis = 0) # Total of the profile: the months and the steps without month
+    return out, acc, counters
+
+
+def month_periods(df_profiles):
+    """
+    Find the month of each timestep of the profiles, for the monthly sums of the summary output. They only depend on the times, so
+    they are computed once per profiles (see sweep.prepare_profiles) and passed to every power flow run on them.
+
+    Parameters:
+    df_profiles (pd.DataFrame or ProfileHandle): The profiles. Without 'Time' column only the totals of the summary are kept.
+
+    Returns:
+    tuple: The month of each timestep as a position in the months of the profile (-1 where the time is missing, None without 
+        times), and the last day of each month (pd.DatetimeIndex).
+    """
+    if df_profiles is None or 'Time' not in df_profiles:
+        return None, pd.DatetimeIndex([])
+    time = df_profiles['Time']
+    if not pd.api.types.is_datetime64_any_dtype(time): # Times already parsed (e.g. by sweep.prepare_profiles) are not parsed again
+        time = pd.to_datetime(time)
+    months = np.asarray(time, dtype = 'datetime64[ns]').astype('datetime64[M]')
+    in_month = ~np.isnat(months)
+    month_index, period_in_month = np.unique(months[in_month], return_inverse = True)
+    period = np.full(len(months), -1, dtype = np.int64)
+    period[in_month] = period_in_month
+    month_end = pd.DatetimeIndex((month_index + np.timedelta64(1, 'M')).astype('datetime64[ns]')) - pd.Timedelta(days = 1)
+    return period, month_end
+
+
+def run_power_flow_kernel(consumption, pv_production, grid_supply_capacity, grid_feedin_capacity, batt_power_capacity, 
+                          batt_energy_capacity, batt_efficiency, batt_soc_minimum, gen_capacity, gen_stored_energy_trigger, grid_stored_energy_trigger, 
+                          output = 'dataframe', df_profiles = None, state = None, steps_per_hour = 4.0, periods = None):
+    """
+    Run the timestep kernel on prepared profiles.
+
+    Parameters:
+    consumption (np.array): Power consumption in +kW.
+    pv_production (np.array): PV power production in -kW, already limited to the PV capacity.
+    gen_capacity (np.array): Power capacity of the three generators in kW.
+    gen_stored_energy_trigger (np.array): Battery energy in kWh below which each generator starts.
+    output (str, optional): 'dataframe', 'compact' or 'summary', see calculate_power_flow_new. Defaults to 'dataframe'.
+    df_profiles (pd.DataFrame, optional): The profiles, whose 'Time' column gives the months of the summary.
+    state (np.array, optional): Battery energy in kWh and activation of the three generators at the start. It is updated in place with 
+        the ones at the end, to continue in the next chunk of a profile. Defaults to None (full battery, generators off).
+    steps_per_hour (float, optional): Number of timesteps per hour. Defaults to 4 (quarter-hours).
+    periods (tuple, optional): month_periods of df_profiles, when computed once for many runs. Defaults to computing them.
+    The remaining arguments are the scalar inputs of calculate_power_flow_new.
+
+    Returns:
+    pd.DataFrame, PowerFlowResults or PowerFlowSummary: The DataFrame df_out, identical to the one of the python loop, its 
+        compact results or the summary record.
+    """
+    scalars = [float(value) for value in [grid_supply_capacity, grid_feedin_capacity, batt_power_capacity, batt_energy_capacity, 
+                                          batt_efficiency, batt_soc_minimum, *gen_capacity, *gen_stored_energy_trigger, grid_stored_energy_trigger]]
+    if output in ['dataframe', 'compact']:
+        with stage('power_flow/kernel'):
+            out, _, _ = _call_power_flow_kernel(consumption, pv_production, scalars, state = state, steps_per_hour = steps_per_hour)
+        with stage('power_flow/dataframe'):
+            columns = dict(zip(KERNEL_COLUMNS, out))
+            columns['consumption'] = consumption
+            columns['pv_production'] = pv_production
+            if output == 'compact': # The derived rows of the kernel output are left out
+                return PowerFlowResults(columns, batt_efficiency)
+            return power_flow_dataframe(columns)
+    elif output != 'summary':
+        raise ValueError(f"Unknown power flow output '{output}'")
+    
+    period, month_end = month_periods(df_profiles) if periods is None else periods
+    with stage('power_flow/kernel'):
+        _, acc, counters = _call_power_flow_kernel(consumption, pv_production, scalars, True, period, len(month_end), state, steps_per_hour)
+    
+    # Rows of acc are the months then the whole profile, its columns the KERNEL_COLUMNS: the two input profiles are added in front
+    totals = np.empty((len(month_end) + 1, len(POWER_FLOW_COLUMNS)))
+    totals[:, 2:] = acc
+    if period is None:
+        totals[-1, 0], totals[-1, 1] = np.sum(consumption), np.sum(pv_production)
+    else: # Added up per month as in the kernel, the steps without month in the last row, then over all the rows
+        row = np.where(period >= 0, period, len(month_end))
+        totals[:, 0] = np.bincount(row, consumption, len(month_end) + 1)
+        totals[:, 1] = np.bincount(row, pv_production, len(month_end) + 1)
+        totals[-1, :2] = totals[:, :2].sum(axis = 0)
+    totals /= steps_per_hour * 1000 # Energy in MWh, as df_out.sum()/4000
+    return PowerFlowSummary(totals[-1], totals[:-1], month_end, counters[0], counters[1])
     
     
 
 # In this module the main function for carrying power flow calculations is defined 
-def calculate_power_flow_new(df_input, df_profiles):
+def calculate_power_flow_new(df_input, df_profiles, engine = 'kernel', output = 'dataframe', periods = None):
+    """
+    Carry out the power flow calculations over the whole profile.
 
-    df_in = df_input['Value'] # Just selecting the Value column for the calculations 
+    Parameters:
+    df_input (pd.DataFrame): The input variables, with their values in the 'Value' column.
+    df_profiles (pd.DataFrame or ProfileHandle): The consumption and PV production profiles, or a lazy handle on the profiles of 
+        a site in the profile library (see profile_library.ProfileLibrary.profile), of which only the used columns are read.
+    engine (str, optional): 'kernel' runs the timestep kernel (compiled with numba when available), 
+        'python' runs the original step by step loop. Both return the same df_out. Defaults to 'kernel'.
+    output (str, optional): 'dataframe' returns df_out. 'compact' returns it as PowerFlowResults, without the derived columns 
+        (e.g. calculate_power_flow_new(...).astype(np.float32) to keep many results in memory). 'summary' (kernel engine only) keeps running totals in the kernel instead of 
+        the time series and returns a summary record (PowerFlowSummary): 'annual' (as df_out.sum()/4000), 'monthly' (as 
+        df_out.resample('M').sum()/4000 on the 'Time' of df_profiles), 'gen_hours' and 'shortage_hours'. Defaults to 'dataframe'.
+    periods (tuple, optional): month_periods(df_profiles) for the summary output, computed once for all the runs on the same 
+        profiles (see sweep.prepare_profiles). Defaults to computing them.
+
+    Returns:
+    pd.DataFrame, PowerFlowResults or PowerFlowSummary: The DataFrame df_out with the time series of all power flows, its compact 
+        results, or the summary record.
+    """
+
+    df_in = df_input['Value'].astype(float) # Just selecting the Value column for the calculations, as floats so that every engine sees the same numbers
     grid_supply_capacity =  df_in['grid_supply_capacity']
     grid_feedin_capacity = df_in['grid_feedin_capacity']
     pv_capacity = df_in['pv_capacity']
@@ -49,7 +643,18 @@ def calculate_power_flow_new(df_input, df_profiles):
     gen_stored_energy_trigger = gen_soc_trigger * batt_energy_capacity # Minimum energy in the battery in kWh to charge froms generator
     grid_stored_energy_trigger = grid_soc_trigger * batt_energy_capacity # Minimum energy in the battery in kWh to charge from grid 
     
-    print(f"Grid stored energy trigger {grid_stored_energy_trigger}")
+    trace('grid_stored_energy_trigger', value = grid_stored_energy_trigger)
+    
+    if engine == 'kernel':
+        return run_power_flow_kernel(consumption, pv_production, grid_supply_capacity, grid_feedin_capacity, batt_power_capacity, 
+                                     batt_energy_capacity, batt_efficiency, batt_soc_minimum, gen_capacity, gen_stored_energy_trigger, grid_stored_energy_trigger, 
+                                     output, df_profiles, periods = periods)
+    elif engine != 'python':
+        raise ValueError(f"Unknown power flow engine '{engine}'")
+    elif output not in ['dataframe', 'compact']:
+        raise ValueError("The summary output needs the kernel engine")
+    trace_steps = tracing() # Checked once, the loop only records events when tracing
+    begin_stage('power_flow/python_loop')
     
     # Initialization of consumption vectors 
     pv_consumption = np.zeros(n); 
@@ -88,8 +693,8 @@ def calculate_power_flow_new(df_input, df_profiles):
             power_balance = consumption[i] + pv_production[i] # Energy balance before battery has no grid
         else: # (type A)
             power_balance = consumption[i] + pv_production[i] - grid_supply_capacity # Extra supply capacity needed by generators (battery and generator) in kW. If + there is excess demand, if - excess supply.
-            print('Grid charges battery')
-            print(f'Batt soc = {batt_soc}, Grid stored energy = {grid_stored_energy_trigger}')
+            if trace_steps:
+                trace('grid_charges_battery', step = i, batt_soc = batt_soc, grid_stored_energy_trigger = grid_stored_energy_trigger)
     #----------------------- GENERATOR  ----------------------------------
 
         # Condition for generator 1 to be on
@@ -204,6 +809,7 @@ def calculate_power_flow_new(df_input, df_profiles):
         # Changing signs for plotting 
         grid_interface[i] = -grid_interface[i]
         batt_flow[i] = - batt_flow[i]
+    end_stage('power_flow/python_loop')
         
 # creating a datframe with all the outputs 
     df_out = pd.DataFrame({
@@ -222,7 +828,6 @@ def calculate_power_flow_new(df_input, df_profiles):
         'green_batt_consumption': green_batt_consumption,
         'grey_batt_consumption': grey_batt_consumption,
         'blue_batt_consumption': blue_batt_consumption,
-        'blue_batt_consumption': blue_batt_consumption,
         'gen_production': gen_production,
         'batt_flow': batt_flow,
         'batt_outflow': batt_outflow,
@@ -233,10 +838,467 @@ def calculate_power_flow_new(df_input, df_profiles):
         'grid_outflow': grid_outflow,
         'shortage_consumption': shortage_consumption,
     })
+    if output == 'compact':
+        return PowerFlowResults.from_dataframe(df_out, batt_efficiency)
     return df_out
 
 
 
+def profile_chunks(df_profiles, chunk_size):
+    """
+    Split profiles into consecutive chunks for calculate_power_flow_stream.
+
+    Parameters:
+    df_profiles (pd.DataFrame or ProfileHandle): The profiles. With a ProfileHandle the chunks are slices of the memory-mapped 
+        columns, so only the chunk being computed is read from disk.
+    chunk_size (int): Number of timesteps per chunk.
+
+    Yields:
+    pd.DataFrame: The profile columns ('Time' if present, consumption and PV production) of each chunk.
+    """
+    columns = [column for column in ['Time', 'Consumption (kWh)', 'Production (kWh) per MWp'] if column in df_profiles]
+    for start in range(0, len(df_profiles), chunk_size):
+        yield pd.DataFrame({column: df_profiles[column].iloc[start:start + chunk_size] for column in columns})
+
+
+def calculate_power_flow_stream(df_input, chunks, step_minutes = 15, output = 'dataframe'):
+    """
+    Carry out the power flow calculations on a profile given as consecutive chunks (e.g. profile_chunks, or pd.read_csv with 
+    chunksize), for long or high resolution profiles that do not fit in memory at once. The battery energy and the generator 
+    activations are carried from one chunk to the next, so the results are the same as over the whole profile.
+
+    Parameters:
+    df_input (pd.DataFrame): The input variables, with their values in the 'Value' column.
+    chunks (iterable): The chunks of the profile, DataFrames with the 'Consumption (kWh)' and 'Production (kWh) per MWp' columns 
+        (energy per timestep) and optionally 'Time' for the monthly sums of the summary output.
+    step_minutes (float, optional): Length of a timestep in minutes. Defaults to 15.
+    output (str, optional): 'dataframe' yields df_out of each chunk, 'summary' yields the summary record of each chunk (see 
+        calculate_power_flow_new, with 'annual' holding the totals of the chunk), to be combined with combine_power_flow_summaries. 
+        Defaults to 'dataframe'.
+
+    Yields:
+    pd.DataFrame or dict: The power flows of each chunk, df_out indexed by timestep number from the start of the profile, or the summary record.
+    """
+    df_in = df_input['Value'].astype(float)
+    pv_capacity = df_in['pv_capacity']
+    pv_yield = df_in['pv_yield']
+    batt_energy_capacity = df_in['batt_energy_capacity']
+    gen_capacity = np.array([df_in['gen1_capacity'], df_in['gen2_capacity'], df_in['gen3_capacity']])
+    gen_soc_trigger = np.array([df_in['gen1_soc_trigger'], df_in['gen1_soc_trigger'], df_in['gen1_soc_trigger']])
+    gen_stored_energy_trigger = gen_soc_trigger * batt_energy_capacity # Minimum energy in the battery in kWh to charge froms generator
+    grid_stored_energy_trigger = df_in['grid_soc_trigger'] * batt_energy_capacity # Minimum energy in the battery in kWh to charge from grid 
+    steps_per_hour = 60 / step_minutes
+    
+    state = np.array([batt_energy_capacity, 0.0, 0.0, 0.0]) # Full battery and generators off at the start of the profile
+    start = 0
+    for df_chunk in chunks:
+        consumption = df_chunk['Consumption (kWh)'].to_numpy(dtype = float) * steps_per_hour # Power consumption in +kW
+        pv_production = - np.nan_to_num(df_chunk['Production (kWh) per MWp'], nan = 0.0) * pv_capacity * pv_yield / 947.55 * steps_per_hour # PV power production in -kW
+        pv_production = set_limits(pv_production, - pv_capacity * pv_yield, 0)
+        result = run_power_flow_kernel(consumption, pv_production, df_in['grid_supply_capacity'], df_in['grid_feedin_capacity'], df_in['batt_power_capacity'], 
+                                       batt_energy_capacity, df_in['batt_efficiency'], df_in['batt_soc_minimum'], gen_capacity, gen_stored_energy_trigger, 
+                                       grid_stored_energy_trigger, output, df_chunk, state, steps_per_hour)
+        if output == 'dataframe':
+            result.index = pd.RangeIndex(start, start + len(consumption))
+        start += len(consumption)
+        yield result
+
+
+def combine_power_flow_summaries(summaries):
+    """
+    Add up the summary records of consecutive chunks of a profile, see calculate_power_flow_stream.
+
+    Parameters:
+    summaries (iterable): The summary records of the chunks.
+
+    Returns:
+    dict: The summary record of the whole profile. Months split between chunks are added up.
+    """
+    annual, monthly, gen_hours, shortage_hours = None, [], 0.0, 0.0
+    for summary in summaries:
+        annual = summary['annual'] if annual is None else annual + summary['annual']
+        monthly.append(summary['monthly'])
+        gen_hours += summary['gen_hours']
+        shortage_hours += summary['shortage_hours']
+    if annual is None:
+        raise ValueError("No summaries to combine")
+    return {
+        'annual': annual,
+        'monthly': pd.concat(monthly).groupby(level = 0, sort = True).sum(),
+        'gen_hours': gen_hours,
+        'shortage_hours': shortage_hours,
+    }
+
+
+def _kernel_inputs(df_input, df_profiles):
+    # Power profiles and scalar inputs of the timestep kernel, computed as in calculate_power_flow_new
+    df_in = df_input['Value'].astype(float)
+    pv_capacity = df_in['pv_capacity']
+    pv_yield = df_in['pv_yield']
+    batt_energy_capacity = df_in['batt_energy_capacity']
+    gen_soc_trigger = np.array([df_in['gen1_soc_trigger'], df_in['gen1_soc_trigger'], df_in['gen1_soc_trigger']])
+    gen_stored_energy_trigger = gen_soc_trigger * batt_energy_capacity
+    grid_stored_energy_trigger = df_in['grid_soc_trigger'] * batt_energy_capacity
+    consumption = df_profiles['Consumption (kWh)'].to_numpy() * 4 # Power consumption in +kW
+    pv_production = - np.nan_to_num(df_profiles['Production (kWh) per MWp'], nan = 0.0) * pv_capacity * pv_yield / 947.55 * 4 # PV power production in -kW
+    pv_production = set_limits(pv_production, - pv_capacity * pv_yield, 0)
+    scalars = [float(value) for value in [df_in['grid_supply_capacity'], df_in['grid_feedin_capacity'], df_in['batt_power_capacity'], batt_energy_capacity, 
+                                          df_in['batt_efficiency'], df_in['batt_soc_minimum'], df_in['gen1_capacity'], df_in['gen2_capacity'], df_in['gen3_capacity'], 
+                                          *gen_stored_energy_trigger, grid_stored_energy_trigger]]
+    return np.asarray(consumption, dtype = float), np.asarray(pv_production, dtype = float), scalars
+
+
+def calculate_power_flow_incremental(df_input, df_profiles, previous = None, checkpoint_interval = 96):
+    """
+    Carry out the power flow calculations, reusing a previous run where the profiles did not change. The state of the battery 
+    and generators is kept at checkpoints every checkpoint_interval timesteps. When only part of the profiles changed (e.g. an 
+    uploaded consumption profile edited for one month), the calculation resumes from the last checkpoint before the first changed 
+    timestep and stops as soon as the state is back on the previous trajectory after the last changed timestep. 
+    The results are identical to those of calculate_power_flow_new.
+
+    Parameters:
+    df_input (pd.DataFrame): The input variables, with their values in the 'Value' column.
+    df_profiles (pd.DataFrame or ProfileHandle): The consumption and PV production profiles.
+    previous (dict, optional): The run returned by a previous call. It is reused only if the input variables and the number of 
+        timesteps are the same, otherwise everything is recomputed. Defaults to None.
+    checkpoint_interval (int, optional): Number of timesteps between checkpoints. Defaults to 96 (one day).
+
+    Returns:
+    dict: The run: 'df_out' (the DataFrame of calculate_power_flow_new), 'recomputed_steps' (the number of timesteps calculated), 
+        and the profiles, outputs and checkpoints to pass as previous to the next call.
+    """
+    consumption, pv_production, scalars = _kernel_inputs(df_input, df_profiles)
+    n = len(consumption)
+    n_intervals = -(-n // checkpoint_interval)
+    reusable = (previous is not None and previous['scalars'] == scalars and len(previous['consumption']) == n 
+                and previous['checkpoint_interval'] == checkpoint_interval)
+    
+    if reusable:
+        # Timesteps whose profile values differ (bit for bit, NaNs included) from the previous run
+        changed = np.flatnonzero((consumption.view(np.int64) != previous['consumption'].view(np.int64)) 
+                                 | (pv_production.view(np.int64) != previous['pv_production'].view(np.int64)))
+        if len(changed) == 0:
+            return {**previous, 'recomputed_steps': 0}
+        first_interval, last_changed = changed[0] // checkpoint_interval, changed[-1]
+        out = previous['out'].copy()
+        checkpoints = previous['checkpoints'].copy()
+    else:
+        first_interval, last_changed = 0, n - 1
+        out = np.zeros((len(KERNEL_COLUMNS), n))
+        checkpoints = np.zeros((n_intervals + 1, 4))
+        checkpoints[0] = [scalars[3], 0.0, 0.0, 0.0] # Full battery and generators off
+    
+    state = checkpoints[first_interval].copy()
+    recomputed_steps = 0
+    with stage('power_flow/kernel'):
+        for k in range(first_interval, n_intervals):
+            start, end = k * checkpoint_interval, min(n, (k + 1) * checkpoint_interval)
+            if reusable and start > last_changed and np.array_equal(state, previous['checkpoints'][k]):
+                break # Back on the previous trajectory with unchanged profiles: the rest of the previous run still holds
+            out[:, start:end], _, _ = _call_power_flow_kernel(consumption[start:end], pv_production[start:end], scalars, state = state)
+            checkpoints[k + 1] = state
+            recomputed_steps += end - start
+    
+    with stage('power_flow/dataframe'):
+        columns = dict(zip(KERNEL_COLUMNS, out))
+        columns['consumption'] = consumption
+        columns['pv_production'] = pv_production
+        df_out = power_flow_dataframe(columns)
+    return {
+        'df_out': df_out,
+        'recomputed_steps': recomputed_steps,
+        'consumption': consumption,
+        'pv_production': pv_production,
+        'scalars': scalars,
+        'out': out,
+        'checkpoints': checkpoints,
+        'checkpoint_interval': checkpoint_interval,
+    }
+
+
+
+# Transitions of the battery charge sources recorded by power_flow_events, in the order of their codes
+POWER_FLOW_EVENTS = [
+    'grid_charging_start', # The battery falls below the grid trigger (type A): the grid charges it
+    'grid_charging_stop',
+    'generator_on', # More generators running than in the previous timestep
+    'generator_off', # Fewer generators running
+    'shortage_start', # Consumption not satisfied
+    'shortage_end',
+]
+
+
+def power_flow_events(df_input, df_out, time_index = None, start_soc = None):
+    """
+    Extract the transitions of the battery charge sources from the power flows: start and stop of grid charging (type A), 
+    generators switched on and off, and start and end of shortages. They are found on the whole time series at once, 
+    so that the power flow loop does no bookkeeping or output at every timestep.
+
+    Parameters:
+    df_input (pd.DataFrame): The input variables of the power flow.
+    df_out (pd.DataFrame): The power flows, output of calculate_power_flow_new.
+    time_index (pd.Series or pd.DatetimeIndex, optional): The time of each timestep. Defaults to None (no times).
+    start_soc (float, optional): The battery energy in kWh before the first timestep. Defaults to None (full battery, as in 
+        calculate_power_flow_new). Generators are off and there is no grid charging nor shortage before the first timestep.
+
+    Returns:
+    dict: Compact arrays with one value per event, sorted by timestep: 'step' (timestep number), 'event' (code, position in 
+        POWER_FLOW_EVENTS), 'value' (battery energy in kWh for grid charging, number of running generators after the change, 
+        shortage in kW) and 'time' (if time_index is given).
+    """
+    df_in = df_input['Value'].astype(float)
+    batt_energy_capacity = df_in['batt_energy_capacity']
+    grid_stored_energy_trigger = df_in['grid_soc_trigger'] * batt_energy_capacity
+    gen_capacity = np.array([df_in['gen1_capacity'], df_in['gen2_capacity'], df_in['gen3_capacity']])
+    batt_soc = df_out['batt_soc_energy'].to_numpy(dtype = float)
+    shortage = df_out['shortage_consumption'].to_numpy(dtype = float)
+
+    # State of each source at each timestep, decided as in the power flow on the battery energy at the start of the step
+    batt_soc_start = np.concatenate([[batt_energy_capacity if start_soc is None else start_soc], batt_soc[:-1]])
+    grid_charging = ~((batt_soc_start >= grid_stored_energy_trigger) | (grid_stored_energy_trigger == 0))
+    running = generators_active(df_out['gen_production'].to_numpy(dtype = float), gen_capacity)
+    in_shortage = shortage > 0
+
+    steps, codes, values = [], [], []
+    for state, start_code, level in [(grid_charging, 0, batt_soc_start), (running, 2, running), (in_shortage, 4, shortage)]:
+        state = np.asarray(state, dtype = np.int8)
+        change = np.diff(state, prepend = np.int8(0))
+        step = np.flatnonzero(change)
+        steps.append(step)
+        codes.append(np.where(change[step] > 0, start_code, start_code + 1))
+        values.append(level[step])
+    steps = np.concatenate(steps)
+    order = np.argsort(steps, kind = 'stable')
+    events = {
+        'step': steps[order].astype(np.int32),
+        'event': np.concatenate(codes)[order].astype(np.int8),
+        'value': np.concatenate(values)[order].astype(np.float32),
+    }
+    if time_index is not None:
+        events['time'] = np.asarray(time_index, dtype = 'datetime64[ns]')[events['step']]
+    return events
+
+
+def events_dataframe(events):
+    """
+    Convert the events of power_flow_events into a DataFrame, e.g. for display.
+
+    Parameters:
+    events (dict): Output of power_flow_events.
+
+    Returns:
+    pd.DataFrame: One row per event with its 'time' (if any), 'step', 'event' name and 'value'.
+    """
+    df_events = pd.DataFrame({
+        'step': events['step'],
+        'event': pd.Categorical.from_codes(events['event'], categories = POWER_FLOW_EVENTS),
+        'value': events['value'],
+    })
+    if 'time' in events:
+        df_events.insert(0, 'time', events['time'])
+    return df_events
+
+
+# Input variables read by the power flow, i.e. the columns needed in the scenarios of calculate_power_flow_batch
+POWER_FLOW_INPUTS = [
+    'grid_supply_capacity', 'grid_feedin_capacity', 'pv_capacity', 'pv_yield', 'batt_power_capacity', 'batt_energy_capacity', 
+    'batt_efficiency', 'batt_soc_minimum', 'gen1_capacity', 'gen2_capacity', 'gen3_capacity', 'gen1_soc_trigger', 'grid_soc_trigger',
+]
+
+
+def batch_scenarios(inputs):
+    """
+    Stack the values of several df_input DataFrames into a scenarios DataFrame for calculate_power_flow_batch.
+
+    Parameters:
+    inputs (list): List of df_input DataFrames, each with a 'Value' column.
+
+    Returns:
+    pd.DataFrame: One row per scenario and one column per input variable.
+    """
+    return pd.DataFrame([df_input['Value'] for df_input in inputs]).reset_index(drop = True)
+
+
+# Vector versions of _max, _min and _limit, same tie and NaN behaviour as the scalar ones 
+def _vmax(a, b):
+    return np.where(b > a, b, a)
+
+def _vmin(a, b):
+    return np.where(b < a, b, a)
+
+def _vlimit(val, min_val, max_val):
+    return _vmin(max_val, _vmax(min_val, val))
+
+
+def _power_flow_vector(consumption, pv_production, out, grid_supply_capacity, grid_feedin_capacity, batt_power_capacity, 
+                       batt_energy_capacity, batt_efficiency, batt_soc_minimum, gen_capacity_1, gen_capacity_2, gen_capacity_3, 
+                       gen_trigger_1, gen_trigger_2, gen_trigger_3, grid_stored_energy_trigger):
+    # Same logic as _power_flow_kernel, stepping all scenarios together: every input and state variable is a vector with one value per scenario.
+    # pv_production has shape (timesteps, scenarios) and out maps the kept columns to arrays of the same shape.
+    batt_power_limit = batt_power_capacity * batt_efficiency
+    batt_efficiency_squared = batt_efficiency**2
+    batt_soc_lower = batt_soc_minimum * batt_energy_capacity
+    batt_soc = batt_energy_capacity.copy() # Current battery state of charge: full
+    gen_on_1 = np.zeros(len(batt_soc)) # Generation activation: off
+    gen_on_2 = np.zeros(len(batt_soc))
+    gen_on_3 = np.zeros(len(batt_soc))
+    gen_loss = 0.0
+    no_grid_trigger = grid_stored_energy_trigger == 0
+    stores = list(out.items())
+
+    for i in range(len(consumption)):
+        pv = pv_production[i]
+        
+        #----------------------- GENERATOR  ----------------------------------
+        grid_charging = ~((batt_soc >= grid_stored_energy_trigger) | no_grid_trigger) # Type A
+        power_balance = consumption[i] + pv
+        power_balance = np.where(grid_charging, power_balance - grid_supply_capacity, power_balance)
+        
+        gen_on_1 = ((gen_capacity_1 != 0) & ((power_balance >= batt_power_limit) | (batt_soc < gen_trigger_1) | (batt_soc < batt_energy_capacity * gen_on_1))) * 1.0
+        gen_on_2 = ((gen_capacity_2 != 0) & ((power_balance - gen_capacity_1 >= batt_power_limit) | (batt_soc < gen_trigger_2) | (batt_soc < batt_energy_capacity * gen_on_2))) * 1.0
+        gen_on_3 = ((gen_capacity_3 != 0) & ((power_balance - gen_capacity_1 - gen_capacity_2 >= batt_power_limit) | (batt_soc < gen_trigger_3) | (batt_soc < batt_energy_capacity * gen_on_3))) * 1.0
+        
+        gen_prod = -((gen_on_1 * gen_capacity_1 + gen_on_2 * gen_capacity_2) + gen_on_3 * gen_capacity_3)
+        power_balance = power_balance + gen_prod
+        
+        #----------------------- BATTERY ----------------------------------
+        batt_flow_desired = _vmax(0.0, - power_balance) * batt_efficiency + _vmin(0.0, - power_balance) / batt_efficiency
+        batt_flow_desired = _vlimit(batt_flow_desired, - batt_power_capacity, + batt_power_capacity)
+        batt_soc_new = _vlimit(batt_soc + batt_flow_desired / 4, batt_soc_lower, batt_energy_capacity)
+        batt_flow_actual = (batt_soc_new - batt_soc)*4
+        batt_soc = batt_soc_new
+        batt_loss = np.where(batt_flow_actual < 0, -batt_flow_actual * (1 - batt_efficiency), -batt_flow_actual * (1 - 1 / batt_efficiency))
+        power_balance = power_balance + (batt_flow_actual + batt_loss)
+        
+        #-------------------------------- GRID ----------------------------------
+        type_b = (batt_soc >= grid_stored_energy_trigger) | no_grid_trigger
+        curtailment_total = _vmax(0.0, - grid_supply_capacity - grid_feedin_capacity - power_balance)
+        grid_int = np.where(type_b, 
+                            _vlimit(- power_balance, -grid_supply_capacity, grid_feedin_capacity),
+                            _vlimit(- (grid_supply_capacity + power_balance + curtailment_total), -grid_supply_capacity, grid_feedin_capacity))
+        
+        #----------------------- CONSUMPTION and BATTERY FLOWS ----------------------------------
+        consumption_excess = consumption[i]
+        pv_cons = _vmax(0.0, _vmin(-pv, consumption_excess))
+        consumption_excess = consumption_excess - pv_cons
+        grid_cons = _vmax(0.0, _vmin(-_vmax(-grid_supply_capacity, grid_int), consumption_excess))
+        consumption_excess = consumption_excess - grid_cons
+        gen_cons = _vmax(0.0, _vmin(-gen_prod, consumption_excess))
+        consumption_excess = consumption_excess - gen_cons
+        batt_cons = _vmax(0.0, _vmin(_vmax(0.0, -batt_flow_actual), consumption_excess))
+        consumption_excess = consumption_excess - batt_cons
+        
+        gen_overproduction = _vmin(0.0, gen_prod + gen_cons + gen_loss + _vmax(0.0, batt_flow_actual + batt_loss))
+        gen_batt = gen_prod + gen_cons + gen_loss - gen_overproduction
+        gen_batt = np.where(gen_batt < 0, -gen_batt, 0.0)
+        grid_batt = grid_int + consumption[i]
+        grid_batt = np.where(grid_batt < 0, -grid_batt, 0.0)
+        pv_batt = _vmax(0.0, batt_flow_actual + batt_loss - gen_batt - grid_batt)
+        pv_curt = pv_cons + pv_batt + pv + _vmax(0.0, grid_int)
+        pv_curt = np.where(pv_curt < 0, -pv_curt, 0.0)
+        pv_to_grid = -(pv_cons + pv_batt + pv + pv_curt)
+        
+        step = {
+            'pv_consumption': pv_cons,
+            'grid_consumption': grid_cons,
+            'gen_consumption': gen_cons,
+            'batt_consumption': batt_cons,
+            'gen_battery': gen_batt,
+            'pv_battery': pv_batt,
+            'grid_battery': grid_batt,
+            'pv_curtailment': pv_curt,
+            'pv_grid': pv_to_grid,
+            'pv_balance': pv + pv_cons + pv_batt + pv_to_grid + pv_curt,
+            'green_batt_consumption': pv_batt * batt_efficiency_squared,
+            'grey_batt_consumption': gen_batt * batt_efficiency_squared,
+            'blue_batt_consumption': grid_batt * batt_efficiency_squared,
+            'gen_production': gen_prod,
+            'batt_flow': - batt_flow_actual,
+            'batt_outflow': _vmin(batt_flow_actual, 0.0),
+            'batt_inflow': _vmax(batt_flow_actual, 0.0),
+            'batt_soc_energy': batt_soc,
+            'grid_interface': - grid_int,
+            'grid_inflow': _vmax(grid_int, 0.0),
+            'grid_outflow': _vmin(grid_int, 0.0),
+            'shortage_consumption': consumption_excess,
+        }
+        for name, values in stores:
+            values[i] = step[name]
+
+
+def calculate_power_flow_batch(df_scenarios, df_profiles, columns = None, engine = None):
+    """
+    Carry out the power flow calculations for many scenarios (sizings) on the same profiles in one pass.
+
+    Parameters:
+    df_scenarios (pd.DataFrame): One row per scenario and one column per input variable (the 'Value' entries of df_input), 
+        see batch_scenarios. Must contain the POWER_FLOW_INPUTS.
+    df_profiles (pd.DataFrame): The consumption and PV production profiles shared by all scenarios.
+    columns (list, optional): The df_out columns to keep. Defaults to all POWER_FLOW_COLUMNS.
+    engine (str, optional): 'vector' steps all scenarios together with numpy vectors as state, 'kernel' runs the timestep kernel 
+        once per scenario. Defaults to 'kernel' when numba is available and 'vector' otherwise.
+
+    Returns:
+    dict: Mapping from column name to an array of shape (scenarios, timesteps). Row k equals the df_out column of scenario k.
+    """
+    if columns is None:
+        columns = POWER_FLOW_COLUMNS
+    if engine is None:
+        engine = 'kernel' if njit is not None else 'vector'
+    
+    values = {key: df_scenarios[key].to_numpy(dtype = float) for key in POWER_FLOW_INPUTS}
+    pv_capacity = values['pv_capacity'][:, None]
+    pv_yield = values['pv_yield'][:, None]
+    batt_energy_capacity = values['batt_energy_capacity']
+    
+    consumption = df_profiles['Consumption (kWh)'].to_numpy() * 4 # Power consumption in +kW, shared by all scenarios
+    pv_production_energy = np.nan_to_num(df_profiles['Production (kWh) per MWp'], nan = 0.0)
+    pv_production = - pv_production_energy[None, :] * pv_capacity * pv_yield / 947.55 * 4 # PV power production in -kW, one row per scenario
+    pv_production = _vlimit(pv_production, - pv_capacity * pv_yield, 0.0)
+    n_scenarios, n = pv_production.shape
+    
+    gen_stored_energy_trigger = values['gen1_soc_trigger'] * batt_energy_capacity # The power flow uses the generator 1 trigger for all generators
+    parameters = [values['grid_supply_capacity'], values['grid_feedin_capacity'], values['batt_power_capacity'], batt_energy_capacity, 
+                  values['batt_efficiency'], values['batt_soc_minimum'], values['gen1_capacity'], values['gen2_capacity'], values['gen3_capacity'], 
+                  gen_stored_energy_trigger, gen_stored_energy_trigger, gen_stored_energy_trigger, values['grid_soc_trigger'] * batt_energy_capacity]
+    
+    results = {}
+    kernel_columns = [name for name in columns if name in KERNEL_COLUMNS]
+    if engine == 'vector':
+        out = {name: np.empty((n, n_scenarios)) for name in kernel_columns} # Time major, so that each step writes contiguous memory
+        _power_flow_vector(consumption, np.ascontiguousarray(pv_production.T), out, *parameters)
+        results.update({name: out[name].T for name in kernel_columns})
+    elif engine == 'kernel':
+        rows = [KERNEL_COLUMNS.index(name) for name in kernel_columns]
+        results.update({name: np.empty((n_scenarios, n)) for name in kernel_columns})
+        for k in range(n_scenarios):
+            out, _, _ = _call_power_flow_kernel(consumption, pv_production[k], [float(value[k]) for value in parameters])
+            for name, row in zip(kernel_columns, rows):
+                results[name][k] = out[row]
+    else:
+        raise ValueError(f"Unknown power flow engine '{engine}'")
+    
+    if 'consumption' in columns:
+        results['consumption'] = np.broadcast_to(consumption, (n_scenarios, n))
+    if 'pv_production' in columns:
+        results['pv_production'] = pv_production
+    return {name: results[name] for name in columns}
+
+
+def batch_dataframe(results, scenario):
+    """
+    Extract the df_out DataFrame of one scenario from the output of calculate_power_flow_batch.
+
+    Parameters:
+    results (dict): Output of calculate_power_flow_batch, computed with all columns.
+    scenario (int): Position of the scenario in df_scenarios.
+
+    Returns:
+    pd.DataFrame: The df_out of the scenario, equal to the one of calculate_power_flow_new.
+    """
+    return power_flow_dataframe({name: results[name][scenario] for name in POWER_FLOW_COLUMNS})
+
+
 # In this module the main function for carrying power flow calculations is defined 
 def calculate_power_flow_old(df_input, df_profiles):
 
@@ -421,7 +1483,6 @@ def calculate_power_flow_old(df_input, df_profiles):
         'green_batt_consumption': green_batt_consumption,
         'grey_batt_consumption': grey_batt_consumption,
         'blue_batt_consumption': blue_batt_consumption,
-        'blue_batt_consumption': blue_batt_consumption,
         'gen_production': gen_production,
         'batt_flow': batt_flow,
         'batt_outflow': batt_outflow,
@@ -0,0 +1,205 @@
+# In this module a library of consumption and PV production profiles of many sites and years is kept in one directory
+import json
+import os
+import re
+import tempfile
+import pandas as pd
+import numpy as np
+from helpers import profiles_to_binary, read_profiles_header, read_profile_column, profiles_time_index
+
+CONSUMPTION_COLUMN = 'Consumption (kWh)'
+PV_COLUMN = 'Production (kWh) per MWp'
+INDEX_FILE = 'index.json'
+
+
+def _file_name(*parts):
+    # Name of a profile file in the library, from the site or PV shape name, year and resolution
+    return '_'.join(re.sub(r'[^\w-]', '_', str(part)) for part in parts)
+
+
+class ProfileHandle:
+    """
+    Lazy handle on the profiles of a site and year in a ProfileLibrary. It can be used as df_profiles (e.g. by
+    calculate_power_flow_new): each column is memory-mapped from its file on first access and no other column is read.
+
+    Parameters:
+    files (dict): Mapping from column name ('Consumption (kWh)', 'Production (kWh) per MWp') to the binary profile file
+        (without the '.bin' extension) holding it. All files must have the same time grid.
+    """
+
+    def __init__(self, files):
+        self.files = dict(files)
+        self._headers = {column: read_profiles_header(filename) for column, filename in self.files.items()}
+        self._columns = {}
+        grids = {(header['start'], header['step_minutes'], header['periods'], header['length']) for header in self._headers.values()}
+        if len(grids) > 1:
+            raise ValueError(f"The profile files {list(self.files.values())} do not have the same time grid")
+
+    def __getstate__(self):
+        # Only the file names are pickled (e.g. sent to the workers of a sweep), the columns are mapped again on access
+        return {'files': self.files}
+
+    def __setstate__(self, state):
+        self.__init__(state['files'])
+
+    @property
+    def columns(self):
+        return ['Time'] + list(self.files)
+
+    @property
+    def step_minutes(self):
+        return next(iter(self._headers.values()))['step_minutes']
+
+    def __contains__(self, column):
+        return column in self.columns
+
+    def __len__(self):
+        return next(iter(self._headers.values()))['length']
+
+    def __getitem__(self, column):
+        """Return a column as a pd.Series, loading it on first access."""
+        if column not in self._columns:
+            if column == 'Time':
+                values = profiles_time_index(next(iter(self._headers.values())))
+            elif column in self.files:
+                values = read_profile_column(self.files[column], column, self._headers[column])
+            else:
+                raise KeyError(column)
+            self._columns[column] = pd.Series(values, name = column, copy = False)
+        return self._columns[column]
+
+    def to_dataframe(self, columns = None):
+        """
+        Load the profiles into a DataFrame, as read from Input_profiles.csv.
+
+        Parameters:
+        columns (list, optional): The columns to load. Defaults to all of them.
+
+        Returns:
+        pd.DataFrame: The profiles. The columns are memory-mapped (read-only) until they are reassigned.
+        """
+        columns = self.columns if columns is None else columns
+        df_profiles = pd.DataFrame(index = pd.RangeIndex(len(self)))
+        for column in columns:
+            df_profiles[column] = self[column]
+        return df_profiles
+
+
+class ProfileLibrary:
+    """
+    Library of consumption profiles of many sites and years, at one or more resolutions, with an index of all the profiles
+    in one directory. PV production per MWp depends only on the location, so it is stored once per PV shape (e.g. a region)
+    and shared by all the sites that refer to it. Profiles are stored in the binary format of helpers.profiles_to_binary and
+    only the columns that are used are read (see ProfileHandle).
+
+    Parameters:
+    directory (str): Directory of the library. It is created if needed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok = True)
+        self._index = self._read_index()
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {'sites': [], 'pv_shapes': []}
+
+    def _write_index(self):
+        # Written to a temporary file and renamed, so readers never see a partial index
+        handle, temporary_path = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+        with os.fdopen(handle, 'w') as file:
+            json.dump(self._index, file, indent = 1)
+        os.replace(temporary_path, os.path.join(self.directory, INDEX_FILE))
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def add_pv_shape(self, name, year, df_profiles, step_minutes = 15, timezone = 'Europe/Amsterdam'):
+        """
+        Add (or replace) a PV production shape.
+
+        Parameters:
+        name (str): The name of the PV shape, e.g. the region of the sites using it.
+        year (int): The year of the profile.
+        df_profiles (pd.DataFrame): The profile, with the 'Time' and 'Production (kWh) per MWp' columns.
+        step_minutes (int, optional): The timestep of the profile in minutes. Defaults to 15.
+        timezone (str, optional): Timezone of the profile times, see helpers.profiles_to_binary. Defaults to 'Europe/Amsterdam'.
+        """
+        file = _file_name('pv', name, year, f'{step_minutes}min')
+        profiles_to_binary(df_profiles[['Time', PV_COLUMN]], self._path(file), step_minutes, timezone)
+        entries = [entry for entry in self._index['pv_shapes'] if (entry['name'], entry['year'], entry['step_minutes']) != (name, year, step_minutes)]
+        entries.append({'name': name, 'year': year, 'step_minutes': step_minutes, 'file': file})
+        self._index['pv_shapes'] = entries
+        self._write_index()
+
+    def add_site(self, site, year, df_profiles, pv_shape, step_minutes = 15, timezone = 'Europe/Amsterdam'):
+        """
+        Add (or replace) the consumption profile of a site. If df_profiles also has a PV production column and the PV shape
+        is not in the library yet for this year and resolution, it is added as well.
+
+        Parameters:
+        site (str): The name of the site.
+        year (int): The year of the profile.
+        df_profiles (pd.DataFrame): The profile, with the 'Time' and 'Consumption (kWh)' columns (e.g. read from Input_profiles.csv).
+        pv_shape (str): The name of the PV shape of the site.
+        step_minutes (int, optional): The timestep of the profile in minutes. Defaults to 15.
+        timezone (str, optional): Timezone of the profile times, see helpers.profiles_to_binary. Defaults to 'Europe/Amsterdam'.
+        """
+        file = _file_name('site', site, year, f'{step_minutes}min')
+        profiles_to_binary(df_profiles[['Time', CONSUMPTION_COLUMN]], self._path(file), step_minutes, timezone)
+        entries = [entry for entry in self._index['sites'] if (entry['site'], entry['year'], entry['step_minutes']) != (site, year, step_minutes)]
+        entries.append({'site': site, 'year': year, 'step_minutes': step_minutes, 'pv_shape': pv_shape, 'file': file})
+        self._index['sites'] = entries
+        self._write_index()
+        if PV_COLUMN in df_profiles and self._pv_shape_entry(pv_shape, year, step_minutes) is None:
+            self.add_pv_shape(pv_shape, year, df_profiles, step_minutes, timezone)
+
+    def _pv_shape_entry(self, name, year, step_minutes):
+        for entry in self._index['pv_shapes']:
+            if (entry['name'], entry['year'], entry['step_minutes']) == (name, year, step_minutes):
+                return entry
+        return None
+
+    def entries(self):
+        """
+        Return the index of the site profiles.
+
+        Returns:
+        pd.DataFrame: One row per site profile with its site, year, step_minutes, pv_shape and file.
+        """
+        return pd.DataFrame(self._index['sites'], columns = ['site', 'year', 'step_minutes', 'pv_shape', 'file'])
+
+    def sites(self):
+        """Return the names of the sites in the library."""
+        return sorted({entry['site'] for entry in self._index['sites']})
+
+    def years(self, site):
+        """Return the years with a profile of a site."""
+        return sorted({entry['year'] for entry in self._index['sites'] if entry['site'] == site})
+
+    def profile(self, site, year, step_minutes = 15):
+        """
+        Return a lazy handle on the profiles of a site, that can be passed as df_profiles to calculate_power_flow_new.
+
+        Parameters:
+        site (str): The name of the site.
+        year (int): The year of the profiles.
+        step_minutes (int, optional): The resolution of the profiles in minutes. Defaults to 15.
+
+        Returns:
+        ProfileHandle: The consumption of the site and the PV production of its PV shape.
+        """
+        for entry in self._index['sites']:
+            if (entry['site'], entry['year'], entry['step_minutes']) == (site, year, step_minutes):
+                break
+        else:
+            raise KeyError(f"No {step_minutes} minutes profile of site '{site}' in {year}")
+        files = {CONSUMPTION_COLUMN: self._path(entry['file'])}
+        pv_entry = self._pv_shape_entry(entry['pv_shape'], year, step_minutes)
+        if pv_entry is not None:
+            files[PV_COLUMN] = self._path(pv_entry['file'])
+        return ProfileHandle(files)
@@ -0,0 +1,249 @@
+# In this module the results of the power flow and economical calculations are cached, keyed on the content of their inputs
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+import pandas as pd
+import numpy as np
+
+
+def hash_inputs(df_input, keys = None):
+    """
+    Hash the numeric values of an input DataFrame.
+
+    Parameters:
+    df_input (pd.DataFrame): The input DataFrame, with the values in the 'Value' column.
+    keys (list, optional): Only hash these input variables (e.g. the ones read by the power flow). Defaults to all of them.
+
+    Returns:
+    str: Hex digest identifying the values.
+    """
+    values = df_input['Value'] if keys is None else df_input.loc[keys, 'Value']
+    digest = hashlib.sha1()
+    digest.update('|'.join(values.index).encode())
+    digest.update(np.asarray(values, dtype = float).tobytes())
+    return digest.hexdigest()
+
+
+def hash_profiles(df_profiles, columns = ('Consumption (kWh)', 'Production (kWh) per MWp')):
+    """
+    Hash the profile arrays used by the power flow.
+
+    Parameters:
+    df_profiles (pd.DataFrame): The consumption and PV production profiles.
+    columns (tuple, optional): The profile columns to hash.
+
+    Returns:
+    str: Hex digest identifying the profiles.
+    """
+    digest = hashlib.sha1()
+    for column in columns:
+        digest.update(column.encode())
+        digest.update(np.ascontiguousarray(df_profiles[column], dtype = float).tobytes())
+    return digest.hexdigest()
+
+
+def size_of(value):
+    """
+    Estimate the memory used by a cached value in bytes.
+
+    Parameters:
+    value: A DataFrame, Series, numpy array, or a dict, list or tuple of them.
+
+    Returns:
+    int: The estimated size in bytes.
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index = True, deep = True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index = True, deep = True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(size_of(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(size_of(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class ResultStore:
+    """
+    Persistent store of results on disk, shared between processes (dashboard replicas, sweeps) and kept across restarts.
+    Each result is a pickle file named after the hash of its key, so identical results are stored once. Files are written 
+    to a temporary name and then renamed, so concurrent readers never see partial results. When the store grows beyond 
+    max_bytes the least recently read results are removed.
+
+    Parameters:
+    directory (str): Directory of the store. It is created if needed.
+    max_bytes (int, optional): Maximum size of the store on disk. Defaults to 4 GB.
+    """
+
+    def __init__(self, directory, max_bytes = 4 * 2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok = True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + '.pkl')
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key, default = None):
+        """
+        Return the stored value of key, or default if it is not stored. A result that cannot be loaded (truncated file, or
+        pickled with classes or library versions that changed since, e.g. a PowerFlowSummary of an older engine) is removed
+        from the store and default is returned, so that it is computed and stored again.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                value = pickle.load(file)
+        except FileNotFoundError: # Missing, or removed by another process while reading
+            return default
+        except (EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError): # ModuleNotFoundError is an ImportError
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return default
+        try:
+            os.utime(path) # Marking the result as recently used for the eviction
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        """Store value under key, unless it is already stored, and evict old results beyond max_bytes."""
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        handle, temporary_path = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                pickle.dump(value, file, protocol = pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used results until the store fits in max_bytes."""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pkl'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError: # Already removed by another process
+                pass
+            total -= size
+
+    def clear(self):
+        """Remove all stored results."""
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pkl'):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+class ResultsCache:
+    """
+    In-memory cache of results with least-recently-used eviction, bounded in number of entries and in memory.
+    It can be shared between threads (e.g. the sessions of a Streamlit server). With a ResultStore, results missing 
+    from memory are looked up on disk, and computed results are also written to disk.
+
+    Parameters:
+    max_entries (int, optional): Maximum number of cached results. Defaults to 32.
+    max_bytes (int, optional): Maximum memory used by the cached results, as estimated by size_of. Defaults to 512 MB.
+    store (ResultStore, optional): Persistent store behind the memory cache. Defaults to None (memory only).
+    """
+
+    def __init__(self, max_entries = 32, max_bytes = 512 * 2**20, store = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key: (value, size), least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    def get(self, key, default = None):
+        """Return the cached value of key (marking it as recently used), or default."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][0]
+
+    def put(self, key, value):
+        """Store value under key and evict the least recently used results beyond the limits. Values larger than max_bytes are not stored."""
+        size = size_of(value)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last = False)
+                self._bytes -= evicted_size
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value of key, computing and storing it on a miss.
+
+        Parameters:
+        key (hashable): The content key of the result, e.g. built from hash_inputs and hash_profiles.
+        compute (callable): Function without arguments that computes the result.
+
+        Returns:
+        The cached or computed result. It is shared with later calls, so it must not be modified.
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing and self.store is not None:
+            value = self.store.get(key, missing)
+            if value is not missing:
+                self.put(key, value)
+        if value is missing:
+            value = compute()
+            self.put(key, value)
+            if self.store is not None:
+                self.store.put(key, value)
+        return value
+
+    def clear(self):
+        """Remove all cached results."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
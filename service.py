@@ -0,0 +1,307 @@
+# In this module a local HTTP service runs simulations for other applications (e.g. a quoting front end or the dashboard).
+# The profiles stay in memory, the engine stays compiled, and concurrent requests are coalesced into batched power flow calls
+#
+# use: python service.py [--port 8510] [--profiles Input_profiles] [--workers 2]
+#
+#      POST /simulate {"inputs": {"pv_capacity": 1500, "number_generators": 1}, "series": {"columns": ["batt_soc_energy"], "points": 500}}
+#          returns {"summary": {...}} (see sweep.summarise_scenario) and, if "series" is given, {"series": {"time": [...], "batt_soc_energy": [...]}}
+#      POST /simulate {"scenarios": [{"inputs": {...}}, ...]} returns {"results": [...]}, one result per scenario
+#      GET /status returns the number of requests and batches served
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+from powerflow import calculate_power_flow_batch, batch_scenarios, POWER_FLOW_COLUMNS
+from economic import calculate_costs, generator_hours
+from helpers import pickle_read, update_profiles_binary
+from sweep import prepare_profiles, scenario_input, summarise_scenario
+
+# Profiles of a worker process, set once per worker by _init_worker
+_worker_profiles = None
+
+
+def downsample_series(values, points):
+    """
+    Reduce a time series to at most points values, as the means of consecutive buckets of equal length.
+
+    Parameters:
+    values (np.array): The time series.
+    points (int): The maximum number of values.
+
+    Returns:
+    tuple: The position of the first timestep of each bucket and the mean of each bucket.
+    """
+    n = len(values)
+    if points is None or n <= points:
+        return np.arange(n), np.asarray(values, dtype = float)
+    starts = np.arange(points) * n // points
+    return starts, np.add.reduceat(np.asarray(values, dtype = float), starts) / np.diff(np.append(starts, n))
+
+
+def simulate_batch(inputs, series, df_profiles):
+    """
+    Run the power flow and economic calculations of several scenarios in one batched power flow call.
+
+    Parameters:
+    inputs (list): The input values of each scenario (dict of every input variable, the 'Value' column of df_input).
+    series (list): For each scenario None, or the requested time series: dict with 'columns' (names of df_out columns)
+        and 'points' (maximum number of values per series, see downsample_series, None for all).
+    df_profiles (pd.DataFrame): The profiles, with parsed times.
+
+    Returns:
+    list: One response per scenario: dict with the 'summary' (see sweep.summarise_scenario) and the 'series' if requested.
+    """
+    results = calculate_power_flow_batch(batch_scenarios([pd.DataFrame({'Value': pd.Series(values)}) for values in inputs]), df_profiles)
+    times = np.asarray(df_profiles['Time'], dtype = 'datetime64[s]') if 'Time' in df_profiles else None
+    responses = []
+    for k, (values, requested) in enumerate(zip(inputs, series)):
+        df_scenario = pd.DataFrame({'Value': pd.Series(values)})
+        gen_capacity = [values['gen1_capacity'], values['gen2_capacity'], values['gen3_capacity']]
+        power_flow_summary = {
+            'annual': pd.Series({name: results[name][k].sum() / 4000 for name in POWER_FLOW_COLUMNS}), # As df_out.sum()/4000
+            'gen_hours': float(generator_hours(results['gen_production'][k], gen_capacity)),
+            'shortage_hours': float((results['shortage_consumption'][k] > 0).sum() * 0.25),
+        }
+        summary = summarise_scenario(df_scenario, power_flow_summary, calculate_costs(df_scenario, power_flow_summary))
+        response = {'summary': {key: float(value) for key, value in summary.items()}}
+        if requested is not None:
+            response['series'] = {}
+            for name in requested['columns']:
+                starts, response['series'][name] = downsample_series(results[name][k], requested.get('points'))
+                response['series'][name] = response['series'][name].tolist()
+            if times is not None and requested['columns']:
+                response['series']['time'] = np.datetime_as_string(times[starts]).tolist()
+        responses.append(response)
+    return responses
+
+
+def _init_worker(profiles):
+    # Keep the profiles in the worker for all its batches, see sweep._init_worker
+    global _worker_profiles
+    _worker_profiles, _ = prepare_profiles(pd.DataFrame(profiles) if isinstance(profiles, dict) else profiles)
+
+
+def _simulate_worker_batch(inputs, series):
+    return simulate_batch(inputs, series, _worker_profiles)
+
+
+class SimulationService:
+    """
+    Simulation service: requests submitted from any thread are collected for up to max_wait seconds (or until max_batch of them
+    are waiting) and run together with calculate_power_flow_batch, in this process or in a pool of worker processes.
+
+    Parameters:
+    df_input (pd.DataFrame): The default inputs, completed by the values of each request.
+    df_profiles (pd.DataFrame, str or ProfileHandle): The profiles of all the requests, see sweep.prepare_profiles.
+    workers (int, optional): Number of worker processes running batches at the same time. Defaults to 1 (batches run in a thread of this process).
+    max_batch (int, optional): Maximum number of scenarios in one batch. Defaults to 16.
+    max_wait (float, optional): Time in seconds to wait for more requests before running a batch. Defaults to 0.01.
+    """
+
+    def __init__(self, df_input, df_profiles, workers = 1, max_batch = 16, max_wait = 0.01):
+        self.df_input = df_input
+        self.df_profiles, payload = prepare_profiles(df_profiles)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = 0
+        self.batches = 0
+        self._queue = queue.Queue()
+        self._executor = ProcessPoolExecutor(max_workers = workers, initializer = _init_worker, initargs = (payload,)) if workers > 1 else None
+        self._slots = threading.Semaphore(max(1, workers)) # Batches running at the same time
+        self._thread = threading.Thread(target = self._collect, daemon = True)
+        self._thread.start()
+
+    def scenario_values(self, inputs):
+        """
+        Complete the values of a request with the default inputs, as sweep.scenario_input.
+
+        Parameters:
+        inputs (dict): Mapping from input variable to its value.
+
+        Returns:
+        dict: The values of every input variable.
+        """
+        unknown = set(inputs) - set(self.df_input.index)
+        if unknown:
+            raise ValueError(f"Unknown input variables: {', '.join(sorted(unknown))}")
+        return scenario_input(self.df_input, inputs)['Value'].astype(float).to_dict()
+
+    def submit(self, inputs, series = None):
+        """
+        Submit a scenario.
+
+        Parameters:
+        inputs (dict): Mapping from input variable to its value, the other variables keep their default values.
+        series (dict, optional): Time series to return, see simulate_batch. Defaults to None.
+
+        Returns:
+        Future: Its result is the response of the scenario, see simulate_batch.
+        """
+        if series is not None:
+            unknown = set(series.get('columns', [])) - set(POWER_FLOW_COLUMNS)
+            if unknown:
+                raise ValueError(f"Unknown series: {', '.join(sorted(unknown))}")
+            series = {'columns': list(series.get('columns', [])), 'points': series.get('points')}
+        future = Future()
+        self._queue.put((self.scenario_values(inputs), series, future))
+        return future
+
+    def simulate(self, inputs, series = None, timeout = None):
+        """Submit a scenario and wait for its response, see submit."""
+        return self.submit(inputs, series).result(timeout)
+
+    def _collect(self):
+        # Collect the waiting requests into batches and start them, as long as a slot is free
+        while True:
+            pending = [self._queue.get()]
+            if pending[0] is None:
+                return
+            deadline = time.monotonic() + self.max_wait
+            while len(pending) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout = max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None) # Stop after this batch
+                    break
+                pending.append(item)
+            self._slots.acquire()
+            self.requests += len(pending)
+            self.batches += 1
+            self._start(pending)
+
+    def _start(self, pending):
+        inputs = [values for values, _, _ in pending]
+        series = [requested for _, requested, _ in pending]
+        futures = [future for _, _, future in pending]
+
+        def finish(batch):
+            # Hand the responses (or the error) of the batch to the requests
+            self._slots.release()
+            try:
+                responses = batch.result()
+            except Exception as error:
+                for future in futures:
+                    future.set_exception(error)
+                return
+            for future, response in zip(futures, responses):
+                future.set_result(response)
+
+        if self._executor is not None:
+            self._executor.submit(_simulate_worker_batch, inputs, series).add_done_callback(finish)
+        else: # Run in this thread, the next requests wait in the queue and form the next batch
+            batch = Future()
+            try:
+                batch.set_result(simulate_batch(inputs, series, self.df_profiles))
+            except Exception as error:
+                batch.set_exception(error)
+            finish(batch)
+
+    def close(self):
+        """Stop the service once the submitted requests are done."""
+        self._queue.put(None)
+        self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown()
+
+
+def make_handler(service):
+    """
+    Create the HTTP request handler of a service.
+
+    Parameters:
+    service (SimulationService): The service running the simulations.
+
+    Returns:
+    type: The handler class, for http.server.ThreadingHTTPServer (one thread per request, so concurrent requests are batched).
+    """
+    class SimulationHandler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path != '/status':
+                return self._reply(404, {'error': f"Unknown path {self.path}"})
+            self._reply(200, {'requests': service.requests, 'batches': service.batches, 'timesteps': len(service.df_profiles)})
+
+        def do_POST(self):
+            if self.path != '/simulate':
+                return self._reply(404, {'error': f"Unknown path {self.path}"})
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                scenarios = payload['scenarios'] if 'scenarios' in payload else [payload]
+                futures = [service.submit(scenario.get('inputs', {}), scenario.get('series')) for scenario in scenarios]
+            except (ValueError, KeyError, TypeError, AttributeError) as error:
+                return self._reply(400, {'error': str(error)})
+            try:
+                responses = [future.result() for future in futures]
+            except Exception as error:
+                return self._reply(500, {'error': str(error)})
+            self._reply(200, {'results': responses} if 'scenarios' in payload else responses[0])
+
+        def log_message(self, format, *args):
+            pass # No line per request on stderr
+
+    return SimulationHandler
+
+
+def request_simulation(url, inputs, series = None, timeout = 60):
+    """
+    Request a simulation from a running service, e.g. from the dashboard.
+
+    Parameters:
+    url (str): The address of the service, e.g. 'http://localhost:8510'.
+    inputs (dict): Mapping from input variable to its value.
+    series (dict, optional): Time series to return, see simulate_batch. Defaults to None.
+    timeout (float, optional): Timeout in seconds. Defaults to 60.
+
+    Returns:
+    dict: The response, see simulate_batch.
+    """
+    body = {'inputs': inputs} if series is None else {'inputs': inputs, 'series': series}
+    request = urllib.request.Request(url.rstrip('/') + '/simulate', data = json.dumps(body).encode(),
+                                     headers = {'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout = timeout) as response:
+        return json.loads(response.read())
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = "Local HTTP service running power flow and economic simulations")
+    parser.add_argument('--host', default = 'localhost', help = "address to listen on")
+    parser.add_argument('--port', type = int, default = 8510, help = "port to listen on")
+    parser.add_argument('--profiles', default = 'Input_profiles', help = "profiles file without extension (.bin, written again when the .csv changes)")
+    parser.add_argument('--workers', type = int, default = 1, help = "worker processes running batches")
+    parser.add_argument('--max-batch', type = int, default = 16, help = "maximum number of scenarios per batch")
+    parser.add_argument('--max-wait', type = float, default = 0.01, help = "seconds to wait for more requests before running a batch")
+    args = parser.parse_args(args)
+
+    profiles = args.profiles if update_profiles_binary(args.profiles) else pd.read_csv(args.profiles + '.csv')
+    service = SimulationService(pickle_read('Input_variables'), profiles, args.workers, args.max_batch, args.max_wait)
+    service.simulate({}) # Compiling the engine before the first request
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"Simulation service on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    service.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
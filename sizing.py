@@ -0,0 +1,165 @@
+# In this module the sizes of the assets are optimised: the search minimises the yearly net cost under a constraint on the shortage
+import numpy as np
+import pandas as pd
+from results_cache import ResultStore, hash_profiles
+from powerflow import month_periods
+from sweep import prepare_profiles, run_scenario, scenario_input
+
+# Default search ranges: (minimum, maximum, step) of each size
+SIZING_BOUNDS = {
+    'pv_capacity': (0, 3000, 10),
+    'batt_energy_capacity': (0, 4000, 10),
+    'batt_power_capacity': (0, 2000, 10),
+    'gen1_capacity': (0, 1000, 10),
+    'gen2_capacity': (0, 1000, 10),
+    'gen3_capacity': (0, 1000, 10),
+    'grid_supply_capacity': (0, 2000, 10),
+}
+
+GENERATOR_CAPACITIES = ['gen1_capacity', 'gen2_capacity', 'gen3_capacity']
+
+
+def sizing_values(design):
+    """
+    Convert a design (sizes of the assets) into the values of a scenario, see sweep.scenario_input.
+    The generator capacities are sorted in decreasing order, so that the generators in use come first and number_generators
+    (used for the generator lease) is the number of generators with a capacity.
+
+    Parameters:
+    design (dict): Mapping from size variable to its value.
+
+    Returns:
+    dict: The scenario values.
+    """
+    values = dict(design)
+    generators = [key for key in GENERATOR_CAPACITIES if key in values]
+    if generators:
+        for key, capacity in zip(generators, sorted((values[key] for key in generators), reverse = True)):
+            values[key] = capacity
+        values['number_generators'] = sum(1 for key in generators if values[key] > 0)
+    return values
+
+
+def balance_bound(df_scenario, consumption_energy, pv_energy):
+    """
+    Upper bound of the balance of calculate_costs for a scenario, without running the power flow. The fixed costs and the
+    consumption revenue only depend on the inputs and the profiles, the variable costs (fuel and grid energy) are not negative,
+    and the PV energy fed into the grid is at most the PV production and the feed-in capacity at every timestep.
+
+    Parameters:
+    df_scenario (pd.DataFrame): The inputs of the scenario, see sweep.scenario_input.
+    consumption_energy (np.array): The 'Consumption (kWh)' profile.
+    pv_energy (np.array): The 'Production (kWh) per MWp' profile, without NaN.
+
+    Returns:
+    float: The bound in EUR, or np.inf if a price is negative (the variable costs could then be revenues).
+    """
+    df_in = df_scenario['Value']
+    if min(df_in['gen_fuel_price'], df_in['gen_fuel_consumption'], df_in['grid_energy_price'], df_in['grid_feedin_price']) < 0:
+        return np.inf
+    fixed_cost = (df_in['pv_lease'] * df_in['pv_capacity'] + df_in['batt_lease'] * df_in['batt_energy_capacity'] 
+                  + df_in['gen_lease'] * df_in['number_generators'] + df_in['grid_supply_capacity'] * df_in['capacity_cost'])
+    consumption_return = consumption_energy.sum() / 1000 * df_in['consumption_energy_price'] # As df_sum.consumption in MWh
+    pv_production = pv_energy * df_in['pv_capacity'] * df_in['pv_yield'] / 947.55 * 4 # In kW, before the limit of the PV capacity
+    grid_return = np.minimum(pv_production, max(df_in['grid_feedin_capacity'], 0.0)).sum() / 4000 * df_in['grid_feedin_price']
+    return consumption_return + grid_return - fixed_cost
+
+
+def _rank(summary, max_shortage):
+    # Feasible designs first, by net cost, then infeasible designs by shortage
+    if summary['shortage_consumption'] <= max_shortage:
+        return (0, - summary['balance'])
+    return (1, summary['shortage_consumption'])
+
+
+def optimise_sizing(df_input, df_profiles, bounds = None, max_shortage = 0.0, points = 5, shrink = 0.5, max_evaluations = 400, store_dir = None):
+    """
+    Search the sizes of the assets with the lowest yearly net cost (highest balance of calculate_costs), with a shortage of
+    consumption of at most max_shortage. The search is a coarse-to-fine coordinate search: each size in turn is evaluated on a
+    grid of points around the best design, and the grids shrink after every pass until they reach the step of each size.
+    Designs are evaluated once (results are kept in memory, and in a ResultStore if store_dir is given). Once a feasible design
+    is known, designs whose balance_bound is below its balance are pruned without running the power flow: they cannot have a
+    higher balance, feasible or not. The shortage is not used to prune: the dispatch depends on the sizes, so the shortage does
+    not always grow when a capacity decreases.
+
+    Parameters:
+    df_input (pd.DataFrame): The base input DataFrame. Its sizes are the starting design.
+    df_profiles (pd.DataFrame, str or ProfileHandle): The consumption and PV production profiles, see sweep.prepare_profiles.
+    bounds (dict, optional): Mapping from size variable to its (minimum, maximum, step). Only these sizes are searched. Defaults to SIZING_BOUNDS.
+    max_shortage (float, optional): Maximum yearly shortage of consumption in MWh. Defaults to 0.
+    points (int, optional): Number of grid points per size and pass. Defaults to 5.
+    shrink (float, optional): Factor by which the grids shrink after each pass. Defaults to 0.5.
+    max_evaluations (int, optional): Maximum number of power flow evaluations. Defaults to 400.
+    store_dir (str, optional): Directory of a ResultStore shared with sweeps and the dashboard. Defaults to None (no store).
+
+    Returns:
+    dict: 'design' (the best sizes, as scenario values for sweep.scenario_input), 'summary' (its annual summary, see
+        sweep.summarise_scenario), 'feasible' (whether it satisfies the shortage constraint), 'evaluations' (pd.DataFrame with
+        one row per evaluated or pruned design) and 'engine_calls' (the number of power flow evaluations).
+    """
+    bounds = SIZING_BOUNDS if bounds is None else bounds
+    variables = list(bounds)
+    lower = np.array([bounds[key][0] for key in variables], dtype = float)
+    upper = np.array([bounds[key][1] for key in variables], dtype = float)
+    step = np.array([bounds[key][2] if len(bounds[key]) > 2 else 1 for key in variables], dtype = float)
+
+    df_profiles, _ = prepare_profiles(df_profiles)
+    profiles_key = hash_profiles(df_profiles)
+    periods = month_periods(df_profiles)
+    store = ResultStore(store_dir) if store_dir is not None else None
+    consumption_energy = np.asarray(df_profiles['Consumption (kWh)'], dtype = float)
+    pv_energy = np.nan_to_num(np.asarray(df_profiles['Production (kWh) per MWp'], dtype = float), nan = 0.0)
+    evaluations = {} # design: (rank, summary, pruned)
+
+    def snap(values):
+        return tuple(np.clip(lower + np.round((np.asarray(values) - lower) / step) * step, lower, upper).tolist())
+
+    def evaluate(design, best_rank = None):
+        if design in evaluations:
+            return evaluations[design][0]
+        values = sizing_values(dict(zip(variables, design)))
+        if best_rank is not None and best_rank[0] == 0: # Pruned if it cannot beat the best feasible design
+            if balance_bound(scenario_input(df_input, values), consumption_energy, pv_energy) < - best_rank[1]:
+                evaluations[design] = ((1, np.inf), None, True)
+                return evaluations[design][0]
+        summary = run_scenario(df_input, df_profiles, values, store, profiles_key, periods)
+        rank = _rank(summary, max_shortage)
+        evaluations[design] = (rank, summary, False)
+        return rank
+
+    def engine_calls():
+        return sum(1 for _, _, pruned in evaluations.values() if not pruned)
+
+    df_in = df_input['Value']
+    best = snap([df_in[key] for key in variables])
+    best_rank = evaluate(best)
+    radius = (upper - lower) / 2 # Half width of the grids, the first pass covers the whole range
+    while engine_calls() < max_evaluations:
+        for i in range(len(variables)):
+            candidates = np.linspace(max(lower[i], best[i] - radius[i]), min(upper[i], best[i] + radius[i]), points)
+            for value in candidates:
+                design = snap(best[:i] + (value,) + best[i + 1:])
+                rank = evaluate(design, best_rank)
+                if rank < best_rank:
+                    best, best_rank = design, rank
+                if engine_calls() >= max_evaluations:
+                    break
+        if np.all(radius <= step):
+            break
+        radius = np.maximum(radius * shrink, step)
+
+    rows = []
+    for design, (rank, summary, pruned) in evaluations.items():
+        row = dict(zip(variables, design))
+        row['feasible'] = None if pruned else rank[0] == 0 # Not known for pruned designs
+        row['pruned'] = pruned
+        if summary is not None:
+            row.update(summary)
+        rows.append(row)
+    return {
+        'design': sizing_values(dict(zip(variables, best))),
+        'summary': evaluations[best][1],
+        'feasible': best_rank[0] == 0,
+        'evaluations': pd.DataFrame(rows),
+        'engine_calls': engine_calls(),
+    }
@@ -0,0 +1,217 @@
+# In this module sizing studies are carried out: grids of input scenarios are evaluated in parallel with a process pool
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import numpy as np
+from powerflow import calculate_power_flow_new, month_periods, PowerFlowSummary, ENGINE_VERSION
+from economic import calculate_costs
+from results_cache import ResultStore, hash_inputs, hash_profiles
+from helpers import read_profiles_binary
+from profile_library import ProfileHandle
+
+DEFAULT_GENERATOR_CAPACITY = 250 # Capacity in kW of the generators in use of a scenario when no generator has one (as in Input_variables.csv)
+
+# Base inputs and profiles of a worker process. They are set once per worker by _init_worker, so tasks only carry the scenario values
+_worker_input = None
+_worker_profiles = None
+_worker_store = None
+_worker_profiles_key = None
+_worker_periods = None
+
+
+def sweep_grid(grid):
+    """
+    Build the scenarios of a sizing study as all the combinations of the values of the chosen input variables.
+
+    Parameters:
+    grid (dict): Mapping from input variable (e.g. 'pv_capacity') to the list or array of values to evaluate.
+
+    Returns:
+    pd.DataFrame: One row per scenario and one column per variable of the grid.
+    """
+    keys = list(grid.keys())
+    return pd.DataFrame(list(itertools.product(*[list(grid[key]) for key in keys])), columns = keys)
+
+
+def scenario_input(df_input, values):
+    """
+    Create the df_input of a scenario by overwriting some input values.
+
+    Parameters:
+    df_input (pd.DataFrame): The base input DataFrame (e.g. read from Input_variables.csv).
+    values (dict): Mapping from input variable to its value in the scenario. If number_generators is given, the
+        generators up to that number keep the capacity given in values, or else the one of df_input. Generators in use
+        without capacity get the largest capacity of the other generators, or DEFAULT_GENERATOR_CAPACITY if none has one.
+        The capacity of the generators beyond that number is set to 0, as in the dashboard.
+
+    Returns:
+    pd.DataFrame: A copy of df_input with the scenario values.
+    """
+    df_scenario = df_input.copy()
+    for key, value in values.items():
+        df_scenario.loc[key, 'Value'] = value
+    if 'number_generators' in values:
+        number_generators = int(values['number_generators'])
+        capacities = [df_scenario.loc[f'gen{k}_capacity', 'Value'] for k in range(1, 4)]
+        default_capacity = max(capacities) if max(capacities) > 0 else DEFAULT_GENERATOR_CAPACITY
+        for k in range(1, number_generators + 1):
+            if not capacities[k - 1] > 0:
+                df_scenario.loc[f'gen{k}_capacity', 'Value'] = default_capacity
+        for k in range(number_generators + 1, 4):
+            df_scenario.loc[f'gen{k}_capacity', 'Value'] = 0
+    return df_scenario
+
+
+def summarise_scenario(df_input, power_flow_summary, df_cost_balance):
+    """
+    Reduce the results of a scenario to its annual summary.
+
+    Parameters:
+    df_input (pd.DataFrame): The inputs of the scenario.
+    power_flow_summary (PowerFlowSummary or dict): The summary record of the power flows, output of calculate_power_flow_new(..., output = 'summary').
+    df_cost_balance (pd.DataFrame): The costs and revenues of the scenario, output of calculate_costs.
+
+    Returns:
+    dict: Yearly energy of each power flow in MWh, generator and shortage hours, fuel consumption, and yearly cost, revenue and balance in EUR.
+    """
+    df_in = df_input['Value']
+    if isinstance(power_flow_summary, PowerFlowSummary):
+        summary = power_flow_summary.annual_totals() # Sum of all energy flows in MWh
+    else:
+        summary = power_flow_summary['annual'].to_dict()
+    summary['gen_hours'] = power_flow_summary['gen_hours']
+    summary['shortage_hours'] = power_flow_summary['shortage_hours']
+    summary['gen_fuel'] = df_in['gen_fuel_consumption'] * summary['gen_hours']
+    summary['total_cost'] = df_cost_balance.loc['Fixed cost'].sum() + df_cost_balance.loc['Variable cost'].sum()
+    summary['total_revenue'] = df_cost_balance.loc['Variable revenue'].sum()
+    summary['balance'] = summary['total_cost'] + summary['total_revenue']
+    return summary
+
+
+def run_scenario(df_input, df_profiles, values, store = None, profiles_key = None, periods = None):
+    """
+    Run the power flow and the economic calculations of one scenario.
+
+    Parameters:
+    df_input (pd.DataFrame): The base input DataFrame.
+    df_profiles (pd.DataFrame): The consumption and PV production profiles.
+    values (dict): The input values of the scenario, see scenario_input.
+    store (ResultStore, optional): Store of results on disk. Scenarios already in the store are not recomputed. Defaults to None.
+    profiles_key (str, optional): hash_profiles of df_profiles, computed if not given.
+    periods (tuple, optional): powerflow.month_periods of df_profiles, computed if not given.
+
+    Returns:
+    dict: The annual summary of the scenario, see summarise_scenario.
+    """
+    df_scenario = scenario_input(df_input, values)
+    if store is not None:
+        key = ('summary', ENGINE_VERSION, hash_inputs(df_scenario), profiles_key or hash_profiles(df_profiles))
+        summary = store.get(key)
+        if summary is not None:
+            return summary
+    
+    power_flow_summary = calculate_power_flow_new(df_scenario, df_profiles, output = 'summary', periods = periods) # Only running totals, no time series
+    df_cost_balance = calculate_costs(df_scenario, power_flow_summary)
+    summary = summarise_scenario(df_scenario, power_flow_summary, df_cost_balance)
+    if store is not None:
+        store.put(key, summary)
+    return summary
+
+
+def _init_worker(df_input, profiles, store_dir, profiles_key):
+    # Keep the base inputs, the profiles and the result store in the worker for all its tasks. 
+    # profiles is the name of a binary profile file or a ProfileHandle, memory-mapped by every worker, or a dict of profile arrays
+    global _worker_input, _worker_profiles, _worker_store, _worker_profiles_key, _worker_periods
+    _worker_input = df_input
+    if isinstance(profiles, str):
+        _worker_profiles = read_profiles_binary(profiles)
+    elif isinstance(profiles, dict):
+        _worker_profiles = pd.DataFrame(profiles)
+    else:
+        _worker_profiles = profiles
+    _worker_store = ResultStore(store_dir) if store_dir is not None else None
+    _worker_profiles_key = profiles_key
+    _worker_periods = month_periods(_worker_profiles)
+
+
+def _run_worker_scenario(values):
+    return run_scenario(_worker_input, _worker_profiles, values, _worker_store, _worker_profiles_key, _worker_periods)
+
+
+def prepare_profiles(df_profiles):
+    """
+    Prepare the profiles of a study once for all its scenarios. The months of the timesteps are then found once per process
+    with powerflow.month_periods, see run_scenario.
+
+    Parameters:
+    df_profiles (pd.DataFrame, str or ProfileHandle): The profiles, the name of a binary profile file (see helpers.profiles_to_binary) 
+        or a profile_library.ProfileHandle.
+
+    Returns:
+    tuple: The profiles with parsed times, and what to send to worker processes (file name, handle or dict of profile arrays, see _init_worker).
+    """
+    if isinstance(df_profiles, str):
+        return read_profiles_binary(df_profiles), df_profiles
+    if isinstance(df_profiles, ProfileHandle):
+        return df_profiles, df_profiles
+    df_profiles = df_profiles.copy()
+    df_profiles['Time'] = pd.to_datetime(df_profiles['Time']) # Parsed once here instead of in every scenario
+    return df_profiles, {column: df_profiles[column].to_numpy() for column in ['Time', 'Consumption (kWh)', 'Production (kWh) per MWp']}
+
+
+def iter_sweep(df_input, df_profiles, scenarios, workers = None, store_dir = None):
+    """
+    Evaluate the scenarios of a sizing study in parallel and yield their summaries as they are computed, in the order of the 
+    scenarios, so that large studies can be reduced on the fly (e.g. to a Pareto front) without keeping every result.
+
+    Parameters:
+    See run_sweep. scenarios is a list of dicts of scenario values, or a DataFrame or dict as in run_sweep.
+
+    Yields:
+    dict: The annual summary of each scenario, see summarise_scenario.
+    """
+    if isinstance(scenarios, dict):
+        scenarios = sweep_grid(scenarios)
+    if isinstance(scenarios, pd.DataFrame):
+        scenarios = scenarios.to_dict('records')
+    if workers is None:
+        workers = os.cpu_count() or 1
+    df_profiles, profiles = prepare_profiles(df_profiles)
+    profiles_key = hash_profiles(df_profiles)
+
+    if workers == 1:
+        store = ResultStore(store_dir) if store_dir is not None else None
+        periods = month_periods(df_profiles)
+        for values in scenarios:
+            yield run_scenario(df_input, df_profiles, values, store, profiles_key, periods)
+    else:
+        chunksize = max(1, len(scenarios) // (workers * 4)) # A few chunks per worker to balance the load
+        with ProcessPoolExecutor(max_workers = workers, initializer = _init_worker,
+                                 initargs = (df_input, profiles, store_dir, profiles_key)) as executor:
+            yield from executor.map(_run_worker_scenario, scenarios, chunksize = chunksize)
+
+
+def run_sweep(df_input, df_profiles, scenarios, workers = None, store_dir = None):
+    """
+    Evaluate the scenarios of a sizing study in parallel, one process per core.
+
+    Parameters:
+    df_input (pd.DataFrame): The base input DataFrame (e.g. read from Input_variables.csv).
+    df_profiles (pd.DataFrame, str or ProfileHandle): The consumption and PV production profiles, sent once to each worker, or the 
+        name of a binary profile file (see helpers.profiles_to_binary) or a profile_library.ProfileHandle that each worker memory-maps.
+    scenarios (pd.DataFrame or dict): The scenarios, one row per scenario and one column per input variable (see sweep_grid).
+        A dict is expanded with sweep_grid.
+    workers (int, optional): Number of worker processes. Defaults to the number of cores. With 1 the scenarios run in this process.
+    store_dir (str, optional): Directory of a ResultStore shared with other sweeps and the dashboard. Scenarios found there are 
+        not recomputed and new results are added. Defaults to None (no store).
+
+    Returns:
+    pd.DataFrame: One row per scenario with its input values followed by its annual summary.
+    """
+    if isinstance(scenarios, dict):
+        scenarios = sweep_grid(scenarios)
+    summaries = list(iter_sweep(df_input, df_profiles, scenarios, workers, store_dir))
+
+    df_summary = pd.DataFrame(summaries, index = scenarios.index)
+    return pd.concat([scenarios, df_summary], axis = 1)
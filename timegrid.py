@@ -0,0 +1,87 @@
+# In this module the times of the profiles are mapped once to row positions: repeated times (end of summer time) are dropped,
+# rows without time are moved to the end and the position of the first timestep of every day is stored. A window of days is
+# then found in constant time and read as a slice of the results, instead of looking up every day by its date string.
+import numpy as np
+import pandas as pd
+
+_NS_PER_DAY = 24 * 3600 * 10**9
+
+
+class TimeGrid:
+    """
+    Row positions of the times of the profiles, built once per profiles.
+
+    Parameters:
+    times (pd.Series or pd.DatetimeIndex): The times of the profiles (e.g. the parsed 'Time' column), one per row of df_out.
+    """
+
+    def __init__(self, times):
+        times = pd.DatetimeIndex(np.asarray(pd.DatetimeIndex(times), dtype = 'datetime64[ns]')) # In nanoseconds, as _NS_PER_DAY
+        self.length = len(times)
+        kept = np.flatnonzero(~times.duplicated(keep = 'first')) # Repeated times are shown once, their first occurrence
+        timed = kept[times[kept].notna()]
+        timed = timed[np.argsort(times.asi8[timed], kind = 'stable')] # Already in order for the profiles
+        self.rows = np.concatenate([timed, kept[times[kept].isna()]]) # Rows of df_out kept, the ones without time at the end
+        self.size = len(timed) # Number of rows with a time
+        self.times = times[timed]
+        self.first_day = self.times[0].normalize() if self.size else pd.NaT
+        days = (self.times.asi8 - self.first_day.value) // _NS_PER_DAY if self.size else np.zeros(0, dtype = np.int64)
+        last_day = days[-1] if self.size else -1
+        self.day_offsets = np.searchsorted(days, np.arange(last_day + 2)) # Position of the first timestep of each day, then the end
+
+    def select(self, df):
+        """
+        Return the kept rows of a DataFrame with one row per time of the profiles (e.g. df_out), in the order of the positions.
+
+        Parameters:
+        df (pd.DataFrame): The DataFrame, with one row per time.
+
+        Returns:
+        pd.DataFrame: The rows without repeated times, the rows without time last. df itself if no row is dropped or moved.
+        """
+        if len(df) != self.length:
+            raise ValueError(f"{len(df)} rows for {self.length} times")
+        if np.array_equal(self.rows, np.arange(self.length)):
+            return df
+        return df.iloc[self.rows]
+
+    def offset(self, day):
+        """
+        Return the position of the first timestep of a day, in constant time.
+
+        Parameters:
+        day (datetime-like): The day. Days before the first one give 0, days after the last one give the number of timed rows.
+
+        Returns:
+        int: The position in the rows returned by select.
+        """
+        k = (pd.Timestamp(day).normalize() - self.first_day).days
+        return int(self.day_offsets[min(max(k, 0), len(self.day_offsets) - 1)])
+
+    def window(self, start_date, end_date):
+        """
+        Return the positions of a window of days.
+
+        Parameters:
+        start_date (datetime-like): The first day of the window.
+        end_date (datetime-like): The last day of the window (included).
+
+        Returns:
+        tuple: The position of the first timestep of the window and the position after its last one.
+        """
+        return self.offset(start_date), self.offset(pd.Timestamp(end_date) + pd.Timedelta(days = 1))
+
+    def slice(self, df_selected, start_date, end_date):
+        """
+        Return a window of days of a DataFrame returned by select, as a slice without copy.
+
+        Parameters:
+        df_selected (pd.DataFrame): The DataFrame returned by select.
+        start_date (datetime-like): The first day of the window.
+        end_date (datetime-like): The last day of the window (included).
+
+        Returns:
+        pd.DataFrame: The rows of the window.
+        """
+        start, stop = self.window(start_date, end_date)
+        return df_selected.iloc[start:stop]